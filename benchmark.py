@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+PMM Benchmarks
+Time SimplePMM tasks against the local mock Plex server and compare the
+results with a saved baseline
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from mock_plex import MockPlexServer, existing_collections, synthetic_sections
+
+REPO_ROOT = Path(__file__).resolve().parent
+DEFAULT_BASELINE = REPO_ROOT / 'benchmark_baseline.json'
+
+# Cases run in this order against one server per size; the warm case reuses
+# the cold case's state store to measure a steady-state nightly run
+CASES = [
+    ('create_collections_cold', 'create_collections', True),
+    ('create_collections_warm', 'create_collections', False),
+    ('scan_library', 'scan_library', False),
+    ('run_maintenance', 'run_maintenance', False),
+]
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process in KB, or None if unavailable"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run_worker(task):
+    """Run one SimplePMM task in this process and print its timings as JSON"""
+    sys.path.insert(0, str(REPO_ROOT))
+    import pmm
+
+    instance = pmm.SimplePMM()
+    started = time.perf_counter()
+    getattr(instance, task)()
+    print(json.dumps({'wall_seconds': time.perf_counter() - started, 'peak_rss_kb': peak_rss_kb()}))
+
+
+def run_case(server, task, state_db, workdir):
+    """Run a task in a fresh interpreter and attach the server's request stats"""
+    env = dict(os.environ)
+    env.update({
+        'PLEX_URL': server.url,
+        'PLEX_TOKEN': server.token,
+        'PMM_CONFIG_PATH': str(REPO_ROOT / 'config'),
+        'PMM_STATE_DB': str(state_db),
+        'PMM_LOG_LEVEL': 'WARNING',
+        'AUTO_RUN_ENABLED': 'false',
+    })
+    server.reset(stats_only=True)
+    completed = subprocess.run(
+        [sys.executable, str(Path(__file__).resolve()), '--worker', task],
+        cwd=workdir, env=env, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"{task} failed:\n{completed.stderr}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    stats = server.stats()
+    result['http_requests'] = stats['total_requests']
+    result['requests_by_endpoint'] = stats['requests']
+    return result
+
+
+def size_label(size, genres=None, studios=None, existing=0):
+    """Results key for a size; non-default pools get their own baseline entries"""
+    knobs = [f"{name}={value}" for name, value in
+             (('genres', genres), ('studios', studios), ('existing', existing)) if value]
+    return ' '.join([str(size)] + knobs)
+
+
+def run_benchmarks(sizes, shows_ratio, latency, genres=None, studios=None, existing=0):
+    """Run every case for every library size; return {size label: {case: result}}
+
+    genres and studios size the mock's value pools and existing pre-seeds
+    that many stale collections per library, which the cold case updates.
+    """
+    results = {}
+    for size in sizes:
+        label = size_label(size, genres, studios, existing)
+        print(f"\n== {size} movies / {int(size * shows_ratio)} shows ({label}) ==")
+        sections = synthetic_sections(size, int(size * shows_ratio), genres=genres, studios=studios)
+        with MockPlexServer(sections, existing_collections(sections, existing), latency=latency) as server, \
+                tempfile.TemporaryDirectory(prefix='pmm-bench-') as workdir:
+            state_db = Path(workdir) / 'pmm_state.db'
+            results[label] = {}
+            for name, task, cold in CASES:
+                if cold:
+                    server.reset()
+                    state_db.unlink(missing_ok=True)
+                result = run_case(server, task, state_db, workdir)
+                results[label][name] = result
+                print(f"  {name:<26} {result['wall_seconds']:8.2f}s  "
+                      f"{result['peak_rss_kb'] or 0:>9} KB  {result['http_requests']:>7} requests")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions against the baseline"""
+    regressions = []
+    for size, cases in results.items():
+        for name, result in cases.items():
+            base = baseline.get(size, {}).get(name)
+            if not base:
+                continue
+            for metric, limit in (('wall_seconds', 1 + tolerance), ('peak_rss_kb', 1 + tolerance),
+                                  ('http_requests', 1.0)):
+                if result.get(metric) is None or base.get(metric) is None:
+                    continue
+                if result[metric] > base[metric] * limit:
+                    regressions.append(f"{size}/{name}: {metric} {result[metric]:.2f} > baseline {base[metric]:.2f}")
+    return regressions
+
+
+def main():
+    """Run the benchmark suite"""
+    parser = argparse.ArgumentParser(description='Benchmark SimplePMM against a mock Plex server')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                        help='movie library sizes to benchmark (1k to 500k)')
+    parser.add_argument('--shows-ratio', type=float, default=0.2,
+                        help='TV library size as a fraction of the movie library')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='artificial per-request latency')
+    parser.add_argument('--genres', type=int, help='distinct genres in the mock libraries')
+    parser.add_argument('--studios', type=int, help='distinct studios in the mock libraries')
+    parser.add_argument('--existing-collections', type=int, default=0,
+                        help='pre-seed this many stale genre/studio collections per library')
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='write results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative slowdown/growth before a regression is reported')
+    parser.add_argument('--output', type=Path, help='also write results as JSON to this file')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker)
+        return 0
+
+    results = run_benchmarks(args.sizes, args.shows_ratio, args.latency_ms / 1000,
+                             args.genres, args.studios, args.existing_collections)
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2), encoding='utf-8')
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2), encoding='utf-8')
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+    if args.baseline.exists():
+        regressions = compare(results, json.loads(args.baseline.read_text(encoding='utf-8')), args.tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for regression in regressions:
+                print(f"  ✗ {regression}")
+            return 1
+        print("\n✓ No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
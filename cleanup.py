@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+PMM Temp Cleanup
+Walk temp and transcode directories in parallel and delete files by age,
+glob and size-quota policies without holding file lists in memory
+"""
+
+import fnmatch
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Quota accounting groups files by modification time into buckets this wide;
+# a quota pass may overshoot by at most one bucket's worth of files
+QUOTA_BUCKET_SECONDS = 60
+
+# Directories currently being cleaned in this process, so servers sharing a
+# cleanup configuration don't clean the same directory at once
+_active = set()
+_active_lock = threading.Lock()
+
+
+def parallel_walk(root, visit, workers=4):
+    """Call visit(path, stat_result) for every file under root
+
+    Directories are scanned with os.scandir on ``workers`` threads, so
+    visit must be thread-safe. Symlinks are never followed. Returns the
+    number of directories that could not be read.
+    """
+    pending = queue.SimpleQueue()
+    pending.put(root)
+    state = {'outstanding': 1, 'errors': 0}
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            path = pending.get()
+            if path is None:
+                return
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                with lock:
+                                    state['outstanding'] += 1
+                                pending.put(entry.path)
+                            else:
+                                visit(entry.path, entry.stat(follow_symlinks=False))
+                        except OSError as e:
+                            logger.debug(f"Skipping {entry.path}: {e}")
+            except OSError as e:
+                logger.warning(f"Cannot read {path}: {e}")
+                with lock:
+                    state['errors'] += 1
+            finally:
+                with lock:
+                    state['outstanding'] -= 1
+                    finished = state['outstanding'] == 0
+                if finished:
+                    for _ in range(workers):
+                        pending.put(None)
+
+    threads = [threading.Thread(target=worker, name=f'pmm-cleanup-{index}', daemon=True)
+               for index in range(max(1, workers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return state['errors']
+
+
+class CleanupPolicy:
+    """What may be deleted from one directory tree
+
+    Files matching ``include`` but not ``exclude`` (globs against the file
+    name or its path relative to the root) and untouched for at least
+    ``min_age_minutes`` are deleted once older than ``max_age_hours``.
+    If the tree is still above ``max_size_gb``, the oldest of them are
+    deleted until it is under quota.
+    """
+
+    def __init__(self, path, max_age_hours=None, max_size_gb=None, include=('*',), exclude=(),
+                 min_age_minutes=10, remove_empty_dirs=False):
+        self.path = os.path.abspath(os.path.expanduser(str(path)))
+        self.max_age = float(max_age_hours) * 3600 if max_age_hours else None
+        self.max_bytes = int(float(max_size_gb) * 1024 ** 3) if max_size_gb else None
+        self.include = [include] if isinstance(include, str) else list(include or ['*'])
+        self.exclude = [exclude] if isinstance(exclude, str) else list(exclude or [])
+        self.min_age = float(min_age_minutes) * 60
+        self.remove_empty_dirs = bool(remove_empty_dirs)
+
+    def matches(self, path):
+        """Whether the globs allow deleting this file"""
+        name = os.path.basename(path)
+        relative = os.path.relpath(path, self.path).replace(os.sep, '/')
+
+        def matched(patterns):
+            return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative, pattern)
+                       for pattern in patterns)
+
+        return matched(self.include) and not matched(self.exclude)
+
+
+class CleanupStats:
+    """Thread-safe counters for one directory's cleanup"""
+
+    def __init__(self, path):
+        self.path = path
+        self.scanned_files = 0
+        self.scanned_bytes = 0
+        self.deleted_files = 0
+        self.deleted_bytes = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def scanned(self, size):
+        with self._lock:
+            self.scanned_files += 1
+            self.scanned_bytes += size
+
+    def deleted(self, size):
+        with self._lock:
+            self.deleted_files += 1
+            self.deleted_bytes += size
+
+    def failed(self):
+        with self._lock:
+            self.errors += 1
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    def as_dict(self):
+        elapsed = max(self.elapsed, 1e-6)
+        return {
+            'path': self.path,
+            'scanned_files': self.scanned_files,
+            'scanned_bytes': self.scanned_bytes,
+            'deleted_files': self.deleted_files,
+            'deleted_bytes': self.deleted_bytes,
+            'errors': self.errors,
+            'seconds': round(self.elapsed, 3),
+            'files_per_second': round(self.scanned_files / elapsed, 1),
+        }
+
+
+class CleanupEngine:
+    """Apply cleanup policies, optionally as a dry run
+
+    Every deletion (or would-be deletion) is reported to ``decision_log``,
+    a JSON-lines file written as decisions are made.
+    """
+
+    def __init__(self, policies, workers=4, dry_run=False, decision_log=None):
+        self.policies = list(policies)
+        self.workers = max(1, int(workers))
+        self.dry_run = bool(dry_run)
+        self.decision_log = decision_log
+        self._log_file = None
+        self._log_lock = threading.Lock()
+
+    def run(self):
+        """Clean every policy's directory in turn; return a list of per-directory stats dicts"""
+        results = []
+        if self.decision_log:
+            os.makedirs(os.path.dirname(os.path.abspath(self.decision_log)), exist_ok=True)
+            self._log_file = open(self.decision_log, 'a', encoding='utf-8')
+        try:
+            for policy in self.policies:
+                stats = self.clean(policy)
+                if stats is not None:
+                    results.append(stats.as_dict())
+        finally:
+            if self._log_file is not None:
+                self._log_file.close()
+                self._log_file = None
+        return results
+
+    def clean(self, policy):
+        """Clean one directory; return its CleanupStats, or None if it was skipped"""
+        if not os.path.isdir(policy.path):
+            logger.warning(f"Cleanup directory not found: {policy.path}")
+            return None
+        with _active_lock:
+            if policy.path in _active:
+                logger.info(f"{policy.path} is already being cleaned, skipping")
+                return None
+            _active.add(policy.path)
+        try:
+            return self._clean(policy)
+        finally:
+            with _active_lock:
+                _active.discard(policy.path)
+
+    def _clean(self, policy):
+        stats = CleanupStats(policy.path)
+        now = time.time()
+        touched_dirs = set()
+        # Bytes of deletable files left after the age pass, by mtime bucket
+        buckets = {}
+        remaining = {'bytes': 0}
+        lock = threading.Lock()
+
+        def age_pass(path, stat):
+            stats.scanned(stat.st_size)
+            age = now - stat.st_mtime
+            deletable = age >= policy.min_age and policy.matches(path)
+            if deletable and policy.max_age is not None and age > policy.max_age:
+                if self._delete(path, stat, 'age', stats):
+                    touched_dirs.add(os.path.dirname(path))
+                    return
+            with lock:
+                remaining['bytes'] += stat.st_size
+                if deletable:
+                    bucket = int(stat.st_mtime // QUOTA_BUCKET_SECONDS)
+                    buckets[bucket] = buckets.get(bucket, 0) + stat.st_size
+
+        stats.errors += parallel_walk(policy.path, age_pass, self.workers)
+
+        excess = remaining['bytes'] - policy.max_bytes if policy.max_bytes is not None else 0
+        if excess > 0:
+            cutoff = None
+            freed = 0
+            for bucket in sorted(buckets):
+                cutoff = bucket
+                freed += buckets[bucket]
+                if freed >= excess:
+                    break
+            if freed < excess:
+                logger.warning(f"{policy.path}: only {freed / 1024 ** 2:.1f} MB of "
+                               f"{excess / 1024 ** 2:.1f} MB over quota may be deleted")
+
+            def quota_pass(path, stat):
+                age = now - stat.st_mtime
+                if policy.max_age is not None and age > policy.max_age:
+                    return  # Already handled (or, in a dry run, reported) by the age pass
+                if (int(stat.st_mtime // QUOTA_BUCKET_SECONDS) <= cutoff
+                        and age >= policy.min_age and policy.matches(path)):
+                    if self._delete(path, stat, 'quota', stats):
+                        touched_dirs.add(os.path.dirname(path))
+
+            if cutoff is not None:
+                stats.errors += parallel_walk(policy.path, quota_pass, self.workers)
+
+        if policy.remove_empty_dirs and not self.dry_run:
+            self._remove_empty_dirs(policy.path, touched_dirs)
+
+        stats.finish()
+        logger.info(f"{'Dry run: would reclaim' if self.dry_run else 'Reclaimed'} "
+                    f"{stats.deleted_bytes / 1024 ** 2:.1f} MB in {stats.deleted_files} files from {policy.path} "
+                    f"({stats.scanned_files} files scanned in {stats.elapsed:.2f}s, "
+                    f"{stats.scanned_files / max(stats.elapsed, 1e-6):.0f} files/s)")
+        return stats
+
+    def _delete(self, path, stat, reason, stats):
+        """Delete (or in a dry run, only report) a file; return whether it is gone"""
+        if not self.dry_run:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                return False
+            except OSError as e:
+                logger.debug(f"Cannot delete {path}: {e}")
+                stats.failed()
+                return False
+        stats.deleted(stat.st_size)
+        self._report(path, stat, reason)
+        return True
+
+    def _report(self, path, stat, reason):
+        logger.debug(f"{'Would delete' if self.dry_run else 'Deleted'} {path} ({reason})")
+        if self._log_file is not None:
+            line = json.dumps({
+                'action': 'would_delete' if self.dry_run else 'delete',
+                'reason': reason,
+                'path': path,
+                'bytes': stat.st_size,
+                'mtime': stat.st_mtime,
+                'at': time.time(),
+            })
+            with self._log_lock:
+                self._log_file.write(line + '\n')
+
+    def _remove_empty_dirs(self, root, touched_dirs):
+        """Remove directories emptied by the cleanup, deepest first, keeping root"""
+        candidates = set()
+        for directory in touched_dirs:
+            while directory != root and directory.startswith(root + os.sep):
+                candidates.add(directory)
+                directory = os.path.dirname(directory)
+        for directory in sorted(candidates, key=len, reverse=True):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+
+
+def engine_from_config(cleanup_config, dry_run=None):
+    """Build a CleanupEngine from the ``cleanup`` section, or None without directories"""
+    cleanup_config = cleanup_config or {}
+    directories = cleanup_config.get('directories') or []
+    if not cleanup_config.get('enabled', True) or not directories:
+        return None
+    policies = [CleanupPolicy(**entry) if isinstance(entry, dict) else CleanupPolicy(entry)
+                for entry in directories]
+    return CleanupEngine(
+        policies,
+        workers=int(cleanup_config.get('workers', 4)),
+        dry_run=cleanup_config.get('dry_run', False) if dry_run is None else dry_run,
+        decision_log=cleanup_config.get('decision_log'),
+    )
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+PMM Library Events
+Turn Plex notification websocket alerts into debounced batches of added,
+changed and deleted library items
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LIBRARY_IDENTIFIER = 'com.plexapp.plugins.library'
+
+# Timeline entry metadata types PMM builds collections from (movie, show)
+WATCHED_TYPES = {1, 2}
+
+# Timeline states: 5 = item processed, 9 = item deleted. Earlier states
+# (created, matching, downloading metadata) are followed by a 5.
+STATE_PROCESSED = 5
+STATE_DELETED = 9
+
+
+def parse_timeline(data):
+    """Yield (section_key, rating_key, deleted) for library timeline entries"""
+    if data.get('type') != 'timeline':
+        return
+    for entry in data.get('TimelineEntry', []):
+        if entry.get('identifier') != LIBRARY_IDENTIFIER:
+            continue
+        if int(entry.get('type', -1)) not in WATCHED_TYPES:
+            continue
+        state = int(entry.get('state', -1))
+        if state not in (STATE_PROCESSED, STATE_DELETED):
+            continue
+        # Collections show up as metadata items too; they carry no section
+        section_key = entry.get('sectionID')
+        if section_key in (None, '', '-1'):
+            continue
+        yield str(section_key), int(entry['itemID']), state == STATE_DELETED
+
+
+class ChangeBatcher:
+    """Debounce item events into {section_key: (changed keys, deleted keys)} batches"""
+
+    def __init__(self, debounce=30.0, max_delay=300.0):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._changed = {}
+        self._deleted = {}
+        self._first_event = None
+        self._last_event = None
+
+    def add(self, section_key, rating_key, deleted=False):
+        now = time.monotonic()
+        with self._lock:
+            if deleted:
+                self._deleted.setdefault(section_key, set()).add(rating_key)
+                self._changed.get(section_key, set()).discard(rating_key)
+            else:
+                self._changed.setdefault(section_key, set()).add(rating_key)
+                self._deleted.get(section_key, set()).discard(rating_key)
+            self._first_event = self._first_event or now
+            self._last_event = now
+
+    def requeue(self, section_key, changed, deleted):
+        """Put back a batch that failed to apply, unless newer events superseded its items"""
+        with self._lock:
+            pending = self._changed.get(section_key, set()) | self._deleted.get(section_key, set())
+        for rating_key in changed:
+            if rating_key not in pending:
+                self.add(section_key, rating_key)
+        for rating_key in deleted:
+            if rating_key not in pending:
+                self.add(section_key, rating_key, deleted=True)
+
+    def handle_alert(self, data):
+        """AlertListener callback"""
+        for section_key, rating_key, deleted in parse_timeline(data):
+            self.add(section_key, rating_key, deleted)
+
+    def pop_due(self, now=None):
+        """Return the pending batch once events have gone quiet, else {}"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self._last_event is None:
+                return {}
+            quiet = now - self._last_event >= self.debounce
+            overdue = now - self._first_event >= self.max_delay
+            if not (quiet or overdue):
+                return {}
+            changed, deleted = self._changed, self._deleted
+            self._changed, self._deleted = {}, {}
+            self._first_event = self._last_event = None
+
+        return {
+            section_key: (sorted(changed.get(section_key, ())), sorted(deleted.get(section_key, ())))
+            for section_key in set(changed) | set(deleted)
+            if changed.get(section_key) or deleted.get(section_key)
+        }
+
+
+class LibraryEventListener:
+    """Keep an AlertListener connected and feed debounced batches to on_batch
+
+    ``on_batch(section_key, changed_keys, deleted_keys)`` runs on a single
+    dispatcher thread, so batches never overlap each other. A batch that
+    fails is retried with the next one, up to ``max_attempts`` times; then
+    ``on_dropped(section_key)`` is called so the library can be resynced.
+    """
+
+    def __init__(self, plex, on_batch, debounce=30.0, max_delay=300.0, reconnect_delay=30.0,
+                 max_attempts=3, on_dropped=None):
+        self.plex = plex
+        self.on_batch = on_batch
+        self.on_dropped = on_dropped
+        self.batcher = ChangeBatcher(debounce, max_delay)
+        self.reconnect_delay = reconnect_delay
+        self.max_attempts = max(1, int(max_attempts))
+        # Section key -> failed attempts of its pending changes
+        self._failures = {}
+        self._stop = threading.Event()
+        self._listener = None
+        self._thread = None
+
+    def _connect(self):
+        self._listener = self.plex.startAlertListener(
+            callback=self.batcher.handle_alert,
+            callbackError=lambda error: logger.warning(f"Plex alert listener error: {error}"),
+        )
+
+    def _run(self):
+        next_connect = 0.0
+        while not self._stop.wait(1.0):
+            if (self._listener is None or not self._listener.is_alive()) and time.monotonic() >= next_connect:
+                if self._listener is not None:
+                    logger.warning("Plex alert listener disconnected, reconnecting")
+                try:
+                    self._connect()
+                except Exception as e:
+                    logger.error(f"Could not start Plex alert listener: {e}")
+                next_connect = time.monotonic() + self.reconnect_delay
+
+            self.dispatch_due()
+
+    def dispatch_due(self, now=None):
+        """Apply the batches that are due, re-queueing or dropping those that fail"""
+        for section_key, (changed, deleted) in self.batcher.pop_due(now).items():
+            try:
+                self.on_batch(section_key, changed, deleted)
+            except Exception as e:
+                attempts = self._failures.get(section_key, 0) + 1
+                if attempts < self.max_attempts:
+                    logger.warning(f"Error applying library changes for section {section_key}, "
+                                   f"retrying with the next batch ({attempts}/{self.max_attempts}): {e}")
+                    self._failures[section_key] = attempts
+                    self.batcher.requeue(section_key, changed, deleted)
+                    continue
+                logger.error(f"Giving up on {len(changed) + len(deleted)} library changes for section "
+                             f"{section_key} after {attempts} attempts: {e}")
+                self._failures.pop(section_key, None)
+                if self.on_dropped is not None:
+                    try:
+                        self.on_dropped(section_key)
+                    except Exception as e:
+                        logger.error(f"Error marking section {section_key} for a full sync: {e}")
+            else:
+                self._failures.pop(section_key, None)
+
+    def start(self):
+        logger.info("Listening for Plex library events")
+        self._thread = threading.Thread(target=self._run, name='pmm-events', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._listener is not None and self._listener.is_alive():
+            self._listener.stop()
+        if self._thread:
+            self._thread.join(timeout=5)
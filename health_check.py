@@ -6,142 +6,250 @@ Verify that PMM is configured and running correctly
 
 import sys
 import os
+import json
+import time
+import shutil
+import argparse
+import threading
 import subprocess
+from concurrent.futures import Future, TimeoutError
 from pathlib import Path
-from dotenv import load_dotenv
-import requests
-import yaml
+
+# Seconds each check may take before it is reported as failed
+CHECK_TIMEOUT = 15
+
+# Passing results are reused for this long between runs
+CACHE_FILE = os.getenv('PMM_HEALTH_CACHE', 'logs/health_check_cache.json')
+
+def config_file():
+    """Path of pmm_config.yml, honouring PMM_CONFIG_PATH like pmm.py"""
+    return os.path.join(os.getenv('PMM_CONFIG_PATH', './config'), 'pmm_config.yml')
+
+def load_config():
+    """Read pmm_config.yml, or an empty dict if it cannot be read"""
+    import yaml
+    
+    try:
+        with open(config_file(), 'r', encoding='utf-8') as f:
+            return yaml.safe_load(f) or {}
+    except (OSError, yaml.YAMLError):
+        return {}
 
 def check_files():
     """Check if required files exist"""
     required_files = [
         'pmm.py',
-        'config/pmm_config.yml',
+        config_file(),
         '.env',
         'requirements.txt'
     ]
     
-    missing_files = []
-    for file_path in required_files:
-        if not Path(file_path).exists():
-            missing_files.append(file_path)
-    
+    missing_files = [file_path for file_path in required_files if not Path(file_path).exists()]
     if missing_files:
-        print(f"✗ Missing files: {', '.join(missing_files)}")
-        return False
+        return False, f"✗ Missing files: {', '.join(missing_files)}"
     
-    print("✓ All required files present")
-    return True
+    return True, "✓ All required files present"
 
 def check_configuration():
     """Check configuration validity"""
+    import yaml
+    
     try:
-        with open('config/pmm_config.yml', 'r', encoding='utf-8') as f:
+        with open(config_file(), 'r', encoding='utf-8') as f:
             config = yaml.safe_load(f)
         
         if 'libraries' not in config:
-            print("✗ No libraries configured")
-            return False
+            return False, "✗ No libraries configured"
         
-        print(f"✓ Configuration valid ({len(config['libraries'])} libraries configured)")
-        return True
+        return True, f"✓ Configuration valid ({len(config['libraries'])} libraries configured)"
     except Exception as e:
-        print(f"✗ Configuration error: {e}")
-        return False
+        return False, f"✗ Configuration error: {e}"
 
 def check_environment():
     """Check environment variables"""
-    load_dotenv()
-    
     plex_url = os.getenv('PLEX_URL')
     plex_token = os.getenv('PLEX_TOKEN')
     
     if not plex_url:
-        print("✗ PLEX_URL not configured")
-        return False
+        return False, "✗ PLEX_URL not configured"
     
     if not plex_token or plex_token == 'your_plex_token_here':
-        print("✗ PLEX_TOKEN not configured")
-        return False
+        return False, "✗ PLEX_TOKEN not configured"
     
-    print("✓ Environment variables configured")
-    return True
+    return True, "✓ Environment variables configured"
 
-def check_plex_connection():
+def check_plex_connection(timeout=10):
     """Test Plex server connection"""
-    load_dotenv()
+    import requests
+    from plex_session import session_from_config
     
     try:
-        plex_url = os.getenv('PLEX_URL')
-        plex_token = os.getenv('PLEX_TOKEN')
-        
-        response = requests.get(
-            f"{plex_url}/identity",
-            params={'X-Plex-Token': plex_token},
-            timeout=10
-        )
+        with session_from_config(load_config()) as session:
+            response = session.get(
+                f"{os.getenv('PLEX_URL')}/identity",
+                params={'X-Plex-Token': os.getenv('PLEX_TOKEN')},
+                timeout=timeout
+            )
         
         if response.status_code == 200:
-            print("✓ Plex server connection successful")
-            return True
-        else:
-            print(f"✗ Plex server returned status {response.status_code}")
-            return False
+            return True, "✓ Plex server connection successful"
+        return False, f"✗ Plex server returned status {response.status_code}"
     
     except requests.exceptions.RequestException as e:
-        print(f"✗ Cannot connect to Plex server: {e}")
-        return False
+        return False, f"✗ Cannot connect to Plex server: {e}"
 
 def check_docker():
     """Check Docker availability"""
+    docker = shutil.which('docker')
+    if docker is None:
+        return False, "✗ Docker not available"
     try:
         result = subprocess.run(
-            ['docker', '--version'],
-            capture_output=True, text=True, check=True
+            [docker, '--version'],
+            capture_output=True, text=True, check=True, timeout=10
         )
-        print(f"✓ Docker available: {result.stdout.strip()}")
-        return True
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        print("✗ Docker not available")
-        return False
+        return True, f"✓ Docker available: {result.stdout.strip()}"
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError):
+        return False, "✗ Docker not available"
 
 def check_dependencies():
     """Check Python dependencies"""
     try:
         import plexapi
-        import docker
-        import schedule
-        print("✓ All Python dependencies available")
-        return True
+        import websocket
+        return True, "✓ All Python dependencies available"
     except ImportError as e:
-        print(f"✗ Missing dependency: {e}")
-        return False
+        return False, f"✗ Missing dependency: {e}"
+
+def plex_target():
+    """The server check_plex_connection talks to"""
+    return os.getenv('PLEX_URL', '')
+
+# (name, check, seconds a passing result stays cached; 0 = always run,
+#  optional callable naming what the check targets - part of the cache key)
+CHECKS = [
+    ("Files", check_files, 0),
+    ("Configuration", check_configuration, 0),
+    ("Environment", check_environment, 0),
+    ("Dependencies", check_dependencies, 3600),
+    ("Docker", check_docker, 3600),
+    ("Plex Connection", check_plex_connection, 30, plex_target),
+]
+
+def cache_key(check):
+    """Cache results per check and target, so switching servers re-runs it"""
+    name, target = check[0], check[3] if len(check) > 3 else None
+    return f"{name} @ {target()}" if target else name
+
+def load_cache(path):
+    try:
+        return json.loads(Path(path).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(path, cache):
+    try:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(cache, indent=2), encoding='utf-8')
+    except OSError:
+        pass
 
-def main():
+def start_check(check_func):
+    """Run a check on a daemon thread so a hung check can't block exit"""
+    future = Future()
+    
+    def run():
+        try:
+            future.set_result(check_func())
+        except Exception as e:
+            future.set_exception(e)
+    
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+def run_checks(checks, timeout=CHECK_TIMEOUT, cache_file=CACHE_FILE):
+    """Run checks concurrently; return {name: (passed, message)} in check order
+    
+    Each check gets ``timeout`` seconds. Passing results are cached in
+    ``cache_file`` for the check's TTL; failures are always re-checked.
+    """
+    cache = load_cache(cache_file) if cache_file else {}
+    now = time.time()
+    results = {}
+    pending = []
+    
+    for check in checks:
+        name, check_func, ttl = check[:3]
+        key = cache_key(check)
+        cached = cache.get(key)
+        if cached and cached['passed'] and now - cached['checked_at'] < ttl:
+            results[name] = (True, f"{cached['message']} (cached {now - cached['checked_at']:.0f}s ago)")
+        else:
+            pending.append((name, key, time.monotonic(), start_check(check_func)))
+    
+    # Each check's timeout runs from its own start, so a slow check
+    # doesn't use up the time of the ones collected after it
+    for name, key, started, future in pending:
+        try:
+            passed, message = future.result(timeout=max(0, started + timeout - time.monotonic()))
+        except TimeoutError:
+            results[name] = (False, f"✗ Timed out after {timeout}s")
+            continue
+        except Exception as e:
+            passed, message = False, f"✗ Check failed: {e}"
+        results[name] = (passed, message)
+        cache[key] = {'passed': passed, 'message': message, 'checked_at': now}
+    
+    if cache_file:
+        save_cache(cache_file, cache)
+    return {check[0]: results[check[0]] for check in checks}
+
+def ping(url, timeout=3):
+    """Query a running PMM daemon's health endpoint; exit code 0 when healthy"""
+    import urllib.request
+    import urllib.error
+    
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            print(response.read().decode('utf-8'))
+            return 0
+    except urllib.error.HTTPError as e:
+        print(e.read().decode('utf-8'))
+    except OSError as e:
+        print(f"✗ {url} unreachable: {e}")
+    return 1
+
+def main(argv=None):
     """Run all health checks"""
+    parser = argparse.ArgumentParser(description='Verify that PMM is configured and running correctly')
+    parser.add_argument('--timeout', type=float, default=CHECK_TIMEOUT, help='seconds allowed per check')
+    parser.add_argument('--no-cache', action='store_true', help='ignore and do not write cached results')
+    parser.add_argument('--ping', metavar='URL',
+                        help='only query a running daemon, e.g. http://localhost:8080/healthz')
+    args = parser.parse_args(argv)
+    
+    if args.ping:
+        return ping(args.ping)
+    
+    from dotenv import load_dotenv
+    load_dotenv()
+    
     print("PMM Health Check")
     print("=" * 50)
     
-    checks = [
-        ("Files", check_files),
-        ("Configuration", check_configuration),
-        ("Environment", check_environment),
-        ("Dependencies", check_dependencies),
-        ("Docker", check_docker),
-        ("Plex Connection", check_plex_connection),
-    ]
-    
-    results = {}
-    for name, check_func in checks:
+    started = time.perf_counter()
+    results = run_checks(CHECKS, args.timeout, None if args.no_cache else CACHE_FILE)
+    for name, (passed, message) in results.items():
         print(f"\nChecking {name}...")
-        results[name] = check_func()
+        print(message)
     
     print("\n" + "=" * 50)
-    print("Health Check Summary:")
+    print(f"Health Check Summary ({time.perf_counter() - started:.1f}s):")
     print("=" * 50)
     
     all_passed = True
-    for name, passed in results.items():
+    for name, (passed, _) in results.items():
         status = "✓ PASS" if passed else "✗ FAIL"
         print(f"{name}: {status}")
         if not passed:
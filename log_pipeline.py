@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+PMM Log Pipeline
+Queue-backed logging: callers only enqueue records while a background
+listener writes them to stdout and a rotating, optionally gzipped log file
+"""
+
+import atexit
+import contextvars
+import copy
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import sys
+import time
+from datetime import date, datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Upper bound on rotated files kept, on top of the age-based retention
+MAX_BACKUPS = 100
+
+# Prepended to messages logged in this context, e.g. the server being managed
+log_prefix = contextvars.ContextVar('log_prefix', default='')
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            record.exc_text = record.exc_text or self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _RecordQueueHandler(QueueHandler):
+    """QueueHandler that keeps tracebacks apart from the message
+
+    The stock handler folds the traceback into the message text; keeping
+    it in ``exc_text`` lets the JSON sink report it as its own field. The
+    caller's ``log_prefix`` is applied here, on the logging thread.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.message = log_prefix.get() + record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _gzip_rotator(source, dest):
+    """Compress a rotated log file, keeping its modification time"""
+    stat = os.stat(source)
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.utime(dest, (stat.st_atime, stat.st_mtime))
+    os.remove(source)
+
+
+class RotatingLogFile(RotatingFileHandler):
+    """Log file rotated daily and when it exceeds max_bytes
+
+    Rotated files are named ``pmm.log.1`` (``pmm.log.1.gz`` when compressed),
+    ``pmm.log.2`` and so on, and are deleted once they are older than
+    ``retention_days``.
+    """
+
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, retention_days=30, compress=True):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        super().__init__(filename, maxBytes=max_bytes, backupCount=MAX_BACKUPS, encoding='utf-8')
+        self.retention_days = retention_days
+        if compress:
+            self.namer = lambda name: name + '.gz'
+            self.rotator = _gzip_rotator
+        self._day = self._file_day()
+        self.prune()
+
+    def _file_day(self):
+        try:
+            return date.fromtimestamp(os.stat(self.baseFilename).st_mtime)
+        except OSError:
+            return date.today()
+
+    def shouldRollover(self, record):
+        try:
+            if self._day != date.today() and os.path.getsize(self.baseFilename) > 0:
+                return True
+        except OSError:
+            pass
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self._day = date.today()
+        self.prune()
+
+    def prune(self):
+        """Delete rotated files older than the retention period"""
+        if not self.retention_days:
+            return
+        cutoff = time.time() - self.retention_days * 86400
+        for path in glob.glob(glob.escape(self.baseFilename) + '.*'):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                continue
+
+
+def setup_logging(level='INFO', log_file='logs/pmm.log', max_bytes=10 * 1024 * 1024,
+                  retention_days=30, compress=True, json_format=False, stdout=True):
+    """Route the root logger through a queue to the file and stdout sinks
+
+    Returns the started QueueListener; it is stopped (and the queue
+    drained) at interpreter exit.
+    """
+    formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+    handlers = []
+    if log_file:
+        handlers.append(RotatingLogFile(log_file, max_bytes, retention_days, compress))
+    if stdout:
+        handlers.append(logging.StreamHandler(sys.stdout))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(_RecordQueueHandler(log_queue))
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def setup_logging_from_config(config, level='INFO'):
+    """setup_logging with the logging and maintenance sections of pmm_config.yml"""
+    log_config = (config or {}).get('logging') or {}
+    maintenance = (config or {}).get('maintenance') or {}
+    return setup_logging(
+        level=level,
+        log_file=log_config.get('file', 'logs/pmm.log'),
+        max_bytes=int(float(log_config.get('max_size_mb', 10)) * 1024 * 1024),
+        retention_days=float(maintenance.get('log_retention_days', 30)),
+        compress=bool(log_config.get('compress', True)),
+        json_format=log_config.get('format', 'text') == 'json',
+        stdout=bool(log_config.get('stdout', True)),
+    )
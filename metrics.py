@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+PMM Metrics
+In-process counters, gauges and histograms for maintenance runs, exposed
+as Prometheus text over HTTP or written as a JSON summary
+"""
+
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HELP = {
+    'pmm_task_duration_seconds': 'Duration of maintenance tasks',
+    'pmm_library_duration_seconds': 'Duration of collection processing per library',
+    'pmm_plex_requests_total': 'Plex HTTP requests by endpoint and status',
+    'pmm_plex_request_duration_seconds': 'Plex HTTP request latency by endpoint',
+    'pmm_items_processed_total': 'Library items read into snapshots',
+    'pmm_items_per_second': 'Item throughput of the last processing of each library',
+    'pmm_collections_total': 'Collection outcomes (created, updated, unchanged, skipped, failed)',
+    'pmm_last_run_timestamp_seconds': 'Unix time the last maintenance run finished',
+    'pmm_task_last_run_timestamp_seconds': 'Unix time each maintenance task last finished without error',
+    'pmm_plex_concurrency_limit': 'Current adaptive limit on in-flight Plex requests',
+    'pmm_plex_throttled_total': 'Times the Plex request limit was lowered (overload or latency)',
+    'pmm_tmdb_lookups_total': 'TMDb lookups by result (cached, fetched, failed)',
+    'pmm_optimize_phase_seconds': 'Duration of each Plex butler task run by optimize_database',
+    'pmm_cleanup_files_total': 'Files deleted by temp cleanup, by directory',
+    'pmm_cleanup_bytes_total': 'Bytes reclaimed by temp cleanup, by directory',
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def endpoint_name(path):
+    """Collapse ids in a Plex path so requests group by endpoint"""
+    return re.sub(r'/\d+(,\d+)*', '/{id}', urlsplit(path).path) or '/'
+
+
+class Histogram:
+    """Fixed-bucket histogram with Prometheus cumulative semantics"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+
+class Metrics:
+    """Thread-safe registry of counters, gauges and histograms"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.started_at = time.time()
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            key = (name, _label_key(labels))
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name, value, buckets=DURATION_BUCKETS, **labels):
+        with self._lock:
+            key = (name, _label_key(labels))
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the duration of the with-block into a histogram"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def instrument_session(self, session, **labels):
+        """Count and time every response a requests.Session receives"""
+        def record(response, *args, **kwargs):
+            endpoint = endpoint_name(response.request.path_url)
+            method = response.request.method
+            self.inc('pmm_plex_requests_total', method=method, endpoint=endpoint,
+                     status=response.status_code, **labels)
+            self.observe('pmm_plex_request_duration_seconds', response.elapsed.total_seconds(),
+                         buckets=LATENCY_BUCKETS, method=method, endpoint=endpoint, **labels)
+        session.hooks['response'].append(record)
+        return session
+
+    def labelled(self, **labels):
+        """Return a view that adds labels (e.g. server=...) to everything recorded through it"""
+        return LabelledMetrics(self, labels)
+
+    def render_prometheus(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for kind, series in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted({name for name, _ in series}):
+                    lines.append(f'# HELP {name} {HELP.get(name, name)}')
+                    lines.append(f'# TYPE {name} {kind}')
+                    for (series_name, key), value in sorted(series.items()):
+                        if series_name == name:
+                            lines.append(f'{name}{_format_labels(key)} {value}')
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f'# HELP {name} {HELP.get(name, name)}')
+                lines.append(f'# TYPE {name} histogram')
+                for (series_name, key), histogram in sorted(self.histograms.items(), key=lambda entry: entry[0]):
+                    if series_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_format_labels(key, [("le", bound)])} {cumulative}')
+                    lines.append(f'{name}_bucket{_format_labels(key, [("le", "+Inf")])} {histogram.count}')
+                    lines.append(f'{name}_sum{_format_labels(key)} {histogram.sum}')
+                    lines.append(f'{name}_count{_format_labels(key)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Return a JSON-friendly summary of everything recorded"""
+        result = {'started_at': self.started_at, 'generated_at': time.time(),
+                  'counters': {}, 'gauges': {}, 'histograms': {}}
+        with self._lock:
+            for (name, key), value in self.counters.items():
+                result['counters'].setdefault(name, []).append(dict(key, value=value))
+            for (name, key), value in self.gauges.items():
+                result['gauges'].setdefault(name, []).append(dict(key, value=value))
+            for (name, key), histogram in self.histograms.items():
+                mean = histogram.sum / histogram.count if histogram.count else 0.0
+                result['histograms'].setdefault(name, []).append(
+                    dict(key, count=histogram.count, sum=round(histogram.sum, 6), mean=round(mean, 6)))
+        return result
+
+    def write_json(self, path):
+        """Write the summary to a JSON file, creating its directory"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.summary(), indent=2, default=str), encoding='utf-8')
+        return path
+
+
+class LabelledMetrics:
+    """Metrics view sharing a registry but tagging every series with fixed labels"""
+
+    def __init__(self, registry, labels):
+        self.registry = registry
+        self.labels = labels
+
+    def inc(self, name, value=1, **labels):
+        self.registry.inc(name, value, **self.labels, **labels)
+
+    def set(self, name, value, **labels):
+        self.registry.set(name, value, **self.labels, **labels)
+
+    def observe(self, name, value, buckets=DURATION_BUCKETS, **labels):
+        self.registry.observe(name, value, buckets, **self.labels, **labels)
+
+    def timer(self, name, **labels):
+        return self.registry.timer(name, **self.labels, **labels)
+
+    def instrument_session(self, session, **labels):
+        return self.registry.instrument_session(session, **self.labels, **labels)
+
+    def render_prometheus(self):
+        return self.registry.render_prometheus()
+
+    def summary(self):
+        return self.registry.summary()
+
+    def write_json(self, path):
+        return self.registry.write_json(path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve /metrics in Prometheus text format and /healthz, /readyz as JSON
+
+    The health endpoints call ``server.health(ready)``, which must answer
+    from in-process state only: they are polled every few seconds.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/metrics' and self.server.metrics is not None:
+            self._send(200, self.server.metrics.render_prometheus(), 'text/plain; version=0.0.4; charset=utf-8')
+        elif path in ('/healthz', '/readyz') and self.server.health is not None:
+            healthy, status = self.server.health(ready=path == '/readyz')
+            self._send(200 if healthy else 503, json.dumps(status, default=str), 'application/json')
+        else:
+            self.send_error(404)
+
+    def _send(self, code, text, content_type):
+        body = text.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(metrics, port, host='0.0.0.0', handler=MetricsHandler, health=None):
+    """Serve metrics (and health if given) on a daemon thread and return the HTTP server"""
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.daemon_threads = True
+    httpd.metrics = metrics
+    httpd.health = health
+    threading.Thread(target=httpd.serve_forever, name='pmm-metrics', daemon=True).start()
+    return httpd
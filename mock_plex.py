@@ -0,0 +1,824 @@
+#!/usr/bin/env python3
+"""
+Mock Plex Server
+A local stand-in for the parts of the Plex HTTP API that PMM uses, serving
+synthetic libraries and counting every request for benchmarks
+"""
+
+import base64
+import hashlib
+import json
+import random
+import re
+import struct
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, quote, urlsplit
+
+MACHINE_IDENTIFIER = 'mock-plex-0000'
+NOTIFICATIONS_PATH = '/:/websockets/notifications'
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+COLLECTION_TYPE = '18'
+TYPE_IDS = {'movie': '1', 'show': '2'}
+# Filter fields whose values /library/sections/{id}/{field} lists
+FILTER_CHOICES = ('genre', 'decade', 'year', 'studio')
+
+# Synthetic items are matched to TMDb id TMDB_ID_OFFSET + ratingKey
+TMDB_ID_OFFSET = 100_000
+
+GENRES = [
+    'Action', 'Adventure', 'Animation', 'Comedy', 'Crime', 'Documentary',
+    'Drama', 'Family', 'Fantasy', 'History', 'Horror', 'Music', 'Mystery',
+    'Romance', 'Science Fiction', 'Thriller', 'War', 'Western',
+]
+
+STUDIOS = [
+    'Warner Bros.', 'Universal Pictures', 'Paramount Pictures', 'Walt Disney Pictures',
+    'Columbia Pictures', '20th Century Fox', 'Lionsgate', 'A24', 'HBO', 'Netflix',
+    'BBC', 'AMC', 'FX', 'Hulu', 'Amazon Studios', 'Pixar',
+]
+
+# Titles of the group-by collections PMM writes (see rules.GROUP_RULES), used
+# to pre-seed collections it will find and update instead of create
+EXISTING_TITLES = {
+    'movie': {'genres': '{} Movies', 'studio': '{} Movies'},
+    'show': {'genres': '{} TV Shows', 'studio': '{} Shows'},
+}
+
+# Butler tasks the mock accepts, with the activity each shows while running
+BUTLER_TASKS = {
+    'OptimizeDatabase': ('database.optimize', 'Optimizing database'),
+    'CleanOldBundles': ('butler.bundles', 'Cleaning old bundles'),
+    'CleanOldCacheFiles': ('butler.cache', 'Cleaning old cache files'),
+    'BackupDatabase': ('database.backup', 'Backing up database'),
+}
+
+
+class MockSection:
+    """A synthetic library section: a list of item dicts plus its collections"""
+
+    def __init__(self, key, title, section_type, items, locations=None):
+        self.key = str(key)
+        self.title = title
+        self.type = section_type
+        self.items = items
+        self.by_key = {item['ratingKey']: item for item in items}
+        self.locations = locations or [f'/data/{title.lower().replace(" ", "_")}']
+        self.refreshing_until = 0.0
+
+
+def synthetic_guids(rating_key, section_type='movie'):
+    """Agent GUIDs for a synthetic item; mock_tmdb maps them back to the same TMDb id
+
+    Every tenth item has only an IMDb (movies) or TVDB (shows) id, so
+    enrichment has to resolve it through TMDb's /find.
+    """
+    tmdb_id = TMDB_ID_OFFSET + rating_key
+    external = f'imdb://tt{rating_key:07d}' if section_type == 'movie' else f'tvdb://{rating_key}'
+    if rating_key % 10 == 0:
+        return [external]
+    return [f'tmdb://{tmdb_id}', external]
+
+
+def name_pool(names, size=None, label='Name'):
+    """The first size names, padded with 'label N' when size exceeds the list"""
+    if size is None:
+        return list(names)
+    return list(names[:size]) + [f'{label} {number}' for number in range(len(names) + 1, size + 1)]
+
+
+def synthetic_items(count, section_type='movie', start_key=1, seed=0, base_time=1_600_000_000,
+                    genres=GENRES, studios=STUDIOS):
+    """Generate count deterministic items with years, ratings, studios and genres"""
+    rng = random.Random(seed)
+    items = []
+    for offset in range(count):
+        rating_key = start_key + offset
+        added_at = base_time + rng.randrange(0, 100_000_000)
+        items.append({
+            'ratingKey': rating_key,
+            'title': f'{section_type.title()} {rating_key}',
+            'year': rng.randint(1950, 2024),
+            'rating': round(rng.uniform(3.0, 9.8), 1),
+            'studio': rng.choice(studios),
+            'genres': rng.sample(genres, min(len(genres), rng.randint(1, 3))),
+            'addedAt': added_at,
+            'updatedAt': added_at + rng.randrange(0, 1_000_000),
+            'guids': synthetic_guids(rating_key, section_type),
+        })
+    return items
+
+
+def synthetic_sections(movies=1000, shows=200, seed=0, genres=None, studios=None):
+    """Build the default Movies / TV Shows pair of sections
+
+    genres and studios size the value pools; larger pools mean more,
+    smaller group-by collections.
+    """
+    genres = name_pool(GENRES, genres, 'Genre')
+    studios = name_pool(STUDIOS, studios, 'Studio')
+    sections = [MockSection(1, 'Movies', 'movie', synthetic_items(movies, 'movie', 1, seed, genres=genres,
+                                                                  studios=studios))]
+    if shows:
+        sections.append(MockSection(2, 'TV Shows', 'show', synthetic_items(shows, 'show', movies + 1, seed + 1,
+                                                                           genres=genres, studios=studios)))
+    return sections
+
+
+def existing_collections(sections, count, seed=0):
+    """Pre-seed up to count genre/studio collections per section, as PMM would title them
+
+    Each holds a random half of its matching items plus as many unrelated
+    ones, so a run has to both add and remove members. Returns the
+    {section key: {title: ratingKeys}} MockPlexServer takes.
+    """
+    rng = random.Random(seed)
+    collections = {}
+    for section in sections:
+        titles = EXISTING_TITLES.get(section.type, {})
+        members = defaultdict(list)
+        for item in section.items:
+            if 'genres' in titles:
+                for genre in item['genres']:
+                    members[titles['genres'].format(genre)].append(item['ratingKey'])
+            if 'studio' in titles:
+                members[titles['studio'].format(item['studio'])].append(item['ratingKey'])
+        seeded = {}
+        for title in sorted(members)[:count]:
+            rating_keys = members[title]
+            stale = rng.sample(rating_keys, max(1, len(rating_keys) // 2))
+            others = rng.sample(section.items, min(len(section.items), len(stale)))
+            seeded[title] = stale + [item['ratingKey'] for item in others]
+        if seeded:
+            collections[section.key] = seeded
+    return collections
+
+
+class MockPlexState:
+    """Mutable server state shared by all request handler threads"""
+
+    def __init__(self, sections, collections=None, latency=0.0, scan_seconds=0.0, capacity=None,
+                 butler_seconds=0.0):
+        self.sections = {section.key: section for section in sections}
+        self.latency = latency
+        self.scan_seconds = scan_seconds
+        self.butler_seconds = butler_seconds
+        # Running butler tasks: uuid -> {task, type, title, started, until}
+        self.activities = {}
+        # Requests in flight beyond capacity are refused with a 503
+        self.capacity = capacity
+        # Endpoint -> how many more requests are handled but never answered
+        self.lost_responses = Counter()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.lock = threading.Lock()
+        self.initial_collections = collections or {}
+        self.websockets = set()
+        self.reset()
+
+    def reset(self, stats_only=False):
+        """Clear request stats and, unless stats_only, restore the initial collections"""
+        with self.lock:
+            self.request_counts = Counter()
+            self.request_seconds = defaultdict(float)
+            self.scans = []
+            self.butler_runs = []
+            self.overloaded = 0
+            self.peak_in_flight = self.in_flight
+            if stats_only:
+                return
+            self.collections = {}
+            self.next_key = max(
+                [item['ratingKey'] for section in self.sections.values() for item in section.items] or [0]
+            ) + 1_000_000
+            for section_key, titles in self.initial_collections.items():
+                for title, rating_keys in titles.items():
+                    self._add_collection(str(section_key), title, rating_keys)
+
+    def _add_collection(self, section_key, title, rating_keys):
+        key = self.next_key
+        self.next_key += 1
+        self.collections[key] = {
+            'ratingKey': key, 'title': title, 'section': section_key,
+            'items': list(dict.fromkeys(rating_keys)), 'smart': False, 'filters': None,
+            'addedAt': int(time.time()), 'updatedAt': int(time.time()),
+        }
+        return self.collections[key]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'total_requests': sum(self.request_counts.values()),
+                'requests': dict(self.request_counts),
+                'seconds': dict(self.request_seconds),
+                'scans': list(self.scans),
+                'butler_runs': list(self.butler_runs),
+                'collections': len(self.collections),
+                'overloaded': self.overloaded,
+                'peak_in_flight': self.peak_in_flight,
+            }
+
+    def running_activities(self):
+        """Butler activities still running, dropping finished ones; call with the lock held"""
+        now = time.time()
+        for uuid in [uuid for uuid, activity in self.activities.items() if activity['until'] <= now]:
+            del self.activities[uuid]
+        return list(self.activities.values())
+
+    def find_item(self, rating_key):
+        for section in self.sections.values():
+            item = section.by_key.get(rating_key)
+            if item is not None:
+                return section, item
+        return None, None
+
+
+class _WebSocketClient:
+    """Server side of one notification websocket; frames are sent unmasked"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.lock = threading.Lock()
+
+    def send(self, payload, opcode=0x1):
+        header = bytes([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header += bytes([length])
+        elif length < 1 << 16:
+            header += bytes([126]) + struct.pack('!H', length)
+        else:
+            header += bytes([127]) + struct.pack('!Q', length)
+        with self.lock:
+            self.wfile.write(header + payload)
+            self.wfile.flush()
+
+
+def timeline_alert(section_key, rating_key, state=5, item_type=1):
+    """Build a library timeline NotificationContainer like Plex sends"""
+    return {
+        'type': 'timeline',
+        'size': 1,
+        'TimelineEntry': [{
+            'identifier': 'com.plexapp.plugins.library',
+            'sectionID': str(section_key),
+            'itemID': str(rating_key),
+            'type': item_type,
+            'state': state,
+            'updatedAt': int(time.time()),
+        }],
+    }
+
+
+def _endpoint(method, path):
+    """Normalize a request path into a countable endpoint name"""
+    path = re.sub(r'/\d+(,\d+)*', '/{id}', path)
+    return f'{method} {path}'
+
+
+def _container(**attrib):
+    return ET.Element('MediaContainer', {k: str(v) for k, v in attrib.items()})
+
+
+def _item_element(parent, section, item):
+    tag = 'Video' if section.type == 'movie' else 'Directory'
+    element = ET.SubElement(parent, tag, {
+        'ratingKey': str(item['ratingKey']),
+        'key': f"/library/metadata/{item['ratingKey']}",
+        'type': section.type,
+        'title': item['title'],
+        'year': str(item['year']),
+        'rating': str(item['rating']),
+        'studio': item['studio'],
+        'addedAt': str(item['addedAt']),
+        'updatedAt': str(item['updatedAt']),
+        'librarySectionID': section.key,
+    })
+    if section.type == 'show':
+        element.set('childCount', '1')
+        element.set('leafCount', '10')
+    for genre in item['genres']:
+        ET.SubElement(element, 'Genre', {'tag': genre})
+    for guid in item.get('guids', ()):
+        ET.SubElement(element, 'Guid', {'id': guid})
+    return element
+
+
+def _smart_content(uri):
+    """Split a smart collection uri into its content path and the filters it applies"""
+    content = '/library' + uri.split('/library', 1)[-1]
+    filters = {key: value for key, value in parse_qsl(urlsplit(content).query)
+               if key not in ('type', 'sort', 'limit')}
+    return content, filters
+
+
+def _collection_items(state, collection):
+    """Member ratingKeys; smart collections are evaluated live; call with the lock held"""
+    if not collection['smart']:
+        return collection['items']
+    section = state.sections[collection['section']]
+    return [item['ratingKey'] for item in section.items if _matches(item, collection['filters'])]
+
+
+def _collection_element(parent, state, collection):
+    section = state.sections[collection['section']]
+    element = ET.SubElement(parent, 'Directory', {
+        'ratingKey': str(collection['ratingKey']),
+        'key': f"/library/collections/{collection['ratingKey']}/children",
+        'type': 'collection',
+        'title': collection['title'],
+        'subtype': section.type,
+        'smart': '1' if collection['smart'] else '0',
+        'childCount': str(len(_collection_items(state, collection))),
+        'librarySectionID': section.key,
+        'addedAt': str(collection['addedAt']),
+        'updatedAt': str(collection['updatedAt']),
+    })
+    if collection['smart']:
+        element.set('content', collection['content'])
+    return element
+
+
+def _matches(item, filters):
+    """Apply the subset of Plex filters the mock understands"""
+    for field, value in filters.items():
+        if field.endswith('>>'):
+            if item.get(field[:-2], 0) <= float(value):
+                return False
+        elif field.endswith('<<'):
+            if item.get(field[:-2], 0) >= float(value):
+                return False
+        elif field == 'genre':
+            if value not in item['genres']:
+                return False
+        elif field == 'decade':
+            if (item['year'] // 10) * 10 != int(value):
+                return False
+        elif field in ('year', 'studio'):
+            if str(item[field]) != value:
+                return False
+    return True
+
+
+class MockPlexHandler(BaseHTTPRequestHandler):
+    """Routes Plex API requests onto the shared MockPlexState"""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MockPlex/1.0'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _dispatch(self, method):
+        started = time.perf_counter()
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query, keep_blank_values=True))
+        endpoint = _endpoint(method, url.path)
+
+        with self.state.lock:
+            self.state.in_flight += 1
+            self.state.peak_in_flight = max(self.state.peak_in_flight, self.state.in_flight)
+            overloaded = self.state.capacity is not None and self.state.in_flight > self.state.capacity
+        if self.state.latency:
+            time.sleep(self.state.latency)
+
+        try:
+            if overloaded and url.path != '/_mock/stats':
+                with self.state.lock:
+                    self.state.overloaded += 1
+                self._send_status(503)
+                return
+            if url.path == '/_mock/stats':
+                self._send_json(self.state.stats())
+                return
+            if self.server.token and params.get('X-Plex-Token', self.headers.get('X-Plex-Token')) != self.server.token:
+                self._send_status(401)
+                return
+            if url.path == NOTIFICATIONS_PATH and self.headers.get('Upgrade', '').lower() == 'websocket':
+                self._serve_websocket()
+                return
+            body = self.route(method, url.path, params)
+            with self.state.lock:
+                lose = self.state.lost_responses[endpoint] > 0
+                if lose:
+                    self.state.lost_responses[endpoint] -= 1
+            if lose:
+                # Done, but the client only sees the connection drop
+                self.close_connection = True
+            elif body is None:
+                self._send_status(404)
+            else:
+                self._send_xml(body)
+        finally:
+            with self.state.lock:
+                self.state.in_flight -= 1
+                self.state.request_counts[endpoint] += 1
+                self.state.request_seconds[endpoint] += time.perf_counter() - started
+
+    def route(self, method, path, params):
+        """Return the MediaContainer element for a request, or None for 404"""
+        state = self.state
+        parts = [part for part in path.split('/') if part]
+
+        if method == 'GET' and not parts:
+            return _container(friendlyName='Mock Plex', machineIdentifier=MACHINE_IDENTIFIER,
+                              version='1.40.0.0000', platform='Linux', platformVersion='mock')
+        if method == 'GET' and parts == ['library']:
+            return _container(identifier='com.plexapp.plugins.library', title1='Plex Library')
+        if method == 'GET' and parts == ['identity']:
+            return _container(machineIdentifier=MACHINE_IDENTIFIER, version='1.40.0.0000')
+        if parts[:2] == ['library', 'sections']:
+            return self._route_sections(method, parts[2:], params)
+        if parts[:1] == ['butler']:
+            return self._route_butler(method, parts[1:])
+        if method == 'GET' and parts == ['activities']:
+            return self._activities()
+        if parts[:2] == ['library', 'metadata'] and len(parts) == 3 and method == 'GET':
+            container = _container()
+            with state.lock:
+                for rating_key in parts[2].split(','):
+                    section, item = state.find_item(int(rating_key))
+                    if item is not None:
+                        _item_element(container, section, item)
+            container.set('size', str(len(container)))
+            return container
+        if parts[:2] == ['library', 'collections']:
+            return self._route_collections(method, parts[2:], params)
+        return None
+
+    def _route_sections(self, method, parts, params):
+        state = self.state
+        if not parts and method == 'GET':
+            container = _container(size=len(state.sections))
+            for section in state.sections.values():
+                directory = ET.SubElement(container, 'Directory', {
+                    'key': section.key, 'type': section.type, 'title': section.title,
+                    'agent': 'tv.plex.agents.movie', 'scanner': 'Plex Movie',
+                    'language': 'en-US', 'uuid': f'mock-section-{section.key}',
+                    'refreshing': '1' if time.time() < section.refreshing_until else '0',
+                })
+                for index, location in enumerate(section.locations):
+                    ET.SubElement(directory, 'Location', {'id': str(index), 'path': location})
+            return container
+
+        section = state.sections.get(parts[0])
+        if section is None or len(parts) != 2:
+            return None
+        if parts[1] in FILTER_CHOICES and method == 'GET':
+            return self._filter_choices(section, parts[1])
+        if parts[1] == 'refresh':
+            with state.lock:
+                state.scans.append({'section': section.key, 'path': params.get('path'), 'method': method,
+                                    'during_butler': bool(state.running_activities())})
+                section.refreshing_until = time.time() + state.scan_seconds
+            return _container()
+        if parts[1] != 'all' or method != 'GET':
+            return None
+
+        start = int(params.get('X-Plex-Container-Start', self.headers.get('X-Plex-Container-Start', 0)))
+        size = params.get('X-Plex-Container-Size', self.headers.get('X-Plex-Container-Size'))
+        filters = {key: value for key, value in params.items()
+                   if not key.startswith('X-Plex') and key not in ('type', 'includeCollections',
+                                                                      'excludeFields', 'excludeElements',
+                                                                      'includeGuids', 'sort')}
+
+        with state.lock:
+            if params.get('type') == COLLECTION_TYPE:
+                rows = [c for c in state.collections.values() if c['section'] == section.key]
+            else:
+                rows = [item for item in section.items if _matches(item, filters)]
+            total = len(rows)
+            page = rows[start:] if size is None else rows[start:start + int(size)]
+            container = _container(size=len(page), totalSize=total, offset=start,
+                                   librarySectionID=section.key)
+            for row in page:
+                if params.get('type') == COLLECTION_TYPE:
+                    _collection_element(container, state, row)
+                else:
+                    _item_element(container, section, row)
+        return container
+
+    def _filter_choices(self, section, field):
+        """List the values of a filter field present in a section, like /library/sections/{id}/genre"""
+        with self.state.lock:
+            values = Counter()
+            for item in section.items:
+                values.update(item['genres'] if field == 'genre' else
+                              [(item['year'] // 10) * 10 if field == 'decade' else item[field]])
+        container = _container(size=len(values))
+        for value in sorted(values):
+            ET.SubElement(container, 'Directory', {
+                'key': str(value),
+                'title': f'{value}s' if field == 'decade' else str(value),
+                'fastKey': f'/library/sections/{section.key}/all?{field}={quote(str(value))}',
+            })
+        return container
+
+    def _route_butler(self, method, parts):
+        state = self.state
+        if not parts and method == 'GET':
+            container = _container(size=len(BUTLER_TASKS))
+            for name, (_, title) in BUTLER_TASKS.items():
+                ET.SubElement(container, 'ButlerTask', {
+                    'name': name, 'title': title, 'interval': '7', 'enabled': '1',
+                    'scheduleRandomized': '0', 'description': title,
+                })
+            return container
+        if len(parts) != 1 or parts[0] not in BUTLER_TASKS or method != 'POST':
+            return None
+        activity_type, title = BUTLER_TASKS[parts[0]]
+        now = time.time()
+        with state.lock:
+            scanning = [s.title for s in state.sections.values() if now < s.refreshing_until]
+            uuid = f'mock-activity-{len(state.butler_runs)}'
+            state.activities[uuid] = {'uuid': uuid, 'task': parts[0], 'type': activity_type, 'title': title,
+                                      'started': now, 'until': now + state.butler_seconds}
+            state.butler_runs.append({'task': parts[0], 'started_at': now, 'during_scan': scanning})
+        return _container()
+
+    def _activities(self):
+        """List running butler tasks and library scans the way /activities does"""
+        state = self.state
+        now = time.time()
+        container = _container()
+        with state.lock:
+            running = [dict(activity, progress=int(100 * (now - activity['started'])
+                                                    / max(activity['until'] - activity['started'], 1e-6)))
+                       for activity in state.running_activities()]
+            running += [{'uuid': f'mock-scan-{section.key}', 'type': 'library.update.section',
+                         'title': f'Scanning {section.title}', 'progress': 50}
+                        for section in state.sections.values() if now < section.refreshing_until]
+        for activity in running:
+            ET.SubElement(container, 'Activity', {
+                'uuid': activity['uuid'], 'type': activity['type'], 'title': activity['title'],
+                'cancellable': '0', 'userID': '1', 'progress': str(activity['progress']),
+            })
+        container.set('size', str(len(container)))
+        return container
+
+    def _route_collections(self, method, parts, params):
+        state = self.state
+        with state.lock:
+            if not parts and method == 'POST':
+                smart = params.get('smart') == '1'
+                rating_keys = [] if smart else [
+                    int(key) for key in params.get('uri', '').rsplit('/', 1)[-1].split(',') if key
+                ]
+                collection = state._add_collection(params['sectionId'], params['title'], rating_keys)
+                if smart:
+                    collection['smart'] = True
+                    collection['content'], collection['filters'] = _smart_content(params['uri'])
+                container = _container(size=1)
+                _collection_element(container, state, collection)
+                return container
+
+            collection = state.collections.get(int(parts[0])) if parts else None
+            if collection is None:
+                return None
+            section = state.sections[collection['section']]
+
+            if len(parts) == 1:
+                if method == 'DELETE':
+                    del state.collections[collection['ratingKey']]
+                    return _container()
+                container = _container(size=1)
+                _collection_element(container, state, collection)
+                return container
+            if parts[1] == 'children' and method == 'GET':
+                members = _collection_items(state, collection)
+                container = _container(size=len(members))
+                for rating_key in members:
+                    item = section.by_key.get(rating_key)
+                    if item is not None:
+                        _item_element(container, section, item)
+                return container
+            if parts[1] == 'items' and method == 'PUT' and collection['smart']:
+                collection['content'], collection['filters'] = _smart_content(params['uri'])
+                collection['updatedAt'] = int(time.time())
+                return _container()
+            if parts[1] == 'items' and method == 'PUT':
+                rating_keys = [int(key) for key in params.get('uri', '').rsplit('/', 1)[-1].split(',') if key]
+                existing = set(collection['items'])
+                collection['items'].extend(key for key in rating_keys if key not in existing)
+                collection['updatedAt'] = int(time.time())
+                return _container()
+            if parts[1] == 'items' and method == 'DELETE' and len(parts) == 3:
+                rating_key = int(parts[2])
+                collection['items'] = [key for key in collection['items'] if key != rating_key]
+                collection['updatedAt'] = int(time.time())
+                return _container()
+        return None
+
+    def _serve_websocket(self):
+        """Complete the websocket handshake and hold the connection open"""
+        accept = base64.b64encode(
+            hashlib.sha1((self.headers['Sec-WebSocket-Key'] + WEBSOCKET_GUID).encode('ascii')).digest()
+        ).decode('ascii')
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.close_connection = True
+
+        client = _WebSocketClient(self.wfile)
+        with self.state.lock:
+            self.state.websockets.add(client)
+        try:
+            while True:
+                header = self.rfile.read(2)
+                if len(header) < 2:
+                    break
+                opcode, length = header[0] & 0x0F, header[1] & 0x7F
+                if length == 126:
+                    length = struct.unpack('!H', self.rfile.read(2))[0]
+                elif length == 127:
+                    length = struct.unpack('!Q', self.rfile.read(8))[0]
+                mask = self.rfile.read(4) if header[1] & 0x80 else b'\0\0\0\0'
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(self.rfile.read(length)))
+                if opcode == 0x8:
+                    client.send(b'', opcode=0x8)
+                    break
+                if opcode == 0x9:
+                    client.send(payload, opcode=0xA)
+        except OSError:
+            pass
+        finally:
+            with self.state.lock:
+                self.state.websockets.discard(client)
+
+    def _send_xml(self, element):
+        body = ET.tostring(element, encoding='utf-8', xml_declaration=True)
+        self._send(200, body, 'text/xml;charset=utf-8')
+
+    def _send_json(self, data):
+        self._send(200, json.dumps(data).encode('utf-8'), 'application/json')
+
+    def _send_status(self, status):
+        self._send(status, b'', 'text/plain')
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockPlexServer:
+    """Run a MockPlexHandler on a background thread; usable as a context manager"""
+
+    def __init__(self, sections=None, collections=None, token='mock-token',
+                 host='127.0.0.1', port=0, latency=0.0, scan_seconds=0.0, capacity=None,
+                 butler_seconds=0.0):
+        self.state = MockPlexState(sections if sections is not None else synthetic_sections(),
+                                   collections, latency, scan_seconds, capacity, butler_seconds)
+        self.token = token
+        self._httpd = ThreadingHTTPServer((host, port), MockPlexHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.state = self.state
+        self._httpd.token = token
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='mock-plex', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def stats(self):
+        return self.state.stats()
+
+    def notify(self, container):
+        """Push a NotificationContainer dict to every connected alert listener"""
+        payload = json.dumps({'NotificationContainer': container}).encode('utf-8')
+        with self.state.lock:
+            clients = list(self.state.websockets)
+        for client in clients:
+            try:
+                client.send(payload)
+            except OSError:
+                with self.state.lock:
+                    self.state.websockets.discard(client)
+        return len(clients)
+
+    def wait_for_listeners(self, count=1, timeout=10.0):
+        """Block until count alert listeners are connected; return whether they did"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.state.lock:
+                if len(self.state.websockets) >= count:
+                    return True
+            time.sleep(0.05)
+        return False
+
+    def lose_responses(self, endpoint, count=1):
+        """Handle the next count requests to an endpoint, then drop the connection unanswered
+
+        Simulates a response lost after Plex acted. Endpoints are named as
+        in stats(), e.g. 'POST /library/collections'.
+        """
+        with self.state.lock:
+            self.state.lost_responses[endpoint] += count
+
+    def add_item(self, section_key, **fields):
+        """Add an item to a section and announce it like a finished Plex import"""
+        section = self.state.sections[str(section_key)]
+        with self.state.lock:
+            rating_key = self.state.next_key
+            self.state.next_key += 1
+            now = int(time.time())
+            item = {'ratingKey': rating_key, 'title': f'Item {rating_key}', 'year': 2024, 'rating': 7.0,
+                    'studio': STUDIOS[0], 'genres': [GENRES[0]], 'addedAt': now, 'updatedAt': now,
+                    'guids': synthetic_guids(rating_key, section.type)}
+            item.update(fields)
+            section.items.append(item)
+            section.by_key[rating_key] = item
+        self.notify(timeline_alert(section.key, rating_key, 5, int(TYPE_IDS[section.type])))
+        return rating_key
+
+    def update_item(self, rating_key, **fields):
+        """Change an item's metadata and announce the update"""
+        with self.state.lock:
+            section, item = self.state.find_item(rating_key)
+            item.update(fields)
+            item['updatedAt'] = max(int(time.time()), item['updatedAt'] + 1)
+        self.notify(timeline_alert(section.key, rating_key, 5, int(TYPE_IDS[section.type])))
+
+    def delete_item(self, rating_key):
+        """Remove an item and announce the deletion"""
+        with self.state.lock:
+            section, item = self.state.find_item(rating_key)
+            section.items.remove(item)
+            del section.by_key[rating_key]
+        self.notify(timeline_alert(section.key, rating_key, 9, int(TYPE_IDS[section.type])))
+
+    def reset(self, stats_only=False):
+        self.state.reset(stats_only)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    """Serve a synthetic library until interrupted"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve a mock Plex API with synthetic libraries')
+    parser.add_argument('--port', type=int, default=32400)
+    parser.add_argument('--movies', type=int, default=1000)
+    parser.add_argument('--shows', type=int, default=200)
+    parser.add_argument('--token', default='mock-token')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--capacity', type=int, help='answer 503 beyond this many concurrent requests')
+    parser.add_argument('--butler-seconds', type=float, default=5.0, help='how long butler tasks run')
+    parser.add_argument('--genres', type=int, help=f'distinct genres (default {len(GENRES)})')
+    parser.add_argument('--studios', type=int, help=f'distinct studios (default {len(STUDIOS)})')
+    parser.add_argument('--existing-collections', type=int, default=0,
+                        help='pre-seed this many stale genre/studio collections per library')
+    args = parser.parse_args()
+
+    sections = synthetic_sections(args.movies, args.shows, genres=args.genres, studios=args.studios)
+    server = MockPlexServer(sections, existing_collections(sections, args.existing_collections), token=args.token,
+                            port=args.port, latency=args.latency_ms / 1000, capacity=args.capacity,
+                            butler_seconds=args.butler_seconds)
+    print(f"Mock Plex listening on {server.url} (token: {args.token})")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Mock TMDb Server
+A local stand-in for the TMDb v3 endpoints PMM's enrichment uses, serving
+deterministic details for the ids mock_plex's synthetic items carry
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from mock_plex import TMDB_ID_OFFSET
+
+KEYWORDS = [
+    'time travel', 'heist', 'based on novel', 'dystopia', 'space', 'revenge',
+    'friendship', 'superhero', 'coming of age', 'artificial intelligence',
+    'road trip', 'small town', 'survival', 'conspiracy',
+]
+
+# Ids divisible by this are unknown to TMDb (404, or no /find match)
+MISSING_EVERY = 97
+
+
+def synthetic_details(kind, tmdb_id):
+    """Deterministic TMDb details for an id, or None if TMDb doesn't know it"""
+    if tmdb_id % MISSING_EVERY == 0:
+        return None
+    rng = random.Random(tmdb_id)
+    details = {
+        'id': tmdb_id,
+        'popularity': round(rng.uniform(0.5, 500.0), 3),
+    }
+    keywords = [{'id': KEYWORDS.index(name) + 1, 'name': name}
+                for name in rng.sample(KEYWORDS, rng.randint(0, 3))]
+    if kind == 'movie':
+        details['title'] = f'Movie {tmdb_id}'
+        # Runs of four consecutive ids form a franchise, one run in five
+        saga = tmdb_id // 4
+        details['belongs_to_collection'] = (
+            {'id': saga, 'name': f'Mock Saga {saga} Collection'} if saga % 5 == 0 else None
+        )
+        details['keywords'] = {'keywords': keywords}
+    else:
+        details['name'] = f'Show {tmdb_id}'
+        details['keywords'] = {'results': keywords}
+    return details
+
+
+class MockTMDbHandler(BaseHTTPRequestHandler):
+    """Serve /3/movie/{id}, /3/tv/{id} and /3/find/{external id}"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query))
+        endpoint = re.sub(r'/(tt)?\d+$', '/{id}', url.path)
+        with server.lock:
+            server.request_counts[endpoint] += 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        bearer = self.headers.get('Authorization', '').removeprefix('Bearer ')
+        if server.api_key and server.api_key not in (params.get('api_key'), bearer):
+            self._send_json(401, {'status_code': 7, 'status_message': 'Invalid API key'})
+            return
+
+        match = re.fullmatch(r'/3/(movie|tv)/(\d+)', url.path)
+        if match:
+            details = synthetic_details(match[1], int(match[2]))
+            if details is None:
+                self._send_json(404, {'status_code': 34, 'status_message': 'Not found'})
+            else:
+                self._send_json(200, details)
+            return
+
+        match = re.fullmatch(r'/3/find/(tt)?(\d+)', url.path)
+        if match:
+            source = params.get('external_source')
+            tmdb_id = TMDB_ID_OFFSET + int(match[2])
+            movie = source == 'imdb_id' and match[1] and synthetic_details('movie', tmdb_id)
+            show = source == 'tvdb_id' and not match[1] and synthetic_details('tv', tmdb_id)
+            self._send_json(200, {
+                'movie_results': [{'id': tmdb_id}] if movie else [],
+                'tv_results': [{'id': tmdb_id}] if show else [],
+            })
+            return
+
+        self._send_json(404, {'status_code': 34, 'status_message': 'Not found'})
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockTMDbServer:
+    """Run a MockTMDbHandler on a background thread; usable as a context manager"""
+
+    def __init__(self, api_key='mock-tmdb-key', host='127.0.0.1', port=0, latency=0.0):
+        self.api_key = api_key
+        self._httpd = ThreadingHTTPServer((host, port), MockTMDbHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.api_key = api_key
+        self._httpd.latency = latency
+        self._httpd.lock = threading.Lock()
+        self._httpd.request_counts = Counter()
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/3'
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, name='mock-tmdb', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def stats(self):
+        with self._httpd.lock:
+            counts = dict(self._httpd.request_counts)
+        return {'total_requests': sum(counts.values()), 'requests': counts}
+
+    def reset(self):
+        with self._httpd.lock:
+            self._httpd.request_counts.clear()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    """Serve mock TMDb until interrupted"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve a mock TMDb API for PMM enrichment')
+    parser.add_argument('--port', type=int, default=8383)
+    parser.add_argument('--api-key', default='mock-tmdb-key')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockTMDbServer(args.api_key, port=args.port, latency=args.latency_ms / 1000)
+    print(f"Mock TMDb listening on {server.url} (api key: {args.api_key})")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
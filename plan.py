@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+PMM Collection Plans
+Compute every collection's desired membership from exported library
+snapshots, entirely offline, and read/write the result as a plan file
+"""
+
+import json
+import logging
+import time
+from pathlib import Path
+
+from rules import collections_for
+from snapshot import LibrarySnapshot
+
+logger = logging.getLogger(__name__)
+
+PLAN_VERSION = 1
+SNAPSHOT_SUFFIX = '.pmmsnap'
+
+
+def snapshot_filename(library):
+    """File name an exported library snapshot is saved under"""
+    slug = ''.join(c if c.isalnum() else '_' for c in library.title).strip('_').lower()
+    return f"{library.key}-{slug or 'library'}{SNAPSHOT_SUFFIX}"
+
+
+def expand_snapshot_paths(paths):
+    """Expand directories in paths to the snapshot files inside them"""
+    expanded = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            expanded.extend(sorted(path.glob(f'*{SNAPSHOT_SUFFIX}')))
+        else:
+            expanded.append(path)
+    return expanded
+
+
+def compute_plan(snapshot_paths, rules=None):
+    """Load snapshot files and compute {collection: ratingKeys} for each library
+
+    ``rules`` comes from rules.compile_rules; the built-in defaults are used if None.
+    """
+    plan = {'version': PLAN_VERSION, 'generated_at': time.time(), 'libraries': []}
+
+    for path in expand_snapshot_paths(snapshot_paths):
+        started = time.perf_counter()
+        snapshot, meta = LibrarySnapshot.load(path)
+        collections = collections_for(meta.get('type'), snapshot, rules)
+        elapsed = time.perf_counter() - started
+
+        logger.info(f"{meta.get('title', path)}: {len(collections)} collections from "
+                    f"{len(snapshot)} items in {elapsed:.2f}s")
+        plan['libraries'].append({
+            'key': meta.get('key'),
+            'title': meta.get('title'),
+            'type': meta.get('type'),
+            'snapshot': str(path),
+            'exported_at': meta.get('exported_at'),
+            'items': len(snapshot),
+            'collections': {title: list(keys) for title, keys in collections.items()},
+        })
+
+    return plan
+
+
+def write_plan(plan, path):
+    """Write a plan as JSON, creating its directory"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(plan, separators=(',', ':')), encoding='utf-8')
+    return path
+
+
+def read_plan(path):
+    """Read a plan file written by write_plan"""
+    plan = json.loads(Path(path).read_text(encoding='utf-8'))
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(f"{path} uses plan format {plan.get('version')}, expected {PLAN_VERSION}")
+    return plan
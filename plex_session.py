@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Plex HTTP Session
+Shared requests.Session factory with keep-alive pooling, gzip and
+idempotent retries for all Plex traffic
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from throttle import limiter_from_config, response_overloaded
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'])
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies a default timeout when the caller passes none
+
+    With a ``limiter`` (throttle.AdaptiveLimiter) every request waits for a
+    slot first and reports back whether Plex answered promptly.
+    """
+
+    def __init__(self, *args, timeout=None, limiter=None, **kwargs):
+        self.timeout = timeout
+        self.limiter = limiter
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        if self.limiter is None:
+            return super().send(request, **kwargs)
+
+        token = self.limiter.acquire()
+        overloaded = True
+        try:
+            response = super().send(request, **kwargs)
+            overloaded = response_overloaded(response)
+            return response
+        finally:
+            self.limiter.release(token, overloaded)
+
+
+def create_session(pool_size=2, max_retries=3, timeout=300, backoff_factor=0.5, limiter=None):
+    """Build a pooled session that retries idempotent requests with exponential backoff
+
+    ``pool_size`` should match the number of threads that talk to Plex at
+    once so connections are reused instead of re-established per request.
+    POSTs are never retried here because creating a collection twice is not
+    harmless; callers that can re-check state retry those themselves.
+    """
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=IDEMPOTENT_METHODS,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = TimeoutHTTPAdapter(
+        timeout=timeout,
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=retry,
+        limiter=limiter,
+    )
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['Accept-Encoding'] = 'gzip, deflate'
+    return session
+
+
+def session_from_config(config, pool_size=None, metrics=None):
+    """Create a session from the ``advanced`` section of pmm_config.yml
+
+    Requests are throttled by ``advanced.throttle``, whose concurrency
+    ceiling defaults to the pool size.
+    """
+    advanced = (config or {}).get('advanced', {})
+    max_workers = max(1, int(advanced.get('max_workers', 2)))
+    pool_size = pool_size or max_workers
+    return create_session(
+        pool_size=pool_size,
+        max_retries=max(0, int(advanced.get('max_retries', 3))),
+        timeout=int(advanced.get('timeout', 300)),
+        limiter=limiter_from_config(config, max_concurrency=pool_size, metrics=metrics),
+    )
@@ -4,50 +4,339 @@ Simple Plex Media Manager (PMM) for Surface
 A lightweight tool to manage your Plex media library
 """
 
+import time
+STARTED_AT = time.perf_counter()
+
 import os
 import sys
 import logging
 from dotenv import load_dotenv
-from plexapi.server import PlexServer
-from plexapi.exceptions import BadRequest, NotFound
 import yaml
-import requests
-import docker
-import schedule
-import time
+import argparse
+import contextvars
+import itertools
+import threading
 from datetime import datetime
+from functools import partial
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from log_pipeline import log_prefix, setup_logging_from_config
+from metrics import Metrics, start_metrics_server
+from snapshot import iter_items_by_key, iter_section_items, iter_section_keys
+from events import LibraryEventListener
+from plan import compute_plan, read_plan, snapshot_filename, write_plan
+from profiling import profile_phase, profiled, start_profiling, stop_profiling
+from rules import collections_for, compile_rules
+from state_store import Checkpoints, StateStore
+
+# plexapi/requests, asyncio and watchdog are imported where they are first
+# needed so quick commands and container cold starts skip them
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=getattr(logging, os.getenv('PMM_LOG_LEVEL', 'INFO')),
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('pmm.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
 logger = logging.getLogger(__name__)
 
+def load_config(config_path):
+    """Load pmm_config.yml from the config directory (empty dict if missing)"""
+    config_file = os.path.join(config_path, 'pmm_config.yml')
+    try:
+        with open(config_file, 'r', encoding='utf-8') as f:
+            return yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        logger.warning(f"Config file not found: {config_file}, using defaults")
+        return {}
+
+# Configure logging: records are queued and written by a background thread
+setup_logging_from_config(load_config(os.getenv('PMM_CONFIG_PATH', './config')),
+                          level=getattr(logging, os.getenv('PMM_LOG_LEVEL', 'INFO')))
+
+class PlexConnectionError(RuntimeError):
+    """Raised when PMM cannot connect to the Plex server"""
+
+def chunked(items, size):
+    """Yield successive lists of at most size items"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _search_args(search_key):
+    """The filter arguments of a library search path, ignoring sort and paging"""
+    query = (search_key or '').partition('?')[2]
+    return {key: value for key, value in parse_qsl(query) if key not in ('sort', 'limit')}
+
+class CollectionIndex:
+    """Per-run lookup of a library's collections by title and ratingKey"""
+    
+    def __init__(self, collections):
+        self.by_title = {}
+        self.by_key = {}
+        for collection in collections:
+            self.add(collection)
+    
+    @classmethod
+    def fetch(cls, library):
+        """Fetch the library's collections once and index them"""
+        return cls(library.collections())
+    
+    def __len__(self):
+        return len(self.by_key)
+    
+    def __contains__(self, title):
+        return title in self.by_title
+    
+    def get(self, title):
+        """Return the collection with this title, or None"""
+        return self.by_title.get(title)
+    
+    def get_by_key(self, rating_key):
+        """Return the collection with this ratingKey, or None"""
+        return self.by_key.get(int(rating_key))
+    
+    def add(self, collection):
+        """Record a collection that was fetched or just created"""
+        self.by_title[collection.title] = collection
+        self.by_key[int(collection.ratingKey)] = collection
+    
+    def remove(self, collection):
+        """Forget a collection that was deleted"""
+        self.by_key.pop(int(collection.ratingKey), None)
+        if self.by_title.get(collection.title) is collection:
+            del self.by_title[collection.title]
+
+# How rule collections are kept: written by PMM from synced items, or as
+# Plex smart collections whose filters Plex evaluates itself
+COLLECTION_MODES = ('static', 'smart')
+
+# Plex search type ids for the library types PMM builds collections in,
+# and for collections themselves
+SEARCH_TYPES = {'movie': 1, 'show': 2}
+COLLECTION_TYPE = 18
+
+# Butler tasks optimize_database runs by default, and words identifying
+# their entries in Plex's activity list
+BUTLER_ACTIVITIES = {
+    'OptimizeDatabase': ('optimiz',),
+    'CleanOldBundles': ('bundle',),
+}
+
+# Task run record for the last completed optimization, as opposed to the
+# optimize_database task, which also succeeds when it decides to skip
+OPTIMIZE_RECORD = 'plex_database_optimize'
+
+# Checkpoint runs for run_maintenance's task list and for full library
+# sweeps; each maintenance task checkpoints under its own name
+MAINTENANCE_RUN = 'maintenance'
+SYNC_RUN = 'sync'
+
+# Checkpoints of the maintenance task running in this context, if any
+_task_checkpoints = contextvars.ContextVar('task_checkpoints', default=None)
+
+# Task names accepted in maintenance.tasks and the methods that run them
+MAINTENANCE_TASKS = {
+    'scan_libraries': '_maintenance_scan',
+    'manage_collections': 'manage_collections',
+    'cleanup_temp_files': 'cleanup_temp_files',
+    'optimize_database': 'optimize_database',
+}
+
+
+def load_maintenance_tasks(maintenance):
+    """Normalize maintenance.tasks entries into {name, schedule, jitter} dicts
+
+    Entries are either a task name, which uses the default schedule, or a
+    mapping with ``name`` and optional ``schedule``/``jitter_seconds``.
+    """
+    default_schedule = os.getenv('RUN_SCHEDULE') or maintenance.get('schedule_time', '06:00')
+    default_jitter = float(maintenance.get('jitter_seconds', 0))
+    tasks = []
+    
+    for entry in maintenance.get('tasks', list(MAINTENANCE_TASKS)):
+        if isinstance(entry, str):
+            entry = {'name': entry}
+        name = entry.get('name')
+        if name not in MAINTENANCE_TASKS:
+            logger.warning(f"Ignoring unknown maintenance task: {name}")
+            continue
+        tasks.append({
+            'name': name,
+            'schedule': str(entry.get('schedule', default_schedule)),
+            'jitter': float(entry.get('jitter_seconds', default_jitter)),
+        })
+    
+    return tasks
+
+# Config sections a servers entry may override for that server only;
+# maintenance, logging, health and metrics are shared by the whole process
+SERVER_SECTIONS = ('libraries', 'collections', 'watcher', 'events', 'advanced', 'cleanup')
+
+
+def load_servers(config, names=None):
+    """Return the servers list of the config, or [None] for the PLEX_URL/PLEX_TOKEN server
+    
+    With names, only the servers of those names are returned.
+    """
+    servers = []
+    for index, entry in enumerate(config.get('servers') or []):
+        entry = dict(entry)
+        entry.setdefault('name', f"server{index + 1}")
+        if not entry.get('url'):
+            raise ValueError(f"Server '{entry['name']}' has no url")
+        if any(server['name'] == entry['name'] for server in servers):
+            raise ValueError(f"Duplicate server name '{entry['name']}'")
+        servers.append(entry)
+    
+    if names:
+        unknown = set(names) - {server['name'] for server in servers}
+        if unknown:
+            raise ValueError(f"Unknown server: {', '.join(sorted(unknown))}")
+        servers = [server for server in servers if server['name'] in names]
+    return servers or [None]
+
+
+def server_config(config, server):
+    """Merge a servers entry's section overrides over the shared config"""
+    config = {key: value for key, value in config.items() if key != 'servers'}
+    for section in SERVER_SECTIONS:
+        override = server.get(section)
+        if isinstance(override, dict) and isinstance(config.get(section), dict):
+            config[section] = _merge(config[section], override)
+        elif override is not None:
+            config[section] = override
+    return config
+
+
+def _merge(base, override):
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            value = _merge(merged[key], value)
+        merged[key] = value
+    return merged
+
+
+def server_slug(server_name):
+    """File-name-safe form of a server name"""
+    return ''.join(c if c.isalnum() else '_' for c in server_name).strip('_').lower() or 'server'
+
+
+def state_db_path(config_path, server_name=None):
+    """State database for a server; named servers each get their own file"""
+    path = os.getenv('PMM_STATE_DB', os.path.join(config_path, 'pmm_state.db'))
+    if not server_name:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}-{server_slug(server_name)}{ext}"
+
 class SimplePMM:
-    def __init__(self):
-        self.plex_url = os.getenv('PLEX_URL', 'http://localhost:32400')
-        self.plex_token = os.getenv('PLEX_TOKEN')
+    def __init__(self, server=None, metrics=None):
+        """Manage one Plex server
+        
+        ``server`` is an entry of the config's servers list; without one the
+        server comes from PLEX_URL/PLEX_TOKEN. ``metrics`` is a registry to
+        share with other servers, whose series are then labelled by server.
+        """
+        server = server or {}
+        self.name = server.get('name')
+        self.plex_url = server.get('url') or os.getenv('PLEX_URL', 'http://localhost:32400')
+        self.token_env = server.get('token_env', 'PLEX_TOKEN')
+        self.plex_token = server.get('token') or os.getenv(self.token_env)
         self.tmdb_api_key = os.getenv('TMDB_API_KEY')
         self.config_path = os.getenv('PMM_CONFIG_PATH', './config')
+        self.config = server_config(load_config(self.config_path), server)
+        self.write_batch_size = int(self.config.get('collections', {}).get('write_batch_size', 200))
+        self.collection_rules = compile_rules(self.config.get('collections'))
+        self.collection_mode = self.config.get('collections', {}).get('mode', 'static')
+        if self.collection_mode not in COLLECTION_MODES:
+            logger.warning(f"Unknown collections mode {self.collection_mode!r}, using static")
+            self.collection_mode = 'static'
+        
+        advanced = self.config.get('advanced', {})
+        self.max_workers = max(1, int(advanced.get('max_workers', 2)))
+        self.timeout = int(advanced.get('timeout', 300))
+        self.max_retries = max(0, int(advanced.get('max_retries', 3)))
+        self.page_size = max(1, int(advanced.get('page_size', 500)))
         
+        metrics_config = self.config.get('metrics', {})
+        metrics = metrics or Metrics()
+        self.metrics = metrics.labelled(server=self.name) if self.name else metrics
+        self.metrics_port = int(metrics_config.get('port', 8080))
+        self.metrics_summary_file = metrics_config.get('summary_file', 'logs/pmm_metrics.json')
+        
+        maintenance = self.config.get('maintenance', {})
+        self.wait_for_scan = bool(maintenance.get('wait_for_scan', False))
+        self.scan_timeout = int(maintenance.get('scan_timeout', 1800))
+        self.maintenance_tasks = load_maintenance_tasks(maintenance)
+        # Interrupted runs resume if their checkpoints are this recent; 0 disables
+        self.resume_max_age = float(maintenance.get('resume_within_hours', 12)) * 3600
+        
+        # Plex library path -> path where PMM sees the same folder
+        self.path_map = self.config.get('watcher', {}).get('path_map') or {}
+        self.watcher = None
+        
+        # Connected on first use of self.plex
+        self.session = None
+        self._plex = None
+        self._connect_lock = threading.Lock()
+        
+        # Held while Plex optimizes its database; scans wait for it
+        self._optimize_lock = threading.Lock()
+        
+        # Collection indexes for the current run, keyed by library key; only
+        # replaced or read while holding _collections_lock
+        self._collection_indexes = {}
+        
+        # Serializes collection builds between scheduled runs and library events
+        self._collections_lock = threading.RLock()
+        self.event_listener = None
+        
+        # Watermarks, item rows and last membership for incremental runs
+        self.state = StateStore(server.get('state_db') or state_db_path(self.config_path, self.name))
+        
+        # TMDb lookups, only set up when a collection rule needs them
+        self.tmdb = None
+        if any(rule_set.tmdb for rule_set in self.collection_rules.values()):
+            from tmdb import enricher_from_config
+            self.tmdb = enricher_from_config(self.config, self.tmdb_api_key, self.config_path, self.metrics)
+        
+        # Last run of each task, mirrored in memory so health checks never query
+        self.started_at = time.time()
+        self.task_runs = self.state.get_task_runs()
+        self.scheduler = None
+    
+    @property
+    def label(self):
+        """How this server is named in logs and health output"""
+        return self.name or self.plex_url
+    
+    @property
+    def plex(self):
+        """The PlexServer connection, opened on first use"""
+        if self._plex is None:
+            with self._connect_lock:
+                if self._plex is None:
+                    self._plex = self._connect()
+        return self._plex
+    
+    def _connect(self):
+        """Connect to Plex over the shared pooled session"""
         if not self.plex_token:
-            logger.error("PLEX_TOKEN not found in environment variables")
-            sys.exit(1)
-            
+            raise PlexConnectionError(f"{self.token_env} not found in environment variables")
+        
+        from plexapi.server import PlexServer
+        from plex_session import session_from_config
+        
+        started = time.perf_counter()
         try:
-            self.plex = PlexServer(self.plex_url, self.plex_token)
-            logger.info(f"Connected to Plex server: {self.plex.friendlyName}")
+            # Library workers plus the collection writers each of them runs
+            self.session = session_from_config(self.config, pool_size=self.max_workers * (self.max_workers + 1),
+                                               metrics=self.metrics)
+            self.metrics.instrument_session(self.session)
+            plex = PlexServer(self.plex_url, self.plex_token, session=self.session, timeout=self.timeout)
         except Exception as e:
-            logger.error(f"Failed to connect to Plex server: {e}")
-            sys.exit(1)
+            raise PlexConnectionError(f"Failed to connect to Plex server {self.label}: {e}") from e
+        logger.info(f"Connected to Plex server: {plex.friendlyName} ({time.perf_counter() - started:.2f}s)")
+        return plex
     
     def get_libraries(self):
         """Get all Plex libraries"""
@@ -61,42 +350,238 @@ class SimplePMM:
             logger.error(f"Error getting libraries: {e}")
             return []
     
-    def scan_library(self, library_name=None):
-        """Scan a specific library or all libraries"""
+    def scan_library(self, library_name=None, wait=False):
+        """Scan a specific library or all libraries; return whether every scan started"""
+        from plexapi.exceptions import NotFound
+        
+        errors = {}
         try:
             if library_name:
                 library = self.plex.library.section(library_name)
                 logger.info(f"Scanning library: {library_name}")
-                library.update()
+                with self._optimize_lock:
+                    library.update()
             else:
                 logger.info("Scanning all libraries")
-                for library in self.plex.library.sections():
-                    logger.info(f"Scanning: {library.title}")
-                    library.update()
+                errors = self.run_concurrently(self._scan_one, self.plex.library.sections())
+                if errors:
+                    logger.warning(f"Scan failed for {len(errors)} libraries: {', '.join(errors)}")
+            if wait:
+                self.wait_for_scans()
             logger.info("Library scan completed")
+            return not errors
         except NotFound:
             logger.error(f"Library '{library_name}' not found")
         except Exception as e:
             logger.error(f"Error scanning library: {e}")
+        return False
     
-    def optimize_database(self):
-        """Optimize Plex database"""
-        try:
+    def _scan_one(self, library):
+        """Trigger a scan of one library; the session retries transient HTTP failures"""
+        checkpoints = _task_checkpoints.get()
+        unit = f"library/{library.key}"
+        if checkpoints is not None and unit in checkpoints:
+            logger.info(f"Skipping scan of {library.title}, started before the interruption")
+            return
+        logger.info(f"Scanning: {library.title}")
+        with self._optimize_lock:
+            library.update()
+        if checkpoints is not None:
+            checkpoints.complete(unit)
+    
+    def scan_paths(self, library, folders):
+        """Trigger partial scans of the given local folders in one library"""
+        for folder in folders:
+            plex_path = self._to_plex_path(folder)
+            logger.info(f"Partial scan of {library.title}: {plex_path}")
+            with self._optimize_lock:
+                library.update(path=plex_path)
+            self.metrics.inc('pmm_partial_scans_total', library=library.title)
+    
+    def wait_for_scans(self, timeout=None):
+        """Poll until no library reports a scan in progress; return False on timeout"""
+        deadline = time.monotonic() + (timeout or self.scan_timeout)
+        delay = 2
+        while time.monotonic() < deadline:
+            # Plex may take a moment to flag a scan it just accepted
+            time.sleep(delay)
+            # Read the section list afresh; plexapi caches library.sections()
+            refreshing = [section.attrib.get('title') for section in self.plex.query('/library/sections')
+                          if section.attrib.get('refreshing') in ('1', 'true')]
+            if not refreshing:
+                return True
+            logger.debug(f"Waiting for scans: {', '.join(refreshing)}")
+            delay = min(delay * 2, 30)
+        logger.warning(f"Library scans still running after {timeout or self.scan_timeout}s")
+        return False
+    
+    def _to_plex_path(self, path):
+        for plex_root, local_root in self.path_map.items():
+            if path == local_root or path.startswith(local_root.rstrip('/\\') + os.sep):
+                return plex_root + path[len(local_root):].replace(os.sep, '/')
+        return path
+    
+    def _to_local_path(self, path):
+        for plex_root, local_root in self.path_map.items():
+            if path == plex_root or path.startswith(plex_root.rstrip('/') + '/'):
+                return os.path.normpath(local_root + path[len(plex_root):])
+        return path
+    
+    def watch_libraries(self):
+        """Start a filesystem watcher that triggers partial scans for changed folders"""
+        watcher_config = self.config.get('watcher', {})
+        library_settings = self.config.get('libraries', {})
+        roots = {}
+        for library in self.plex.library.sections():
+            if not library_settings.get(library.title, {}).get('auto_scan', True):
+                continue
+            for location in library.locations:
+                roots[self._to_local_path(location)] = library
+        
+        def on_changes(root, folders):
+            self.scan_paths(roots[root], folders)
+        
+        from watcher import LibraryWatcher
+        
+        self.watcher = LibraryWatcher(
+            list(roots), on_changes,
+            debounce=float(watcher_config.get('debounce_seconds', 10)),
+            max_delay=float(watcher_config.get('max_delay_seconds', 300)),
+            poll_interval=float(watcher_config.get('poll_interval', 60)),
+            use_polling=bool(watcher_config.get('force_polling', False)),
+        ).start()
+        return self.watcher
+    
+    def with_retries(self, func, *args, description="Plex request", **kwargs):
+        """Call func, retrying failures with exponential backoff up to max_retries times
+        
+        Idempotent requests are already retried by the shared session; this is
+        for multi-request operations that are safe to repeat as a whole.
+        """
+        from plexapi.exceptions import BadRequest, NotFound
+        
+        for attempt in range(self.max_retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except (BadRequest, NotFound):
+                raise
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = min(2 ** attempt, 30)
+                logger.warning(f"{description} failed ({e}), retry {attempt + 1}/{self.max_retries} in {delay}s")
+                time.sleep(delay)
+    
+    def run_concurrently(self, func, items, name=lambda item: item.title):
+        """Run func over items on a bounded worker pool; return {name: error} for failures"""
+        items = list(items)
+        errors = {}
+        if not items:
+            return errors
+        
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as pool:
+            # Workers inherit the caller's context, and with it the log prefix
+            futures = {pool.submit(contextvars.copy_context().run, profiled(func), item): name(item) for item in items}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"{futures[future]} failed: {e}")
+                    errors[futures[future]] = str(e)
+        return errors
+    
+    def optimize_database(self, force=False):
+        """Run the configured Plex butler tasks one at a time, waiting for each to finish
+        
+        Skipped unless enough items changed since the last optimization or
+        it is overdue. Scans PMM would trigger meanwhile wait until it is
+        done; scans already running are waited out first.
+        """
+        from plexapi.exceptions import BadRequest
+        
+        optimize = self.config.get('maintenance', {}).get('optimize') or {}
+        butler_tasks = optimize.get('butler_tasks') or list(BUTLER_ACTIVITIES)
+        timeout = float(optimize.get('timeout', 3600))
+        if not force and not self._optimize_needed(optimize):
+            return True
+        
+        with self._optimize_lock:
             logger.info("Starting database optimization")
-            # This would typically be done through Plex Web UI or API
-            # For now, we'll just log the action
-            logger.info("Database optimization completed")
-        except Exception as e:
-            logger.error(f"Error optimizing database: {e}")
+            started = time.time()
+            if not self.wait_for_scans():
+                logger.warning("Skipping database optimization while library scans are running")
+                return False
+            for task in butler_tasks:
+                phase_started = time.perf_counter()
+                try:
+                    with self.metrics.timer('pmm_optimize_phase_seconds', phase=task):
+                        self.plex.runButlerTask(task)
+                        finished = self._wait_for_activities(BUTLER_ACTIVITIES.get(task, (task.lower(),)), timeout)
+                except BadRequest as e:
+                    logger.error(f"Plex rejected butler task {task}: {e}")
+                    return False
+                if not finished:
+                    logger.warning(f"Butler task {task} still running after {timeout:.0f}s")
+                    return False
+                logger.info(f"Butler task {task} finished in {time.perf_counter() - phase_started:.1f}s")
+            self.set_task_run(OPTIMIZE_RECORD, started, time.time(), True)
+            logger.info(f"Database optimization completed in {time.time() - started:.1f}s")
+            return True
     
-    def cleanup_temp_files(self):
-        """Clean up temporary files"""
-        try:
-            logger.info("Cleaning up temporary files")
-            # Add cleanup logic here based on your needs
-            logger.info("Temporary file cleanup completed")
-        except Exception as e:
-            logger.error(f"Error cleaning temp files: {e}")
+    def _optimize_needed(self, optimize):
+        """Whether enough changed since the last optimization to be worth another"""
+        last = (self.task_runs.get(OPTIMIZE_RECORD) or {}).get('last_success_at')
+        if last is None:
+            return True
+        days = (time.time() - last) / 86400
+        if days >= float(optimize.get('max_interval_days', 30)):
+            return True
+        min_changes = int(optimize.get('min_changes', 500))
+        changed = 0
+        for library in self.plex.library.sections():
+            # An empty page still reports how many items match
+            container = self.plex.query(f"/library/sections/{library.key}/all?updatedAt>>={int(last)}"
+                                        f"&X-Plex-Container-Start=0&X-Plex-Container-Size=0")
+            changed += int(container.attrib.get('totalSize', container.attrib.get('size', 0)))
+            if changed >= min_changes:
+                return True
+        logger.info(f"Skipping database optimization: {changed} items changed since the last one "
+                    f"{days:.1f} days ago (threshold {min_changes})")
+        return False
+    
+    def _wait_for_activities(self, keywords, timeout):
+        """Poll Plex activities with backoff until none match keywords; return False on timeout"""
+        deadline = time.monotonic() + timeout
+        delay = 1
+        while time.monotonic() < deadline:
+            # Plex may take a moment to list an activity it just started
+            time.sleep(delay)
+            running = [activity for activity in self.plex.activities
+                       if any(keyword in f'{activity.type} {activity.title}'.lower() for keyword in keywords)]
+            if not running:
+                return True
+            logger.debug(f"Waiting for {', '.join(f'{a.title} ({a.progress}%)' for a in running)}")
+            delay = min(delay * 2, 30)
+        return False
+    
+    def cleanup_temp_files(self, dry_run=None):
+        """Apply the cleanup policies to temp and transcode directories; return whether all succeeded"""
+        from cleanup import engine_from_config
+        
+        engine = engine_from_config(self.config.get('cleanup'), dry_run)
+        if engine is None:
+            logger.info("No cleanup directories configured")
+            return True
+        
+        logger.info("Cleaning up temporary files" + (" (dry run)" if engine.dry_run else ""))
+        results = engine.run()
+        if not engine.dry_run:
+            for result in results:
+                self.metrics.inc('pmm_cleanup_files_total', result['deleted_files'], path=result['path'])
+                self.metrics.inc('pmm_cleanup_bytes_total', result['deleted_bytes'], path=result['path'])
+        logger.info(f"Temporary file cleanup completed: {sum(r['deleted_files'] for r in results)} files, "
+                    f"{sum(r['deleted_bytes'] for r in results) / 1024 ** 2:.1f} MB")
+        return not any(result['errors'] for result in results)
     
     def get_server_status(self):
         """Get Plex server status"""
@@ -115,186 +600,871 @@ class SimplePMM:
             logger.error(f"Error getting server status: {e}")
             return None
     
+    def run_task(self, name):
+        """Run one maintenance task by name; return whether it succeeded
+        
+        Libraries the task finishes are checkpointed, so if the process dies
+        partway the next run of the task skips them.
+        """
+        task = getattr(self, MAINTENANCE_TASKS[name])
+        checkpoints = self._checkpoints(name)
+        if checkpoints:
+            logger.info(f"Resuming interrupted {name} run, skipping the {len(checkpoints)} units it finished")
+        token = _task_checkpoints.set(checkpoints)
+        try:
+            with self.metrics.timer('pmm_task_duration_seconds', task=name), profile_phase(name):
+                result = task()
+        except Exception as e:
+            logger.error(f"Maintenance task {name} failed: {e}")
+            result = False
+        finally:
+            _task_checkpoints.reset(token)
+        # Only reached when the run wasn't cut short; failed work is redone next run
+        checkpoints.finish()
+        return result is not False
+    
+    def _checkpoints(self, run):
+        """Checkpoints left by an interrupted run, kept only while resuming is enabled"""
+        if not self.resume_max_age:
+            return Checkpoints(None, run)
+        return Checkpoints(self.state, run, self.resume_max_age)
+    
+    def get_task_run(self, name):
+        """When a task last started, for the scheduler's catch-up"""
+        run = self.task_runs.get(name)
+        return run['started_at'] if run else None
+    
+    def set_task_run(self, name, started_at, finished_at, success):
+        """Record a task run in memory and in the state store"""
+        previous = self.task_runs.get(name, {})
+        self.task_runs[name] = {
+            'started_at': started_at,
+            'finished_at': finished_at,
+            'success': success,
+            'last_success_at': finished_at if success else previous.get('last_success_at'),
+        }
+        self.state.set_task_run(name, started_at, finished_at, success)
+        if success:
+            self.metrics.set('pmm_task_last_run_timestamp_seconds', finished_at, task=name)
+    
+    def health_status(self, ready=False):
+        """Return (healthy, status) for /healthz or /readyz without calling Plex
+        
+        Alive means the process is serving. Ready additionally needs a Plex
+        connection and the latest run of every task to have succeeded.
+        """
+        next_runs = self.scheduler.next_runs if self.scheduler else {}
+        tasks = {}
+        problems = []
+        for task in self.maintenance_tasks:
+            run = self.task_runs.get(task['name'])
+            tasks[task['name']] = dict(run or {}, next_run_at=next_runs.get(task['name']))
+            if run and not run['success']:
+                problems.append(f"last {task['name']} run failed")
+        
+        status = {
+            'status': 'alive',
+            'uptime_seconds': round(time.time() - self.started_at),
+            'plex_connected': self._plex is not None,
+            'tasks': tasks,
+        }
+        if not ready:
+            return True, status
+        
+        if self._plex is None:
+            problems.insert(0, "not connected to Plex")
+        status['status'] = 'not ready' if problems else 'ready'
+        status['problems'] = problems
+        return not problems, status
+    
     def run_maintenance(self):
-        """Run routine maintenance tasks"""
+        """Run every configured maintenance task once, in configured order; return whether all succeeded"""
         logger.info("Starting routine maintenance")
-        self.scan_library()
-        self.manage_collections()
-        self.cleanup_temp_files()
-        self.optimize_database()
+        checkpoints = self._checkpoints(MAINTENANCE_RUN)
+        succeeded = True
+        for task in self.maintenance_tasks:
+            if task['name'] in checkpoints:
+                logger.info(f"Skipping {task['name']}, completed before the interruption")
+                continue
+            started = time.time()
+            success = self.run_task(task['name'])
+            self.set_task_run(task['name'], started, time.time(), success)
+            if success:
+                checkpoints.complete(task['name'])
+            succeeded = succeeded and success
+        checkpoints.finish()
+        self.metrics.set('pmm_last_run_timestamp_seconds', time.time())
         logger.info("Routine maintenance completed")
+        return succeeded
+    
+    def _maintenance_scan(self):
+        """Full scan, unless the watcher is already scanning changed folders"""
+        if self.watcher is not None:
+            logger.info("Filesystem watcher active, skipping full library scan")
+            if self.wait_for_scan:
+                self.wait_for_scans()
+            return
+        self.scan_library(wait=self.wait_for_scan)
     
     def create_collections(self, library_name=None):
         """Create automatic collections based on popular criteria"""
         try:
             logger.info("Creating automatic collections")
+            libraries = self._collection_libraries(library_name)
             
-            if library_name:
-                libraries = [self.plex.library.section(library_name)]
-            else:
-                libraries = [lib for lib in self.plex.library.sections() if lib.type in ['movie', 'show']]
-            
-            for library in libraries:
-                logger.info(f"Processing collections for library: {library.title}")
-                
-                if library.type == 'movie':
-                    self._create_movie_collections(library)
-                elif library.type == 'show':
-                    self._create_tv_collections(library)
+            with self._collections_lock:
+                self._collection_indexes = {}
+                errors = self.run_concurrently(self._process_library_collections, libraries)
+            if errors:
+                logger.warning(f"Collections failed for {len(errors)} libraries: {', '.join(errors)}")
+            return errors
                     
         except Exception as e:
             logger.error(f"Error creating collections: {e}")
+            return {library_name or 'all libraries': str(e)}
     
-    def _create_movie_collections(self, library):
-        """Create movie-specific collections"""
-        try:
-            # Get all movies
-            movies = library.all()
-            
-            # Group by decade
-            decades = {}
-            for movie in movies:
-                if hasattr(movie, 'year') and movie.year:
-                    decade = (movie.year // 10) * 10
-                    if decade not in decades:
-                        decades[decade] = []
-                    decades[decade].append(movie)
-            
-            # Create decade collections (only if 5+ movies)
-            for decade, decade_movies in decades.items():
-                if len(decade_movies) >= 5:
-                    collection_name = f"{decade}s Movies"
-                    self._create_or_update_collection(library, collection_name, decade_movies)
-            
-            # Create genre collections
-            genres = {}
-            for movie in movies:
-                if hasattr(movie, 'genres'):
-                    for genre in movie.genres:
-                        genre_name = genre.tag
-                        if genre_name not in genres:
-                            genres[genre_name] = []
-                        genres[genre_name].append(movie)
-            
-            # Create genre collections (only if 10+ movies)
-            for genre, genre_movies in genres.items():
-                if len(genre_movies) >= 10:
-                    collection_name = f"{genre} Movies"
-                    self._create_or_update_collection(library, collection_name, genre_movies)
+    def _process_library_collections(self, library):
+        """Build the collections for one library"""
+        checkpoints = _task_checkpoints.get()
+        unit = f"library/{library.key}"
+        if checkpoints is not None and unit in checkpoints:
+            logger.info(f"Skipping {library.title}, its collections were done before the interruption")
+            return
+        logger.info(f"Processing collections for library: {library.title}")
+        started = time.perf_counter()
+        
+        with self.metrics.timer('pmm_library_duration_seconds', library=library.title), profile_phase(library.title):
+            if library.type not in SEARCH_TYPES:
+                return
+            if self.collection_mode == 'smart':
+                processed = self._create_smart_collections(library)
+            elif library.type == 'movie':
+                processed = self._create_movie_collections(library)
+            else:
+                processed = self._create_tv_collections(library)
+        
+        self.metrics.inc('pmm_items_processed_total', processed, library=library.title)
+        self.metrics.set('pmm_items_per_second', round(processed / max(time.perf_counter() - started, 1e-6), 1),
+                         library=library.title)
+        if checkpoints is not None:
+            checkpoints.complete(unit)
+    
+    def _iter_items(self, library, filters=None, start=0):
+        """Stream lightweight item records for a library"""
+        return iter_section_items(self.plex.query, library.key, self.page_size, filters, start)
+    
+    def _full_sync(self, library):
+        """Replace a library's stored items with a full sweep
+        
+        Progress is checkpointed as rows are committed, so a sweep cut short
+        continues where it stopped. Items that moved in Plex's order
+        meanwhile can be skipped; the next run's key reconciliation
+        fetches them.
+        """
+        checkpoints = self._checkpoints(SYNC_RUN)
+        unit = str(library.key)
+        start = int(checkpoints.get(unit) or 0)
+        if start:
+            logger.info(f"Resuming full sync of {library.title} after {start} items")
+        self.state.upsert_items(library.key, self._iter_items(library, start=start), replace=not start,
+                                progress=lambda written: checkpoints.complete(unit, start + written))
+        checkpoints.discard(unit)
+    
+    def _load_snapshot(self, library):
+        """Sync changed items into the state store and return a library snapshot"""
+        watermark = self.state.get_watermark(library.key)
+        
+        if watermark is None:
+            logger.info(f"No sync watermark for {library.title}, fetching full library")
+            self._full_sync(library)
+        else:
+            # New items normally bump updatedAt too; addedAt catches the rest
+            written = self.state.upsert_items(library.key, self._iter_items(library, {'updatedAt>>': watermark[0] - 1}))
+            written += self.state.upsert_items(library.key, self._iter_items(library, {'addedAt>>': watermark[1] - 1}))
+            logger.info(f"Fetched {written} changed items from {library.title}")
             
-            # Create rating-based collections
-            highly_rated = [m for m in movies if hasattr(m, 'rating') and m.rating and m.rating >= 8.0]
-            if len(highly_rated) >= 5:
-                self._create_or_update_collection(library, "Highly Rated Movies", highly_rated)
-                
-        except Exception as e:
-            logger.error(f"Error creating movie collections: {e}")
+            self._reconcile_keys(library)
+        
+        return self.state.load_snapshot(library.key)
+    
+    def _reconcile_keys(self, library):
+        """Match the stored items to a key-only listing of the library
+        
+        Deletions don't bump any watermark, and comparing counts misses a
+        deletion whenever an addition balances it, so the stored ratingKeys
+        are checked against the keys Plex lists. Gone items are dropped;
+        items the watermark sweeps missed are fetched by ratingKey.
+        """
+        listed = set(iter_section_keys(self.plex.query, library.key, self.page_size))
+        stored = self.state.get_rating_keys(library.key)
+        deleted, missing = stored - listed, listed - stored
+        if deleted or missing:
+            logger.info(f"{library.title}: removing {len(deleted)} deleted items, fetching {len(missing)} missed items")
+            self.state.delete_items(library.key, deleted)
+            self.state.upsert_items(library.key, iter_items_by_key(self.plex.query, sorted(missing), self.write_batch_size),
+                                    advance_watermark=False)
+    
+    def _create_movie_collections(self, library):
+        """Create movie-specific collections; return the number of movies considered"""
+        with profile_phase('sync'):
+            snapshot = self._load_snapshot(library)
+        with profile_phase('rules'):
+            collections = collections_for('movie', snapshot, self.collection_rules, self._enrich(library))
+        with profile_phase('write'):
+            self._apply_collections(library, collections)
+        return len(snapshot)
     
     def _create_tv_collections(self, library):
-        """Create TV show-specific collections"""
-        try:
-            shows = library.all()
-            
-            # Group by network/studio
-            networks = {}
-            for show in shows:
-                if hasattr(show, 'studio') and show.studio:
-                    network = show.studio
-                    if network not in networks:
-                        networks[network] = []
-                    networks[network].append(show)
-            
-            # Create network collections (only if 3+ shows)
-            for network, network_shows in networks.items():
-                if len(network_shows) >= 3:
-                    collection_name = f"{network} Shows"
-                    self._create_or_update_collection(library, collection_name, network_shows)
+        """Create TV show-specific collections; return the number of shows considered"""
+        with profile_phase('sync'):
+            snapshot = self._load_snapshot(library)
+        with profile_phase('rules'):
+            collections = collections_for('show', snapshot, self.collection_rules, self._enrich(library))
+        with profile_phase('write'):
+            self._apply_collections(library, collections)
+        return len(snapshot)
+    
+    def _create_smart_collections(self, library):
+        """Keep the rule collections as Plex smart collections; return the library's item count
+        
+        Only filter values and item counts are fetched: Plex evaluates the
+        filters and keeps membership current itself. TMDb rules have no
+        Plex filter, so they are still synced and written as regular
+        collections.
+        """
+        rule_set = self.collection_rules.get(library.type)
+        if not rule_set:
+            return library.totalSize
+        
+        with profile_phase('rules'):
+            choices = {column: self._filter_choices(library, column) for column in rule_set.columns}
+            candidates = rule_set.server_filters(choices)
+            counts = {}
             
-            # Create genre collections
-            genres = {}
-            for show in shows:
-                if hasattr(show, 'genres'):
-                    for genre in show.genres:
-                        genre_name = genre.tag
-                        if genre_name not in genres:
-                            genres[genre_name] = []
-                        genres[genre_name].append(show)
+            def count(candidate):
+                counts[candidate[0]] = self._count_items(library, candidate[1])
             
-            # Create genre collections (only if 5+ shows)
-            for genre, genre_shows in genres.items():
-                if len(genre_shows) >= 5:
-                    collection_name = f"{genre} TV Shows"
-                    self._create_or_update_collection(library, collection_name, genre_shows)
-                    
+            errors = self.run_concurrently(count, candidates, name=lambda candidate: candidate[0])
+            if errors:
+                raise RuntimeError(f"{len(errors)} filter counts failed")
+            wanted = [(title, filters) for title, filters, minimum_items in candidates
+                      if counts[title] >= minimum_items]
+        
+        with profile_phase('write'):
+            # Load the index before fanning out so workers share one fetch
+            self._get_collection_index(library)
+            errors = self.run_concurrently(lambda entry: self._write_smart_collection(library, *entry), wanted,
+                                           name=lambda entry: entry[0])
+        logger.info(f"{library.title}: {len(wanted)} smart collections from {len(candidates)} filters")
+        
+        enrichment = None
+        if rule_set.tmdb:
+            with profile_phase('sync'):
+                self._load_snapshot(library)
+            enrichment = self._enrich(library)
+        if enrichment is not None:
+            with profile_phase('write'):
+                self._apply_collections(library, rule_set.evaluate_tmdb(enrichment))
+        elif not rule_set.tmdb:
+            # Memberships recorded by static runs no longer describe these collections
+            self.state.prune_memberships(library.key, ())
+        
+        if errors:
+            raise RuntimeError(f"{len(errors)} smart collection writes failed")
+        return library.totalSize
+    
+    def _filter_choices(self, library, field):
+        """Return the (filter value, title) pairs Plex lists for a field in a library"""
+        return [(element.attrib['key'], element.attrib.get('title', element.attrib['key']))
+                for element in self.plex.query(f"/library/sections/{library.key}/{field}")
+                if 'key' in element.attrib]
+    
+    def _smart_search_key(self, library, filters):
+        """The library search a smart collection with these filters runs"""
+        params = dict({'type': SEARCH_TYPES[library.type]}, **filters)
+        return f"/library/sections/{library.key}/all?{urlencode(params, safe='>')}"
+    
+    def _count_items(self, library, filters):
+        """Count the items matching Plex filters without fetching any of them"""
+        container = self.plex.query(f"{self._smart_search_key(library, filters)}"
+                                    f"&X-Plex-Container-Start=0&X-Plex-Container-Size=0")
+        return int(container.attrib.get('totalSize', 0))
+    
+    def _write_smart_collection(self, library, title, filters):
+        """Create or update a smart collection so it runs the given filters"""
+        try:
+            self._retry_collection_write(self._sync_smart_collection, library, title, filters)
         except Exception as e:
-            logger.error(f"Error creating TV collections: {e}")
+            logger.error(f"Error managing collection {title}: {e}")
+            self.metrics.inc('pmm_collections_total', action='failed')
+            raise
     
-    def _create_or_update_collection(self, library, collection_name, items):
-        """Create or update a collection with given items"""
+    def _sync_smart_collection(self, library, title, filters):
+        """Point a smart collection at the filters, replacing a regular collection of the same title"""
+        from plexapi.collection import Collection
+        
+        index = self._get_collection_index(library)
+        existing = index.get(title)
+        search_key = self._smart_search_key(library, filters)
+        uri = f"server://{self.plex.machineIdentifier}/com.plexapp.plugins.library{search_key}"
+        
+        if existing is not None and existing.smart:
+            if _search_args(existing.content) == _search_args(search_key):
+                logger.debug(f"Smart collection already up to date: {title}")
+                self.metrics.inc('pmm_collections_total', action='unchanged')
+                return
+            logger.info(f"Updating smart collection filters: {title}")
+            self.plex.query(f"{existing.key}/items?{urlencode({'uri': uri})}", method=self.session.put)
+            self.metrics.inc('pmm_collections_total', action='updated')
+            return
+        
+        if existing is not None:
+            logger.info(f"Replacing collection with a smart collection: {title}")
+            existing.delete()
+            index.remove(existing)
+        else:
+            logger.info(f"Creating smart collection: {title}")
+        args = {'type': SEARCH_TYPES[library.type], 'title': title, 'smart': 1,
+                'sectionId': library.key, 'uri': uri}
+        container = self.plex.query(f"/library/collections?{urlencode(args)}", method=self.session.post)
+        index.add(Collection(self.plex, container[0]))
+        self.metrics.inc('pmm_collections_total', action='created')
+    
+    def _enrich(self, library):
+        """TMDb details for a library's items, or None when TMDb rules can't run
+        
+        Without complete data the TMDb collections are left as they are.
+        """
+        rule_set = self.collection_rules.get(library.type)
+        if self.tmdb is None or not rule_set or not rule_set.tmdb:
+            return None
+        from tmdb import TMDbError
+        
+        started = time.perf_counter()
         try:
-            # Check if collection already exists
-            existing_collections = library.collections()
-            existing_collection = None
+            enrichment = self.tmdb.enrich(library.type, self.state.get_guids(library.key))
+        except TMDbError as e:
+            logger.warning(f"{library.title}: skipping TMDb collections this run ({e})")
+            return None
+        logger.info(f"{library.title}: matched {len(enrichment)} items on TMDb "
+                    f"in {time.perf_counter() - started:.2f}s")
+        return enrichment
+    
+    def _collection_libraries(self, library_name=None):
+        """Return the named library, or every movie and show library"""
+        if library_name:
+            return [self.plex.library.section(library_name)]
+        return [lib for lib in self.plex.library.sections() if lib.type in ['movie', 'show']]
+    
+    def export_snapshots(self, output_dir, library_name=None):
+        """Sync libraries and save each one's snapshot file for offline planning"""
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        paths = []
+        
+        for library in self._collection_libraries(library_name):
+            snapshot = self._load_snapshot(library)
+            path = snapshot.save(output_dir / snapshot_filename(library), meta={
+                'key': str(library.key),
+                'title': library.title,
+                'type': library.type,
+                'server': self.plex.friendlyName,
+                'exported_at': time.time(),
+            })
+            logger.info(f"Exported {len(snapshot)} items from {library.title} to {path}")
+            paths.append(path)
+        
+        return paths
+    
+    def apply_plan(self, plan_path):
+        """Write the collections of a plan file in one batched phase; return errors"""
+        plan = read_plan(plan_path)
+        entries = []
+        
+        for entry in plan['libraries']:
+            library = self.plex.library.sectionByID(int(entry['key']))
+            if library.totalSize != entry['items']:
+                logger.warning(f"{library.title} has {library.totalSize} items but the plan was computed "
+                               f"from {entry['items']}; memberships may be stale")
+            entries.append((library, entry['collections']))
+        
+        with self._collections_lock:
+            self._collection_indexes = {}
+            errors = self.run_concurrently(lambda entry: self._apply_collections(*entry), entries,
+                                           name=lambda entry: entry[0].title)
+        if errors:
+            logger.warning(f"Plan failed for {len(errors)} libraries: {', '.join(errors)}")
+        return errors
+    
+    def apply_item_changes(self, section_key, changed_keys, deleted_keys):
+        """Patch the state store with changed/deleted items and rewrite affected collections"""
+        library = self.plex.library.sectionByID(int(section_key))
+        if library.type not in ('movie', 'show'):
+            return
+        
+        with self._collections_lock:
+            if self.state.get_watermark(library.key) is None:
+                # Never synced: nothing to patch, build everything
+                self._process_library_collections(library)
+                return
             
-            for collection in existing_collections:
-                if collection.title == collection_name:
-                    existing_collection = collection
-                    break
+            logger.info(f"{library.title}: applying {len(changed_keys)} changed, {len(deleted_keys)} deleted items")
+            self.state.delete_items(library.key, deleted_keys)
+            self.state.upsert_items(library.key, iter_items_by_key(self.plex.query, changed_keys, self.write_batch_size),
+                                    advance_watermark=False)
             
-            if existing_collection:
-                # Update existing collection
-                logger.info(f"Updating collection: {collection_name} ({len(items)} items)")
-                # Note: Plex API doesn't have a direct way to bulk update collections
-                # This would require adding/removing items individually
+            if self.collection_mode == 'smart':
+                # Plex keeps smart collections current; only TMDb rules need the change
+                enrichment = self._enrich(library)
+                if enrichment is None:
+                    return
+                collections = self.collection_rules[library.type].evaluate_tmdb(enrichment)
             else:
-                # Create new collection
-                logger.info(f"Creating collection: {collection_name} ({len(items)} items)")
-                # Note: This requires the createCollection method which varies by library type
-                # For now, we'll log the action
-                logger.info(f"Would create collection '{collection_name}' with {len(items)} items")
-                
+                snapshot = self.state.load_snapshot(library.key)
+                collections = collections_for(library.type, snapshot, self.collection_rules, self._enrich(library))
+            self._collection_indexes.pop(library.key, None)
+            self._apply_collections(library, collections)
+    
+    def listen_for_changes(self):
+        """Start reacting to Plex library alerts with debounced incremental updates"""
+        events_config = self.config.get('events', {})
+        self.event_listener = LibraryEventListener(
+            self.plex, self.apply_item_changes,
+            debounce=float(events_config.get('debounce_seconds', 30)),
+            max_delay=float(events_config.get('max_delay_seconds', 300)),
+            max_attempts=int(events_config.get('max_attempts', 3)),
+            on_dropped=self._resync_library,
+        ).start()
+        return self.event_listener
+    
+    def _resync_library(self, section_key):
+        """Make the next sync of a library a full sweep, after its changes could not be applied"""
+        logger.warning(f"Section {section_key} will be fully resynced on the next collections run")
+        self.state.clear_watermark(section_key)
+    
+    def _apply_collections(self, library, collections):
+        """Write only the collections whose membership changed since the last run"""
+        previous = self.state.get_memberships(library.key)
+        changed = []
+        
+        for collection_name, rating_keys in collections.items():
+            rating_keys = sorted(rating_keys)
+            if previous.get(collection_name) != rating_keys:
+                changed.append((collection_name, rating_keys))
+        
+        # Load the index before fanning out so workers share one fetch
+        self._get_collection_index(library)
+        
+        def write(entry):
+            collection_name, rating_keys = entry
+            if not self._create_or_update_collection(library, collection_name, rating_keys):
+                raise RuntimeError(f"could not write {collection_name}")
+            self.state.set_membership(library.key, collection_name, rating_keys)
+        
+        self.metrics.inc('pmm_collections_total', len(collections) - len(changed), action='skipped')
+        errors = self.run_concurrently(write, changed, name=lambda entry: entry[0])
+        self.state.prune_memberships(library.key, collections)
+        logger.info(f"{library.title}: {len(changed)} collections changed, {len(collections) - len(changed)} unchanged")
+        
+        if errors:
+            raise RuntimeError(f"{len(errors)} collection writes failed")
+    
+    def _get_collection_index(self, library):
+        """Return this run's collection index for a library, fetching it once"""
+        index = self._collection_indexes.get(library.key)
+        if index is None:
+            index = CollectionIndex.fetch(library)
+            self._collection_indexes[library.key] = index
+            logger.debug(f"Indexed {len(index)} existing collections in {library.title}")
+        return index
+    
+    def _items_uri(self, rating_keys):
+        """The server:// uri Plex takes for a batch of items, built from their ratingKeys"""
+        return (f"server://{self.plex.machineIdentifier}/com.plexapp.plugins.library"
+                f"/library/metadata/{','.join(str(key) for key in rating_keys)}")
+    
+    def _add_collection_items(self, collection, rating_keys):
+        """Add ratingKeys to a collection, one PUT per write_batch_size items"""
+        for batch in chunked(rating_keys, self.write_batch_size):
+            self.plex.query(f"{collection.key}/items?{urlencode({'uri': self._items_uri(batch)})}",
+                            method=self.session.put)
+    
+    def _remove_collection_items(self, collection, rating_keys):
+        """Remove ratingKeys from a collection
+        
+        Plex only removes collection members one at a time, so this is one
+        DELETE per item and write_batch_size does not apply.
+        """
+        for rating_key in rating_keys:
+            self.plex.query(f"{collection.key}/items/{rating_key}", method=self.session.delete)
+    
+    def _collection_item_keys(self, collection):
+        """Return the ratingKeys currently in a collection"""
+        return {int(element.attrib['ratingKey']) for element in self.plex.query(f"{collection.key}/children")}
+    
+    def _retry_collection_write(self, sync, library, title, *args):
+        """Call sync(library, title, *args) with retries, re-reading the collection before each retry
+        
+        Creates and deletes are not idempotent: one whose response was lost
+        may still have happened, and retrying from the stale index would
+        create a second collection of the same title.
+        """
+        attempts = itertools.count()
+        
+        def attempt():
+            if next(attempts):
+                self._refresh_collection(library, title)
+            sync(library, title, *args)
+        
+        self.with_retries(attempt, description=f"Write of {title}")
+    
+    def _refresh_collection(self, library, title):
+        """Replace a collection's index entry with what Plex has now"""
+        from plexapi.collection import Collection
+        
+        index = self._get_collection_index(library)
+        stale = index.get(title)
+        if stale is not None:
+            index.remove(stale)
+        key = f"/library/sections/{library.key}/all?{urlencode({'type': COLLECTION_TYPE, 'title': title})}"
+        for element in self.plex.query(key):
+            if element.attrib.get('title') == title:
+                index.add(Collection(self.plex, element, initpath=key))
+                return
+    
+    def _create_or_update_collection(self, library, collection_name, rating_keys):
+        """Create or update a collection so it holds exactly the given ratingKeys"""
+        try:
+            self._retry_collection_write(self._sync_collection, library, collection_name, rating_keys)
+            return True
         except Exception as e:
             logger.error(f"Error managing collection {collection_name}: {e}")
+            self.metrics.inc('pmm_collections_total', action='failed')
+            return False
+    
+    def _sync_collection(self, library, collection_name, rating_keys):
+        """Diff a collection against the desired ratingKeys and send batched writes"""
+        index = self._get_collection_index(library)
+        existing_collection = index.get(collection_name)
+        
+        if existing_collection and existing_collection.smart:
+            # Left by smart mode; Plex won't take explicit members
+            logger.info(f"Replacing smart collection with a regular collection: {collection_name}")
+            existing_collection.delete()
+            index.remove(existing_collection)
+            existing_collection = None
+        
+        if existing_collection:
+            # Diff against what Plex has and only send the difference
+            current = self._collection_item_keys(existing_collection)
+            desired = set(rating_keys)
+            to_add = sorted(desired - current)
+            to_remove = sorted(current - desired)
+            
+            if not to_add and not to_remove:
+                logger.debug(f"Collection already up to date: {collection_name}")
+                self.metrics.inc('pmm_collections_total', action='unchanged')
+                return
+            
+            logger.info(f"Updating collection: {collection_name} (+{len(to_add)} / -{len(to_remove)} items)")
+            self._add_collection_items(existing_collection, to_add)
+            self._remove_collection_items(existing_collection, to_remove)
+            self.metrics.inc('pmm_collections_total', action='updated')
+        else:
+            from plexapi.collection import Collection
+            
+            logger.info(f"Creating collection: {collection_name} ({len(rating_keys)} items)")
+            rating_keys = list(rating_keys)
+            first = rating_keys[:self.write_batch_size]
+            args = {'type': SEARCH_TYPES[library.type], 'title': collection_name, 'smart': 0,
+                    'sectionId': library.key, 'uri': self._items_uri(first)}
+            container = self.plex.query(f"/library/collections?{urlencode(args)}", method=self.session.post)
+            collection = Collection(self.plex, container[0])
+            index.add(collection)
+            self._add_collection_items(collection, rating_keys[len(first):])
+            self.metrics.inc('pmm_collections_total', action='created')
 
     def manage_collections(self):
         """Main collection management function"""
         logger.info("Starting collection management")
-        self.create_collections()
+        if self.wait_for_scan:
+            # Scheduled on its own, a library scan may still be running
+            self.wait_for_scans()
+        errors = self.create_collections()
         logger.info("Collection management completed")
-def main():
+        return not errors
+
+class PMMFleet:
+    """Every configured Plex server, each managed by its own SimplePMM
+    
+    Servers keep their own connection pool, state store and rules but share
+    one metrics registry, one scheduler and the health endpoints. Work fans
+    out to all servers at once; a server that fails is logged and reported
+    without holding up the others.
+    """
+    
+    def __init__(self, servers=None):
+        self.config_path = os.getenv('PMM_CONFIG_PATH', './config')
+        self.config = load_config(self.config_path)
+        self.metrics = Metrics()
+        if servers is None:
+            servers = load_servers(self.config)
+        self.servers = [SimplePMM(server, self.metrics) for server in servers]
+        
+        metrics_config = self.config.get('metrics', {})
+        self.metrics_port = int(metrics_config.get('port', 8080))
+        self.metrics_summary_file = metrics_config.get('summary_file', 'logs/pmm_metrics.json')
+        self.maintenance_tasks = load_maintenance_tasks(self.config.get('maintenance', {}))
+        self.started_at = time.time()
+        self.scheduler = None
+    
+    def __len__(self):
+        return len(self.servers)
+    
+    def run(self, func, description):
+        """Call func(pmm) for every server concurrently; return {server: result}
+        
+        A server whose call raised gets None. With several servers, log
+        lines are prefixed with the server they concern.
+        """
+        def call(pmm):
+            if len(self.servers) == 1:
+                return func(pmm)
+            log_prefix.set(f"[{pmm.label}] ")
+            with profile_phase(pmm.label):
+                return func(pmm)
+        
+        results = {}
+        with ThreadPoolExecutor(max_workers=len(self.servers), thread_name_prefix='pmm-server') as pool:
+            futures = {pool.submit(contextvars.copy_context().run, profiled(call), pmm): pmm
+                       for pmm in self.servers}
+            for future in as_completed(futures):
+                pmm = futures[future]
+                try:
+                    results[pmm.label] = future.result()
+                except Exception as e:
+                    logger.error(f"[{pmm.label}] {description} failed: {e}")
+                    results[pmm.label] = None
+        return {pmm.label: results[pmm.label] for pmm in self.servers}
+    
+    def run_task(self, name):
+        """Run one maintenance task on every server; return whether all succeeded"""
+        def run(pmm):
+            started = time.time()
+            success = pmm.run_task(name)
+            pmm.set_task_run(name, started, time.time(), success)
+            return success
+        
+        return all(self.run(run, name).values())
+    
+    def get_task_run(self, name):
+        """When a task last started on the server that ran it longest ago"""
+        runs = [run for run in (pmm.get_task_run(name) for pmm in self.servers) if run is not None]
+        return min(runs) if runs else None
+    
+    def set_task_run(self, name, started_at, finished_at, success):
+        """Nothing to do: run_task records each server's run in its own store"""
+    
+    def scheduled_tasks(self):
+        """Build the scheduler tasks for maintenance.tasks"""
+        from scheduler import ScheduledTask
+        
+        tasks = []
+        for task in self.maintenance_tasks:
+            logger.info(f"Scheduling {task['name']} at '{task['schedule']}'"
+                        + (f" with up to {task['jitter']:.0f}s jitter" if task['jitter'] else ""))
+            tasks.append(ScheduledTask(task['name'], partial(self.run_task, task['name']),
+                                       task['schedule'], task['jitter']))
+        return tasks
+    
+    def run_maintenance(self):
+        """Run every maintenance task once on all servers, each server in configured order"""
+        return all(self.run(lambda pmm: pmm.run_maintenance(), "maintenance").values())
+    
+    def health_status(self, ready=False):
+        """Combine every server's health_status; one server keeps its own response"""
+        if len(self.servers) == 1:
+            return self.servers[0].health_status(ready)
+        
+        results = {pmm.label: pmm.health_status(ready) for pmm in self.servers}
+        healthy = all(ok for ok, _ in results.values())
+        status = {
+            'status': ('ready' if healthy else 'not ready') if ready else 'alive',
+            'uptime_seconds': round(time.time() - self.started_at),
+            'servers': {label: server_status for label, (_, server_status) in results.items()},
+        }
+        return healthy, status
+    
+    def start_listeners(self):
+        """Start the filesystem watcher and event listener of servers that enable them"""
+        def start(pmm):
+            if pmm.config.get('watcher', {}).get('enabled', False):
+                pmm.watch_libraries()
+            if pmm.config.get('events', {}).get('enabled', False):
+                pmm.listen_for_changes()
+        
+        self.run(start, "starting listeners")
+
+def run_daemon(fleet):
+    """Run scheduled maintenance plus the configured watchers until interrupted"""
+    import asyncio
+    from scheduler import TaskScheduler
+    
+    if fleet.config.get('maintenance', {}).get('enabled', True):
+        fleet.scheduler = TaskScheduler(fleet.scheduled_tasks(), state=fleet)
+    else:
+        fleet.scheduler = TaskScheduler([])
+    for pmm in fleet.servers:
+        pmm.scheduler = fleet.scheduler
+    
+    fleet.start_listeners()
+    
+    metrics_enabled = fleet.config.get('metrics', {}).get('enabled', True)
+    health_enabled = fleet.config.get('health', {}).get('enabled', True)
+    if metrics_enabled or health_enabled:
+        start_metrics_server(fleet.metrics if metrics_enabled else None, fleet.metrics_port,
+                             health=fleet.health_status if health_enabled else None)
+        endpoints = (['/metrics'] if metrics_enabled else []) + (['/healthz', '/readyz'] if health_enabled else [])
+        logger.info(f"Serving {', '.join(endpoints)} on port {fleet.metrics_port}")
+    
+    # Run initial status check
+    fleet.run(lambda pmm: pmm.get_server_status(), "status")
+    fleet.run(lambda pmm: pmm.get_libraries(), "listing libraries")
+    
+    # Sleep until the next task is due; runs until interrupted
+    asyncio.run(fleet.scheduler.run())
+
+def run_once(fleet):
+    """Run every maintenance task once and write the metrics summary"""
+    fleet.run(lambda pmm: pmm.get_server_status(), "status")
+    fleet.run(lambda pmm: pmm.get_libraries(), "listing libraries")
+    ok = fleet.run_maintenance()
+    if fleet.config.get('metrics', {}).get('enabled', True):
+        summary = fleet.metrics.write_json(fleet.metrics_summary_file)
+        logger.info(f"Metrics summary written to {summary}")
+    return ok
+
+def parse_args(argv=None):
+    """Parse the command line; without a command, AUTO_RUN_ENABLED picks daemon or maintenance"""
+    parser = argparse.ArgumentParser(description='Simple Plex Media Manager')
+    parser.add_argument('--server', action='append', dest='servers', metavar='NAME',
+                        help='only manage this server from the servers list (repeatable)')
+    parser.add_argument('--profile', action='store_true',
+                        help='write CPU and memory profiles of each task and library to logs/profile/')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='with --profile, also trace allocation sites (much slower)')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    
+    commands.add_parser('status', help='show Plex server status')
+    commands.add_parser('libraries', help='list Plex libraries')
+    
+    scan = commands.add_parser('scan', help='scan libraries for new media')
+    scan.add_argument('--library', help='only scan this library')
+    scan.add_argument('--wait', action='store_true', help='wait for Plex to finish scanning')
+    
+    collections = commands.add_parser('collections', help='create and update automatic collections')
+    collections.add_argument('--library', help='only process this library')
+    
+    cleanup = commands.add_parser('cleanup', help='clean temp and transcode directories')
+    cleanup.add_argument('--dry-run', action='store_true', help='only report what would be deleted')
+    
+    optimize = commands.add_parser('optimize', help="optimize Plex's database and clean old bundles")
+    optimize.add_argument('--force', action='store_true', help='optimize even if little has changed')
+    
+    commands.add_parser('maintenance', help='run every maintenance task once')
+    commands.add_parser('daemon', help='run maintenance on schedule until stopped')
+    
+    export = commands.add_parser('export', help='save library snapshots for offline planning')
+    export.add_argument('output_dir', nargs='?', default='snapshots')
+    export.add_argument('--library', help='only export this library')
+    
+    plan = commands.add_parser('plan', help='compute collection memberships from snapshots, offline')
+    plan.add_argument('snapshots', nargs='+', help='snapshot files or directories')
+    plan.add_argument('-o', '--output', default='pmm_plan.json')
+    
+    apply = commands.add_parser('apply', help='write the collections of a plan file')
+    apply.add_argument('plan')
+    
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
     """Main function"""
+    args = parse_args(argv)
+    command = args.command
+    if command is None:
+        command = 'daemon' if os.getenv('AUTO_RUN_ENABLED', 'false').lower() == 'true' else 'maintenance'
+    
+    if command == 'plan':
+        # Needs no Plex connection
+        started = time.perf_counter()
+        config = load_config(os.getenv('PMM_CONFIG_PATH', './config'))
+        servers = load_servers(config, args.servers)
+        if len(servers) > 1:
+            logger.error("plan uses one server's rules; choose one with --server")
+            sys.exit(1)
+        config = server_config(config, servers[0] or {})
+        plan = compute_plan(args.snapshots, compile_rules(config.get('collections')))
+        write_plan(plan, args.output)
+        logger.info(f"Plan for {len(plan['libraries'])} libraries written to {args.output} "
+                    f"in {time.perf_counter() - started:.2f}s")
+        return
+    
     logger.info("Starting Simple PMM")
     
+    if args.profile or args.profile_memory:
+        log_file = (load_config(os.getenv('PMM_CONFIG_PATH', './config')).get('logging') or {}).get('file', 'logs/pmm.log')
+        start_profiling(Path(log_file).parent / 'profile' / datetime.now().strftime('%Y%m%d-%H%M%S'),
+                        memory=args.profile_memory)
+    
     try:
-        pmm = SimplePMM()
-        
-        # Check if auto-run is enabled
-        auto_run = os.getenv('AUTO_RUN_ENABLED', 'false').lower() == 'true'
-        run_schedule = os.getenv('RUN_SCHEDULE', '06:00')
+        fleet = PMMFleet(load_servers(load_config(os.getenv('PMM_CONFIG_PATH', './config')), args.servers))
+        logger.info(f"Started '{command}' for {len(fleet)} server(s) in {time.perf_counter() - STARTED_AT:.2f}s")
         
-        if auto_run:
-            logger.info(f"Scheduling automatic maintenance at {run_schedule}")
-            schedule.every().day.at(run_schedule).do(pmm.run_maintenance)
-            
-            # Run initial status check
-            pmm.get_server_status()
-            pmm.get_libraries()
-            
-            # Keep the script running
-            while True:
-                schedule.run_pending()
-                time.sleep(60)  # Check every minute
+        if command == 'status':
+            ok = all(fleet.run(lambda pmm: pmm.get_server_status() is not None, command).values())
+        elif command == 'libraries':
+            ok = all(fleet.run(lambda pmm: bool(pmm.get_libraries()), command).values())
+        elif command == 'scan':
+            ok = all(fleet.run(lambda pmm: pmm.scan_library(args.library, wait=args.wait), command).values())
+        elif command == 'collections':
+            ok = all(fleet.run(lambda pmm: not pmm.create_collections(args.library), command).values())
+        elif command == 'cleanup':
+            ok = all(fleet.run(lambda pmm: pmm.cleanup_temp_files(dry_run=args.dry_run or None), command).values())
+        elif command == 'optimize':
+            ok = all(fleet.run(lambda pmm: pmm.optimize_database(force=args.force), command).values())
+        elif command == 'export':
+            def export(pmm):
+                # Several servers export side by side, one folder each
+                output_dir = Path(args.output_dir)
+                if len(fleet) > 1:
+                    output_dir = output_dir / server_slug(pmm.name)
+                return bool(pmm.export_snapshots(output_dir, args.library))
+            ok = all(fleet.run(export, command).values())
+        elif command == 'apply':
+            if len(fleet) > 1:
+                logger.error("A plan belongs to one server; choose it with --server")
+                sys.exit(1)
+            ok = all(fleet.run(lambda pmm: not pmm.apply_plan(args.plan), command).values())
+        elif command == 'daemon':
+            run_daemon(fleet)
+            ok = True
         else:
-            # Run once and exit
-            pmm.get_server_status()
-            pmm.get_libraries()
-            pmm.run_maintenance()
+            ok = run_once(fleet)
+        
+        if not ok:
+            sys.exit(1)
             
     except KeyboardInterrupt:
         logger.info("PMM stopped by user")
+    except PlexConnectionError as e:
+        logger.error(str(e))
+        sys.exit(1)
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
         sys.exit(1)
+    finally:
+        stop_profiling()
 
 if __name__ == "__main__":
     main()
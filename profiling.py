@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+PMM Profiling
+Opt-in per-phase profiling of maintenance runs: cProfile statistics,
+sampled stacks for flame graphs, allocation sites and memory peaks for each
+maintenance task and library, written as report files
+"""
+
+import contextlib
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Seconds between stack and memory samples
+SAMPLE_INTERVAL = 0.01
+
+# Rows in the text report's function and allocation tables
+REPORT_ROWS = 30
+
+# From Python 3.12 cProfile runs on sys.monitoring: one profiler may be
+# active per process, and it sees every thread. Phases then get sampled
+# function tables, and one cProfile covers the whole run.
+PER_THREAD_PROFILES = sys.version_info < (3, 12)
+
+# The innermost phase of the current context; worker threads inherit it
+_current = contextvars.ContextVar('profile_phase', default=None)
+
+_profiler = None
+
+# Allocations made by the profiler itself, left out of the reports
+_OWN_FILES = tuple(os.path.basename(path) for path in (__file__, tracemalloc.__file__, pstats.__file__,
+                                                        cProfile.__file__))
+
+
+def _rss_kb():
+    """Current resident set size in KB, or None where it can't be read cheaply"""
+    try:
+        with open('/proc/self/statm', 'rb') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _peak_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ',')
+
+
+def _enable(profile):
+    """Enable a cProfile profiler; return False if another profiling tool holds the hook"""
+    try:
+        profile.enable()
+        return True
+    except ValueError as e:
+        logger.debug(f"cProfile unavailable, keeping timings and samples only: {e}")
+        return False
+
+
+def _function_table(stacks, rows):
+    """Format the functions seen most in sampled stacks, with inclusive and own sample counts"""
+    total = sum(stacks.values())
+    inclusive = Counter()
+    own = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        own[frames[-1]] += count
+        for frame in set(frames):
+            inclusive[frame] += count
+    lines = [f"  {'samples':>8} {'own':>8}  function"]
+    for frame, count in inclusive.most_common(rows):
+        lines.append(f"  {100 * count / total:7.1f}% {100 * own[frame] / total:7.1f}%  {frame}")
+    return '\n'.join(lines) + '\n'
+
+
+class _ThreadState(threading.local):
+    """Profilers of the phases running on this thread, innermost last (None where unavailable)"""
+
+    def __init__(self):
+        self.profiles = []
+
+
+class Phase:
+    """One profiled section of a run; nested phases are folded into their parent's report"""
+
+    def __init__(self, profiler, name, parent):
+        self.profiler = profiler
+        self.name = name
+        self.parent = parent
+        self.path = f'{parent.path}.{name}' if parent else name
+        self.index = profiler._next_index()
+        self.children = []
+        self.profiles = []
+        self.stacks = Counter()
+        self.cpu_seconds = 0.0
+        self.peak_rss_kb = None
+        self.peak_traced_kb = None
+        self._lock = threading.Lock()
+        if parent is not None:
+            with parent._lock:
+                parent.children.append(self)
+
+    @contextlib.contextmanager
+    def thread(self):
+        """Profile the calling thread as part of this phase for the with-block"""
+        profiler = self.profiler
+        state = profiler._threads
+        profile = cProfile.Profile() if PER_THREAD_PROFILES else None
+        # A thread runs one profiler at a time: pause the enclosing phase's
+        if profile is not None and state.profiles:
+            state.profiles[-1].disable()
+        if profile is not None and not _enable(profile):
+            profile = None
+        state.profiles.append(profile)
+        ident = threading.get_ident()
+        profiler._enter_thread(ident, self)
+        cpu_started = time.thread_time()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                with self._lock:
+                    self.profiles.append(profile)
+            with self._lock:
+                self.cpu_seconds += time.thread_time() - cpu_started
+            profiler._leave_thread(ident)
+            state.profiles.pop()
+            if state.profiles and state.profiles[-1] is not None:
+                _enable(state.profiles[-1])
+
+    def sampled(self, rss_kb, traced_kb):
+        with self._lock:
+            if rss_kb is not None:
+                self.peak_rss_kb = max(self.peak_rss_kb or 0, rss_kb)
+            if traced_kb is not None:
+                self.peak_traced_kb = max(self.peak_traced_kb or 0, traced_kb)
+
+    def all_profiles(self):
+        profiles = [profile for profile in self.profiles if profile.getstats()]
+        for child in self.children:
+            profiles += child.all_profiles()
+        return profiles
+
+    def all_stacks(self):
+        stacks = Counter(self.stacks)
+        for child in self.children:
+            stacks.update(child.all_stacks())
+        return stacks
+
+    @property
+    def cpu_seconds_total(self):
+        return self.cpu_seconds + sum(child.cpu_seconds_total for child in self.children)
+
+
+class Profiler:
+    """Write a report set per phase into ``output_dir``
+
+    Per phase: ``.pstats`` (cProfile, loadable with pstats or snakeviz),
+    ``.collapsed`` (sampled stacks for flamegraph.pl or speedscope) and
+    ``.txt`` (wall/CPU time, memory peaks and top functions). From Python
+    3.12 phases have no ``.pstats``: the top functions come from the
+    sampled stacks and ``run.pstats`` profiles the whole run. With
+    ``memory`` on, tracemalloc also reports the allocation sites that grew
+    most, at several times the cost of CPU profiling alone. Nested phases
+    are included in their parent's figures. Memory peaks and allocation
+    sites are process-wide while the phase ran, so phases running side by
+    side share them.
+    """
+
+    def __init__(self, output_dir, memory=False, interval=SAMPLE_INTERVAL):
+        self.output_dir = str(output_dir)
+        self.memory = bool(memory)
+        self.interval = float(interval)
+        self.phases = []
+        self._threads = _ThreadState()
+        self._lock = threading.Lock()
+        self._count = 0
+        # Thread ident -> phases running on it, innermost last
+        self._running = {}
+        self._stop = threading.Event()
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # One cProfile for the whole run where phases can't have their own
+        self._run_profile = None
+        if not PER_THREAD_PROFILES:
+            profile = cProfile.Profile()
+            if _enable(profile):
+                self._run_profile = profile
+        self._sampler = threading.Thread(target=self._sample, name='pmm-profiler', daemon=True)
+        self._sampler.start()
+
+    def _next_index(self):
+        with self._lock:
+            self._count += 1
+            return self._count
+
+    def _enter_thread(self, ident, phase):
+        with self._lock:
+            self._running.setdefault(ident, []).append(phase)
+
+    def _leave_thread(self, ident):
+        with self._lock:
+            phases = self._running[ident]
+            phases.pop()
+            if not phases:
+                del self._running[ident]
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Profile the with-block, and the worker threads it hands work to, as a phase"""
+        phase = Phase(self, name, _current.get())
+        token = _current.set(phase)
+        started = time.perf_counter()
+        before = self._snapshot()
+        try:
+            with phase.thread():
+                yield phase
+        finally:
+            _current.reset(token)
+            phase.wall_seconds = time.perf_counter() - started
+            try:
+                self._write(phase, before, self._snapshot())
+            except Exception as e:
+                logger.warning(f"Could not write profile for {phase.path}: {e}")
+            if phase.parent is None:
+                with self._lock:
+                    self.phases.append(self._summary(phase))
+
+    def _sample(self):
+        """Attribute each profiled thread's current stack to its innermost phase"""
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                running = {ident: phases[-1] for ident, phases in self._running.items()}
+            if not running:
+                continue
+            frames = sys._current_frames()
+            rss_kb = _rss_kb()
+            traced_kb = tracemalloc.get_traced_memory()[0] // 1024 if self.memory else None
+            for ident, phase in running.items():
+                frame = frames.get(ident)
+                if frame is None or ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                with phase._lock:
+                    phase.stacks[';'.join(reversed(stack))] += 1
+            seen = set()
+            for phase in running.values():
+                while phase is not None and id(phase) not in seen:
+                    seen.add(id(phase))
+                    phase.sampled(rss_kb, traced_kb)
+                    phase = phase.parent
+
+    def _snapshot(self):
+        """Live Python allocations as {(file, line): (bytes, blocks)}, or None without memory profiling"""
+        if not self.memory:
+            return None
+        # Grouping once per snapshot is far cheaper than filter_traces/compare_to
+        return {(stat.traceback[0].filename, stat.traceback[0].lineno): (stat.size, stat.count)
+                for stat in tracemalloc.take_snapshot().statistics('lineno')}
+
+    def _base(self, phase):
+        slug = re.sub(r'[^\w.-]+', '_', phase.path).strip('_') or 'phase'
+        return os.path.join(self.output_dir, f'{phase.index:03d}-{slug}')
+
+    def _write(self, phase, before, after):
+        base = self._base(phase)
+        profiles = phase.all_profiles()
+        report = io.StringIO()
+        report.write(f"Phase: {phase.path}\n")
+        report.write(f"Wall time: {phase.wall_seconds:.3f}s\n")
+        report.write(f"CPU time (profiled threads): {phase.cpu_seconds_total:.3f}s\n")
+        if phase.peak_rss_kb is not None:
+            report.write(f"Peak RSS while running: {phase.peak_rss_kb / 1024:.1f} MB\n")
+        if phase.peak_traced_kb is not None:
+            report.write(f"Peak Python allocations while running: {phase.peak_traced_kb / 1024:.1f} MB\n")
+        peak = _peak_rss_kb()
+        if peak is not None:
+            report.write(f"Process peak RSS so far: {peak / 1024:.1f} MB\n")
+
+        stacks = phase.all_stacks()
+        if profiles:
+            stats = pstats.Stats(*profiles, stream=report)
+            stats.dump_stats(base + '.pstats')
+            report.write(f"\nTop {REPORT_ROWS} functions by cumulative time:\n")
+            stats.sort_stats('cumulative').print_stats(REPORT_ROWS)
+        elif stacks:
+            report.write(f"\nTop {REPORT_ROWS} functions by share of {sum(stacks.values())} stack samples:\n")
+            report.write(_function_table(stacks, REPORT_ROWS))
+
+        if before is not None and after is not None:
+            report.write(f"\nTop {REPORT_ROWS} allocation sites by growth:\n")
+            growth = [(size - before.get(site, (0, 0))[0], count - before.get(site, (0, 0))[1], size, site)
+                      for site, (size, count) in after.items()
+                      if not site[0].endswith(_OWN_FILES)]
+            for grown, blocks, size, (filename, lineno) in sorted(growth, reverse=True)[:REPORT_ROWS]:
+                report.write(f"  {filename}:{lineno}: {size / 1024:.1f} KiB ({grown / 1024:+.1f} KiB, "
+                             f"{blocks:+d} blocks)\n")
+
+        with open(base + '.collapsed', 'w', encoding='utf-8') as collapsed:
+            for stack, count in sorted(stacks.items()):
+                collapsed.write(f"{stack} {count}\n")
+        with open(base + '.txt', 'w', encoding='utf-8') as text:
+            text.write(report.getvalue())
+
+        if phase.parent is None:
+            logger.info(f"Profile of {phase.path}: {phase.wall_seconds:.2f}s wall, "
+                        f"{phase.cpu_seconds_total:.2f}s CPU, peak RSS "
+                        f"{(phase.peak_rss_kb or peak or 0) / 1024:.0f} MB -> {base}.*")
+
+    def _summary(self, phase):
+        return {
+            'phase': phase.path,
+            'report': os.path.basename(self._base(phase)),
+            'wall_seconds': round(phase.wall_seconds, 3),
+            'cpu_seconds': round(phase.cpu_seconds_total, 3),
+            'peak_rss_kb': phase.peak_rss_kb,
+            'peak_traced_kb': phase.peak_traced_kb,
+            'children': [self._summary(child) for child in phase.children],
+        }
+
+    def close(self):
+        """Stop sampling and write summary.json listing every phase"""
+        self._stop.set()
+        self._sampler.join()
+        if self.memory:
+            tracemalloc.stop()
+        summary = {'phases': self.phases}
+        if self._run_profile is not None:
+            self._run_profile.disable()
+            self._run_profile.dump_stats(os.path.join(self.output_dir, 'run.pstats'))
+            summary['run_pstats'] = 'run.pstats'
+        with open(os.path.join(self.output_dir, 'summary.json'), 'w', encoding='utf-8') as summary_file:
+            json.dump(summary, summary_file, indent=2)
+        logger.info(f"Profile reports written to {self.output_dir}")
+
+
+def start_profiling(output_dir, **kwargs):
+    """Turn profiling on for this process; return the Profiler"""
+    global _profiler
+    _profiler = Profiler(output_dir, **kwargs)
+    return _profiler
+
+
+def stop_profiling():
+    global _profiler
+    if _profiler is not None:
+        _profiler.close()
+        _profiler = None
+
+
+def profile_phase(name):
+    """Profile a with-block as a phase when profiling is on; otherwise do nothing"""
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.phase(name)
+
+
+def profiled(func):
+    """Wrap func so the worker thread running it is profiled with the caller's phase"""
+    current = _current.get()
+    if current is None:
+        return func
+
+    def run(*args, **kwargs):
+        with current.thread():
+            return func(*args, **kwargs)
+
+    return run
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+PMM Collection Rules
+Compile the collections section of pmm_config.yml into group-by,
+threshold and TMDb rules and evaluate them against a library snapshot
+(plus TMDb data, when enriched) without talking to Plex
+"""
+
+import logging
+
+from snapshot import NO_STUDIO, NO_YEAR
+
+logger = logging.getLogger(__name__)
+
+# Config section for each Plex library type
+LIBRARY_SECTIONS = {'movie': 'movies', 'show': 'tv_shows'}
+
+# Used for rules missing from pmm_config.yml (and when there is no config)
+DEFAULT_RULES = {
+    'movies': {
+        'decades': {'enabled': True, 'minimum_items': 5},
+        'genres': {'enabled': True, 'minimum_items': 10},
+        'ratings': {'enabled': True, 'highly_rated_threshold': 8.0, 'minimum_items': 5},
+        'studios': {'enabled': False, 'minimum_items': 5},
+        'franchises': {'enabled': False, 'minimum_items': 2},
+        'keywords': {'enabled': False, 'keywords': [], 'minimum_items': 5},
+        'popular': {'enabled': False, 'top': 50, 'minimum_items': 10},
+    },
+    'tv_shows': {
+        'networks': {'enabled': True, 'minimum_items': 3},
+        'genres': {'enabled': True, 'minimum_items': 5},
+        'ratings': {'enabled': False, 'highly_rated_threshold': 8.0, 'minimum_items': 5},
+        'years': {'enabled': False, 'minimum_items': 3},
+        'keywords': {'enabled': False, 'keywords': [], 'minimum_items': 5},
+        'popular': {'enabled': False, 'top': 50, 'minimum_items': 10},
+    },
+}
+
+# Group-by rules: rule name -> (snapshot column, collection title format)
+GROUP_RULES = {
+    'movies': {
+        'decades': ('decade', '{}s Movies'),
+        'genres': ('genre', '{} Movies'),
+        'studios': ('studio', '{} Movies'),
+    },
+    'tv_shows': {
+        'networks': ('studio', '{} Shows'),
+        'genres': ('genre', '{} TV Shows'),
+        'years': ('year', '{} TV Shows'),
+    },
+}
+
+# Threshold rules: rule name -> collection title for ratings >= threshold
+THRESHOLD_RULES = {
+    'movies': {'ratings': 'Highly Rated Movies'},
+    'tv_shows': {'ratings': 'Highly Rated TV Shows'},
+}
+
+# Rules evaluated against TMDb data: rule name -> collection title format
+# (franchises are titled with TMDb's collection name; keyword titles are
+# marked so a keyword like "Action" can't take the genre collection's title)
+TMDB_RULES = {
+    'movies': {
+        'franchises': '{}',
+        'keywords': '{} Movies (Keyword)',
+        'popular': 'Popular Movies',
+    },
+    'tv_shows': {
+        'keywords': '{} TV Shows (Keyword)',
+        'popular': 'Popular TV Shows',
+    },
+}
+
+
+# Group-by columns titled with Plex's filter value rather than its display
+# title (Plex lists decades as key 1990, title "1990s")
+KEY_TITLED = {'decade', 'year'}
+
+# Plex ratings have one decimal; its rating filter is strictly greater-than,
+# so thresholds are sent half a step lower
+RATING_STEP = 0.1
+
+
+class RuleSet:
+    """Compiled rules for one library type
+
+    ``groupings`` is a list of (column, title format, minimum items),
+    ``thresholds`` a list of (title, minimum rating, minimum items) and
+    ``tmdb`` a list of (rule, title format, minimum items, option) where
+    option is the {lowercase: configured} keywords or the popular top N.
+    """
+
+    def __init__(self, groupings=(), thresholds=(), tmdb=()):
+        self.groupings = list(groupings)
+        self.thresholds = list(thresholds)
+        self.tmdb = list(tmdb)
+        self.columns = {column for column, _, _ in self.groupings}
+
+    def __len__(self):
+        return len(self.groupings) + len(self.thresholds) + len(self.tmdb)
+
+    def evaluate(self, snapshot):
+        """Compute {collection title: ratingKeys} in a single pass over the snapshot
+
+        The columns are zipped into one scan and each row is bucketed for
+        all group-bys and thresholds at once, so more rules cost more
+        appends, not more passes. Studio and genre buckets are dense lists
+        indexed by interned id (a bincount over the codes).
+        """
+        keys = snapshot.rating_keys
+        years = snapshot.years
+        studio_ids = snapshot.studio_ids
+        genre_offsets = snapshot.genre_offsets
+        genre_ids = snapshot.genre_ids
+        ratings = snapshot.ratings
+
+        by_year = {} if 'year' in self.columns else None
+        by_decade = {} if 'decade' in self.columns else None
+        by_studio = [[] for _ in snapshot.studios] if 'studio' in self.columns else None
+        by_genre = [[] for _ in snapshot.genres] if 'genre' in self.columns else None
+        cutoffs = [minimum for _, minimum, _ in self.thresholds]
+        passed = [[] for _ in cutoffs]
+
+        add_year = by_year is not None
+        add_decade = by_decade is not None
+        add_studio = by_studio is not None
+        add_genres = by_genre is not None
+        rows = zip(keys, years, studio_ids, ratings, genre_offsets, genre_offsets[1:])
+        for key, year, studio_id, rating, genre_start, genre_end in rows:
+            if year != NO_YEAR:
+                if add_year:
+                    by_year.setdefault(year, []).append(key)
+                if add_decade:
+                    by_decade.setdefault(year // 10 * 10, []).append(key)
+            if add_studio and studio_id != NO_STUDIO:
+                by_studio[studio_id].append(key)
+            if add_genres:
+                for genre_id in genre_ids[genre_start:genre_end]:
+                    by_genre[genre_id].append(key)
+            if cutoffs and rating == rating:  # NaN marks a missing rating
+                for index, cutoff in enumerate(cutoffs):
+                    if rating >= cutoff:
+                        passed[index].append(key)
+
+        groups = {
+            'year': by_year,
+            'decade': by_decade,
+            'studio': dict(zip(snapshot.studios, by_studio)) if by_studio is not None else None,
+            'genre': dict(zip(snapshot.genres, by_genre)) if by_genre is not None else None,
+        }
+        collections = {}
+        for column, title, minimum_items in self.groupings:
+            for value, rating_keys in groups[column].items():
+                if rating_keys and len(rating_keys) >= minimum_items:
+                    _add_collection(collections, title.format(value), rating_keys, column)
+        for (title, _, minimum_items), rating_keys in zip(self.thresholds, passed):
+            if len(rating_keys) >= minimum_items:
+                collections[title] = rating_keys
+        return collections
+
+    def server_filters(self, choices):
+        """List (collection title, Plex filter, minimum items) for Plex to evaluate
+
+        ``choices`` maps each grouping column to the (filter value, title)
+        pairs Plex lists for it; filters are raw arguments for
+        ``/library/sections/{id}/all``. TMDb rules have no Plex filter and
+        are left out.
+        """
+        filters = []
+        titles = {}
+        for column, title, minimum_items in self.groupings:
+            for value, name in choices.get(column, ()):
+                title_value = title.format(value if column in KEY_TITLED else name)
+                if _add_collection(titles, title_value, column, column):
+                    filters.append((title_value, {column: value}, minimum_items))
+        for title, minimum, minimum_items in self.thresholds:
+            filters.append((title, {'rating>>': round(minimum - RATING_STEP / 2, 2)}, minimum_items))
+        return filters
+
+    def evaluate_tmdb(self, enrichment):
+        """Compute {collection title: ratingKeys} for the TMDb rules
+
+        ``enrichment`` maps ratingKeys to the details tmdb.TMDbEnricher returns.
+        """
+        collections = {}
+        for rule, title, minimum_items, option in self.tmdb:
+            if rule == 'franchises':
+                groups = {}
+                for rating_key, info in enrichment.items():
+                    if info.get('franchise'):
+                        groups.setdefault(info['franchise'], []).append(rating_key)
+            elif rule == 'keywords':
+                groups = {keyword: [] for keyword in option.values()}
+                for rating_key, info in enrichment.items():
+                    for keyword in info.get('keywords', ()):
+                        if keyword.lower() in option:
+                            groups[option[keyword.lower()]].append(rating_key)
+            else:
+                ranked = sorted(enrichment, key=lambda key: enrichment[key].get('popularity') or 0, reverse=True)
+                groups = {None: ranked[:option]}
+
+            for value, rating_keys in groups.items():
+                if rating_keys and len(rating_keys) >= minimum_items:
+                    _add_collection(collections, title.format(value), sorted(set(rating_keys)), rule)
+        return collections
+
+
+def _add_collection(collections, title, value, rule):
+    """Set collections[title] unless an earlier rule already built that title; return whether it was set
+
+    Genre and studio collections share a title format, so a studio named
+    like a genre would otherwise silently replace the genre's collection;
+    likewise a TMDb franchise titled like a rule collection.
+    """
+    if title in collections:
+        logger.warning(f"Skipping the {rule} collection {title!r}: an earlier rule already builds that title")
+        return False
+    collections[title] = value
+    return True
+
+
+def compile_rules(collections_config=None):
+    """Compile the ``collections`` config section into {library type: RuleSet}"""
+    collections_config = collections_config or {}
+    if not collections_config.get('enabled', True):
+        return {library_type: RuleSet() for library_type in LIBRARY_SECTIONS}
+
+    compiled = {}
+    for library_type, section in LIBRARY_SECTIONS.items():
+        configured = collections_config.get(section) or {}
+        groupings = []
+        thresholds = []
+        tmdb = []
+        for name, defaults in DEFAULT_RULES[section].items():
+            settings = dict(defaults, **(configured.get(name) or {}))
+            if not settings.get('enabled', True):
+                continue
+            minimum_items = int(settings.get('minimum_items', 1))
+            if name in GROUP_RULES[section]:
+                column, title = GROUP_RULES[section][name]
+                groupings.append((column, title, minimum_items))
+            elif name in TMDB_RULES[section]:
+                if name == 'keywords':
+                    option = {str(keyword).lower(): str(keyword) for keyword in settings.get('keywords') or []}
+                else:
+                    option = int(settings.get('top', 0))
+                tmdb.append((name, TMDB_RULES[section][name], minimum_items, option))
+            else:
+                thresholds.append((THRESHOLD_RULES[section][name],
+                                   float(settings['highly_rated_threshold']), minimum_items))
+        compiled[library_type] = RuleSet(groupings, thresholds, tmdb)
+    return compiled
+
+
+def collections_for(library_type, snapshot, rules=None, enrichment=None):
+    """Evaluate the compiled rules (defaults if None) for a library type
+
+    TMDb rules are only evaluated when ``enrichment`` is given.
+    """
+    rule_set = (rules if rules is not None else compile_rules()).get(library_type)
+    if not rule_set:
+        return {}
+    collections = rule_set.evaluate(snapshot)
+    if enrichment is not None and rule_set.tmdb:
+        for title, rating_keys in rule_set.evaluate_tmdb(enrichment).items():
+            _add_collection(collections, title, rating_keys, 'TMDb')
+    return collections
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+PMM Scheduler
+Run maintenance tasks on their own cron schedules with asyncio, sleeping
+until the next task is due
+"""
+
+import asyncio
+import logging
+import random
+import re
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# (name, lowest, highest) of the five cron fields
+CRON_FIELDS = (
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    ('weekday', 0, 6),
+)
+
+# How far ahead to look for a matching day before giving up (covers Feb 29)
+MAX_LOOKAHEAD_DAYS = 366 * 8
+
+
+def _parse_field(text, low, high):
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(value) for value in part.split('-', 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if step < 1 or start > end:
+            raise ValueError(f"invalid cron field '{text}'")
+        values.update(range(start, end + 1, step))
+    # Weekdays accept 7 as well as 0 for Sunday
+    limit = 7 if (low, high) == (0, 6) else high
+    if not values or min(values) < low or max(values) > limit:
+        raise ValueError(f"cron field '{text}' out of range {low}-{high}")
+    return {value % 7 for value in values} if limit == 7 else values
+
+
+class CronSchedule:
+    """Five-field cron expression (minute hour day month weekday) in local time
+
+    A plain ``HH:MM`` is accepted as shorthand for "daily at that time".
+    As in cron, when both day and weekday are restricted a day matching
+    either one is due.
+    """
+
+    def __init__(self, expression):
+        self.expression = str(expression).strip()
+        match = re.fullmatch(r'(\d{1,2}):(\d{2})', self.expression)
+        fields = f'{match[2]} {match[1]} * * *'.split() if match else self.expression.split()
+        if len(fields) != len(CRON_FIELDS):
+            raise ValueError(f"invalid schedule '{self.expression}': expected 5 cron fields or HH:MM")
+
+        parsed = [_parse_field(text, low, high) for text, (_, low, high) in zip(fields, CRON_FIELDS)]
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (sorted(values) for values in parsed)
+        self.day_restricted = fields[2] != '*'
+        self.weekday_restricted = fields[4] != '*'
+
+    def __repr__(self):
+        return f"CronSchedule('{self.expression}')"
+
+    def _day_matches(self, day):
+        if day.month not in self.months:
+            return False
+        day_match = day.day in self.days
+        weekday_match = (day.weekday() + 1) % 7 in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return day_match or weekday_match
+        if self.day_restricted:
+            return day_match
+        if self.weekday_restricted:
+            return weekday_match
+        return True
+
+    def next_after(self, when):
+        """Return the first matching minute strictly after the naive datetime when"""
+        start = when.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.date()
+        for _ in range(MAX_LOOKAHEAD_DAYS):
+            if self._day_matches(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = datetime(day.year, day.month, day.day, hour, minute)
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"schedule '{self.expression}' never matches")
+
+
+class ScheduledTask:
+    """A named callable with its cron schedule and random start delay"""
+
+    def __init__(self, name, func, schedule, jitter=0.0):
+        self.name = name
+        self.func = func
+        self.schedule = schedule if isinstance(schedule, CronSchedule) else CronSchedule(schedule)
+        self.jitter = max(0.0, float(jitter or 0))
+
+    def next_due(self, after):
+        """Epoch time of the next run after the epoch time after, including jitter"""
+        due = self.schedule.next_after(datetime.fromtimestamp(after)).timestamp()
+        return due + random.uniform(0, self.jitter) if self.jitter else due
+
+
+class TaskScheduler:
+    """Run each task on its own schedule; a task never overlaps itself
+
+    Every task gets its own coroutine that sleeps until it is due and runs
+    the (blocking) task in a worker thread, so independent tasks run
+    concurrently. With a ``state`` store providing ``get_task_run`` and
+    ``set_task_run``, a task whose run came due while PMM was down runs
+    once immediately at startup. Occurrences that pass while a task is
+    still running are skipped rather than queued.
+    """
+
+    def __init__(self, tasks, state=None):
+        self.tasks = list(tasks)
+        self.state = state
+        self.next_runs = {}
+
+    async def _sleep_until(self, due):
+        # asyncio sleeps on the monotonic clock; re-check the wall clock in
+        # case it was adjusted (or the host suspended) while we slept
+        while True:
+            remaining = due - time.time()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(remaining)
+
+    def _first_due(self, task):
+        now = time.time()
+        last_run = self.state.get_task_run(task.name) if self.state is not None else None
+        if last_run is None:
+            return task.next_due(now)
+        due = task.next_due(last_run)
+        if due <= now:
+            logger.info(f"Task {task.name} missed its run at {datetime.fromtimestamp(due):%Y-%m-%d %H:%M}, "
+                        f"catching up now")
+        return due
+
+    async def _run_task(self, task):
+        due = self._first_due(task)
+        while True:
+            self.next_runs[task.name] = due
+            logger.info(f"Next {task.name} run at {datetime.fromtimestamp(due):%Y-%m-%d %H:%M:%S}")
+            await self._sleep_until(due)
+
+            started = time.time()
+            success = False
+            try:
+                result = await asyncio.to_thread(task.func)
+                success = result is not False
+            except Exception as e:
+                logger.error(f"Scheduled task {task.name} failed: {e}")
+            if self.state is not None:
+                self.state.set_task_run(task.name, started, time.time(), success)
+
+            due = task.next_due(time.time())
+
+    async def run(self):
+        """Run all tasks until cancelled"""
+        if not self.tasks:
+            # Keep running for the watcher, event listener and metrics threads
+            logger.warning("No maintenance tasks scheduled")
+            await asyncio.Event().wait()
+        await asyncio.gather(*(self._run_task(task) for task in self.tasks))
@@ -126,8 +126,8 @@ def test_plex_connection():
         return False
     
     try:
-        import requests
         from dotenv import load_dotenv
+        from plex_session import create_session
         
         load_dotenv()
         plex_url = os.getenv('PLEX_URL', 'http://localhost:32400')
@@ -136,9 +136,10 @@ def test_plex_connection():
         if not plex_token or plex_token == 'your_plex_token_here':
             return False
         
-        response = requests.get(f"{plex_url}/identity", 
-                              params={'X-Plex-Token': plex_token}, 
-                              timeout=10)
+        with create_session(pool_size=1) as session:
+            response = session.get(f"{plex_url}/identity", 
+                                   params={'X-Plex-Token': plex_token}, 
+                                   timeout=10)
         if response.status_code == 200:
             print("✓ Plex server connection successful")
             return True
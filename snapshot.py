@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Library Snapshot
+Compact, column-oriented view of the metadata PMM groups collections by
+"""
+
+import json
+import math
+import mmap
+import struct
+import sys
+from array import array
+from urllib.parse import urlencode
+
+# Sentinels for missing values in the typed columns
+NO_YEAR = 0
+NO_STUDIO = -1
+NO_RATING = float('nan')
+
+# Snapshot files: magic, format version, header length, JSON header, then
+# one 8-byte aligned raw array per column
+SNAPSHOT_MAGIC = b'PMMSNAP\0'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_PREFIX = struct.Struct('<8sII')
+
+# Fixed-width on-disk type of each column ('l'/'L' vary by platform in memory)
+SNAPSHOT_COLUMNS = (
+    ('rating_keys', 'q'),
+    ('years', 'H'),
+    ('ratings', 'd'),
+    ('studio_ids', 'q'),
+    ('genre_offsets', 'Q'),
+    ('genre_ids', 'I'),
+)
+
+
+def item_values(item):
+    """Extract the (ratingKey, year, rating, studio, genres) row of a plexapi item"""
+    return (
+        int(item.ratingKey),
+        getattr(item, 'year', None),
+        getattr(item, 'rating', None),
+        getattr(item, 'studio', None),
+        [getattr(genre, 'tag', genre) for genre in getattr(item, 'genres', None) or []],
+    )
+
+
+def item_guids(item):
+    """The agent GUIDs of a plexapi item or ItemRecord, e.g. ['tmdb://603', 'imdb://tt0133093']"""
+    guids = [getattr(guid, 'id', guid) for guid in getattr(item, 'guids', None) or []]
+    legacy = getattr(item, 'guid', None)
+    if legacy and legacy not in guids:
+        guids.append(legacy)
+    return guids
+
+
+class ItemRecord:
+    """Lightweight stand-in for a plexapi Movie/Show carrying only grouping fields
+
+    Attribute names follow plexapi so records and full objects are
+    interchangeable for snapshots and the state store.
+    """
+
+    __slots__ = ('ratingKey', 'year', 'rating', 'studio', 'genres', 'updatedAt', 'addedAt', 'guids')
+
+    def __init__(self, ratingKey, year=None, rating=None, studio=None, genres=(),
+                 updatedAt=None, addedAt=None, guids=()):
+        self.ratingKey = ratingKey
+        self.year = year
+        self.rating = rating
+        self.studio = studio
+        self.genres = genres
+        self.updatedAt = updatedAt
+        self.addedAt = addedAt
+        self.guids = guids
+
+    @classmethod
+    def from_element(cls, element):
+        """Parse a <Video>/<Directory> element from a section listing"""
+        attrib = element.attrib
+        year = attrib.get('year')
+        rating = attrib.get('rating')
+        guids = [guid.attrib['id'] for guid in element.findall('Guid')]
+        if attrib.get('guid'):
+            guids.append(attrib['guid'])
+        return cls(
+            int(attrib['ratingKey']),
+            int(year) if year else None,
+            float(rating) if rating else None,
+            attrib.get('studio') or None,
+            [genre.attrib['tag'] for genre in element.findall('Genre')],
+            int(attrib.get('updatedAt', 0)),
+            int(attrib.get('addedAt', 0)),
+            guids,
+        )
+
+
+# Heavy listing fields/elements the collection rules never look at
+EXCLUDED_FIELDS = 'summary,tagline,thumb,art,theme,contentRating,originallyAvailableAt'
+EXCLUDED_ELEMENTS = 'Media,Role,Director,Writer,Country,Collection,Label,Image,UltraBlurColors'
+
+
+# Everything but ratingKey, for listings that only reconcile which items exist
+KEY_ONLY_FIELDS = (EXCLUDED_FIELDS + ',key,guid,type,title,titleSort,originalTitle,year,rating,audienceRating,'
+                   'studio,duration,addedAt,updatedAt,lastViewedAt,viewCount,childCount,leafCount')
+KEY_ONLY_ELEMENTS = EXCLUDED_ELEMENTS + ',Genre,Guid'
+
+
+def _iter_section_elements(query, section_key, page_size, params, start=0):
+    """Yield the item elements of a section listing, one page at a time"""
+    while True:
+        page = dict(params, **{'X-Plex-Container-Start': start, 'X-Plex-Container-Size': page_size})
+        container = query(f"/library/sections/{section_key}/all?{urlencode(page, safe=',>')}")
+        count = 0
+        for element in container:
+            if 'ratingKey' in element.attrib:
+                count += 1
+                yield element
+        if count < page_size:
+            return
+        start += page_size
+
+
+def iter_section_items(query, section_key, page_size=500, filters=None, start=0):
+    """Yield ItemRecords for a library section, one page at a time
+
+    ``query`` is a callable taking a request path and returning the parsed
+    MediaContainer element (``PlexServer.query`` or a retrying wrapper).
+    Elements are parsed directly, so no plexapi objects are built and no
+    per-item reloads are triggered. ``filters`` are raw Plex filter
+    arguments such as ``{'updatedAt>>': 1700000000}``; ``start`` skips
+    that many items, to continue an interrupted sweep.
+    """
+    params = dict(filters or {})
+    params.update({'excludeFields': EXCLUDED_FIELDS, 'excludeElements': EXCLUDED_ELEMENTS, 'includeGuids': 1})
+    for element in _iter_section_elements(query, section_key, page_size, params, start):
+        yield ItemRecord.from_element(element)
+
+
+def iter_section_keys(query, section_key, page_size=500):
+    """Yield the ratingKey of every item in a library section
+
+    Every other field and element is excluded, so listing a whole library
+    costs a small fraction of a full sweep.
+    """
+    params = {'excludeFields': KEY_ONLY_FIELDS, 'excludeElements': KEY_ONLY_ELEMENTS}
+    for element in _iter_section_elements(query, section_key, page_size, params):
+        yield int(element.attrib['ratingKey'])
+
+
+class LibrarySnapshot:
+    """Array-backed table of (ratingKey, year, rating, studio, genres) rows
+
+    Strings are interned into lookup tables so each row only stores small
+    integer ids. Genres are stored CSR-style: ``genre_offsets[i]`` to
+    ``genre_offsets[i + 1]`` slices ``genre_ids`` for row ``i``.
+    """
+
+    __slots__ = (
+        'rating_keys', 'years', 'ratings', 'studio_ids',
+        'genre_offsets', 'genre_ids', 'studios', 'genres',
+        '_studio_lookup', '_genre_lookup',
+    )
+
+    def __init__(self):
+        self.rating_keys = array('q')
+        self.years = array('H')
+        self.ratings = array('d')
+        self.studio_ids = array('l')
+        self.genre_offsets = array('L', [0])
+        self.genre_ids = array('L')
+        self.studios = []
+        self.genres = []
+        self._studio_lookup = {}
+        self._genre_lookup = {}
+
+    def __len__(self):
+        return len(self.rating_keys)
+
+    @classmethod
+    def from_items(cls, items):
+        """Build a snapshot in a single pass over plexapi items"""
+        snapshot = cls()
+        for item in items:
+            snapshot.add_item(item)
+        return snapshot
+
+    def add_item(self, item):
+        """Append one plexapi Movie/Show without keeping a reference to it"""
+        self.add(*item_values(item))
+
+    def add(self, rating_key, year=None, rating=None, studio=None, genres=()):
+        """Append one row from plain values"""
+        self.rating_keys.append(int(rating_key))
+        self.years.append(int(year) if year else NO_YEAR)
+        self.ratings.append(float(rating) if rating is not None else NO_RATING)
+        self.studio_ids.append(self._intern_studio(studio) if studio else NO_STUDIO)
+        for genre in genres:
+            self.genre_ids.append(self._intern_genre(genre))
+        self.genre_offsets.append(len(self.genre_ids))
+
+    def _intern_studio(self, studio):
+        studio_id = self._studio_lookup.get(studio)
+        if studio_id is None:
+            studio_id = self._studio_lookup[studio] = len(self.studios)
+            self.studios.append(studio)
+        return studio_id
+
+    def _intern_genre(self, genre):
+        genre_id = self._genre_lookup.get(genre)
+        if genre_id is None:
+            genre_id = self._genre_lookup[genre] = len(self.genres)
+            self.genres.append(genre)
+        return genre_id
+
+    def group_by_decade(self):
+        """Map decade (1990, 2000, ...) to the ratingKeys released in it"""
+        groups = {}
+        keys = self.rating_keys
+        for row, year in enumerate(self.years):
+            if year != NO_YEAR:
+                groups.setdefault((year // 10) * 10, []).append(keys[row])
+        return groups
+
+    def group_by_year(self):
+        """Map release year to ratingKeys"""
+        groups = {}
+        keys = self.rating_keys
+        for row, year in enumerate(self.years):
+            if year != NO_YEAR:
+                groups.setdefault(year, []).append(keys[row])
+        return groups
+
+    def group_by_studio(self):
+        """Map studio/network name to ratingKeys"""
+        buckets = [[] for _ in self.studios]
+        keys = self.rating_keys
+        for row, studio_id in enumerate(self.studio_ids):
+            if studio_id != NO_STUDIO:
+                buckets[studio_id].append(keys[row])
+        return {self.studios[i]: bucket for i, bucket in enumerate(buckets) if bucket}
+
+    def group_by_genre(self):
+        """Map genre tag to ratingKeys"""
+        buckets = [[] for _ in self.genres]
+        keys = self.rating_keys
+        offsets = self.genre_offsets
+        genre_ids = self.genre_ids
+        for row in range(len(keys)):
+            for genre_id in genre_ids[offsets[row]:offsets[row + 1]]:
+                buckets[genre_id].append(keys[row])
+        return {self.genres[i]: bucket for i, bucket in enumerate(buckets) if bucket}
+
+    def rated_at_least(self, threshold):
+        """Return ratingKeys whose rating is >= threshold"""
+        keys = self.rating_keys
+        return [
+            keys[row] for row, rating in enumerate(self.ratings)
+            if not math.isnan(rating) and rating >= threshold
+        ]
+
+    def save(self, path, meta=None):
+        """Write the snapshot to a versioned columnar file; meta is stored in its header"""
+        columns = []
+        offset = 0
+        for name, typecode in SNAPSHOT_COLUMNS:
+            column = getattr(self, name)
+            if not isinstance(column, array) or column.typecode != typecode:
+                column = array(typecode, column)
+            columns.append((name, typecode, offset, len(column), column))
+            offset += _aligned(len(column) * column.itemsize)
+
+        header = json.dumps({
+            'meta': meta or {},
+            'rows': len(self),
+            'byteorder': sys.byteorder,
+            'studios': self.studios,
+            'genres': self.genres,
+            'columns': [
+                {'name': name, 'type': typecode, 'offset': start, 'length': length}
+                for name, typecode, start, length, _ in columns
+            ],
+        }).encode('utf-8')
+        header += b' ' * (_aligned(SNAPSHOT_PREFIX.size + len(header)) - SNAPSHOT_PREFIX.size - len(header))
+
+        with open(path, 'wb') as f:
+            f.write(SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header)))
+            f.write(header)
+            for _, _, _, _, column in columns:
+                data = column.tobytes()
+                f.write(data)
+                f.write(b'\0' * (_aligned(len(data)) - len(data)))
+        return path
+
+    @classmethod
+    def load(cls, path):
+        """Open a snapshot file and return (snapshot, meta)
+
+        Columns are zero-copy memoryviews over a read-only memory map, so
+        loading costs little more than parsing the header and the pages a
+        grouping actually touches are read lazily. The result is read-only.
+        """
+        with open(path, 'rb') as f:
+            prefix = f.read(SNAPSHOT_PREFIX.size)
+            if len(prefix) < SNAPSHOT_PREFIX.size:
+                raise ValueError(f"{path} is not a PMM snapshot")
+            magic, version, header_length = SNAPSHOT_PREFIX.unpack(prefix)
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not a PMM snapshot")
+            if version != SNAPSHOT_VERSION:
+                raise ValueError(f"{path} uses snapshot format {version}, expected {SNAPSHOT_VERSION}")
+            header = json.loads(f.read(header_length))
+            data_start = SNAPSHOT_PREFIX.size + header_length
+            # Never empty: even a snapshot without rows stores genre_offsets [0]
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        snapshot = cls()
+        view = memoryview(buffer)
+        for column in header['columns']:
+            start = data_start + column['offset']
+            size = array(column['type']).itemsize * column['length']
+            values = view[start:start + size].cast(column['type'])
+            if header['byteorder'] != sys.byteorder:
+                # Foreign byte order: fall back to a swapped in-memory copy
+                values = array(column['type'], values.tobytes())
+                values.byteswap()
+            setattr(snapshot, column['name'], values)
+        snapshot.studios = header['studios']
+        snapshot.genres = header['genres']
+        snapshot._studio_lookup = {name: i for i, name in enumerate(snapshot.studios)}
+        snapshot._genre_lookup = {name: i for i, name in enumerate(snapshot.genres)}
+        return snapshot, header['meta']
+
+
+def _aligned(size, alignment=8):
+    return (size + alignment - 1) // alignment * alignment
+
+
+def iter_items_by_key(query, rating_keys, batch_size=200):
+    """Yield ItemRecords for specific ratingKeys, batch_size keys per request"""
+    rating_keys = list(rating_keys)
+    for start in range(0, len(rating_keys), batch_size):
+        batch = ','.join(str(key) for key in rating_keys[start:start + batch_size])
+        for element in query(f"/library/metadata/{batch}?includeGuids=1"):
+            if 'ratingKey' in element.attrib:
+                yield ItemRecord.from_element(element)
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+PMM State Store
+SQLite-backed record of library watermarks, item metadata, the
+collection membership computed on the previous run and the checkpoints
+of runs in progress
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from snapshot import LibrarySnapshot, item_guids, item_values
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS watermarks (
+    library_key TEXT PRIMARY KEY,
+    updated_at INTEGER NOT NULL,
+    added_at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    library_key TEXT NOT NULL,
+    rating_key INTEGER NOT NULL,
+    year INTEGER,
+    rating REAL,
+    studio TEXT,
+    genres TEXT NOT NULL,
+    guids TEXT,
+    PRIMARY KEY (library_key, rating_key)
+);
+CREATE TABLE IF NOT EXISTS memberships (
+    library_key TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    rating_keys TEXT NOT NULL,
+    PRIMARY KEY (library_key, collection)
+);
+CREATE TABLE IF NOT EXISTS task_runs (
+    task TEXT PRIMARY KEY,
+    started_at REAL NOT NULL,
+    finished_at REAL NOT NULL,
+    success INTEGER NOT NULL,
+    last_success_at REAL
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    run TEXT NOT NULL,
+    unit TEXT NOT NULL,
+    value TEXT,
+    recorded_at REAL NOT NULL,
+    PRIMARY KEY (run, unit)
+);
+"""
+
+
+def _timestamp(value):
+    """Convert a plexapi datetime (or None) to epoch seconds"""
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return int(value or 0)
+
+
+def _encode_keys(rating_keys):
+    return ','.join(str(key) for key in sorted(rating_keys))
+
+
+def _decode_keys(text):
+    return [int(key) for key in text.split(',')] if text else []
+
+
+class StateStore:
+    """Persistent change-tracking store shared by all libraries of a run"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(task_runs)")}
+        if 'last_success_at' not in columns:
+            # Stores created before success times were tracked
+            self._conn.execute("ALTER TABLE task_runs ADD COLUMN last_success_at REAL")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(items)")}
+        if 'guids' not in columns:
+            # Stores created before GUIDs were kept: a full sync fills them in
+            self._conn.execute("ALTER TABLE items ADD COLUMN guids TEXT")
+            self._conn.execute("DELETE FROM watermarks")
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get_watermark(self, library_key):
+        """Return (updated_at, added_at) epoch seconds, or None before the first sync"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT updated_at, added_at FROM watermarks WHERE library_key = ?",
+                (str(library_key),),
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def clear_watermark(self, library_key):
+        """Forget a library's watermarks, so its next sync is a full sweep"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM watermarks WHERE library_key = ?", (str(library_key),))
+
+    def count_items(self, library_key):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM items WHERE library_key = ?", (str(library_key),)
+            ).fetchone()[0]
+
+    def get_rating_keys(self, library_key):
+        """Return the set of ratingKeys stored for a library"""
+        with self._lock:
+            cursor = self._conn.execute("SELECT rating_key FROM items WHERE library_key = ?", (str(library_key),))
+            return {rating_key for rating_key, in cursor}
+
+    def upsert_items(self, library_key, items, replace=False, batch_size=1000, progress=None,
+                     advance_watermark=True):
+        """Store item rows and advance the library watermarks; return rows written
+
+        Items are consumed as a stream and written in batches, so a paged
+        fetch never has to be held in memory. With ``replace`` the library's
+        previous rows and watermark are dropped first, which is how a full
+        sweep picks up deletions; if that sweep is interrupted the missing
+        watermark forces another full sweep next time. ``progress`` is
+        called with the rows written so far after each batch is committed.
+
+        Only paged sweeps may advance the watermarks: items fetched by
+        ratingKey (library events) pass ``advance_watermark=False``, since
+        moving the watermark past them would hide older edits whose alerts
+        were missed from the next sweep.
+        """
+        library_key = str(library_key)
+        if replace:
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM items WHERE library_key = ?", (library_key,))
+                self._conn.execute("DELETE FROM watermarks WHERE library_key = ?", (library_key,))
+
+        written = 0
+        updated_at = added_at = 0
+        rows = []
+        for item in items:
+            rating_key, year, rating, studio, genres = item_values(item)
+            rows.append((library_key, rating_key, year, rating, studio, json.dumps(genres),
+                         json.dumps(item_guids(item))))
+            updated_at = max(updated_at, _timestamp(getattr(item, 'updatedAt', None)))
+            added_at = max(added_at, _timestamp(getattr(item, 'addedAt', None)))
+            if len(rows) >= batch_size:
+                written += self._write_rows(rows)
+                rows = []
+                if progress is not None:
+                    progress(written)
+        written += self._write_rows(rows)
+        if not advance_watermark:
+            return written
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                """INSERT INTO watermarks VALUES (?, ?, ?)
+                   ON CONFLICT(library_key) DO UPDATE SET
+                       updated_at = MAX(updated_at, excluded.updated_at),
+                       added_at = MAX(added_at, excluded.added_at)""",
+                (library_key, updated_at, added_at),
+            )
+        return written
+
+    def _write_rows(self, rows):
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def delete_items(self, library_key, rating_keys):
+        """Forget items that were removed from the library"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM items WHERE library_key = ? AND rating_key = ?",
+                [(str(library_key), int(key)) for key in rating_keys],
+            )
+
+    def load_snapshot(self, library_key):
+        """Rebuild a LibrarySnapshot from the stored item rows"""
+        snapshot = LibrarySnapshot()
+        with self._lock:
+            cursor = self._conn.execute(
+                """SELECT rating_key, year, rating, studio, genres FROM items
+                   WHERE library_key = ? ORDER BY rating_key""",
+                (str(library_key),),
+            )
+            for rating_key, year, rating, studio, genres in cursor:
+                snapshot.add(rating_key, year, rating, studio, json.loads(genres))
+        return snapshot
+
+    def get_guids(self, library_key):
+        """Return {ratingKey: agent GUIDs} for a library's items"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT rating_key, guids FROM items WHERE library_key = ? AND guids IS NOT NULL",
+                (str(library_key),),
+            )
+            return {rating_key: json.loads(guids) for rating_key, guids in cursor}
+
+    def get_memberships(self, library_key):
+        """Return {collection title: sorted ratingKeys} from the last run"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT collection, rating_keys FROM memberships WHERE library_key = ?",
+                (str(library_key),),
+            )
+            return {title: _decode_keys(keys) for title, keys in cursor}
+
+    def set_membership(self, library_key, collection, rating_keys):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO memberships VALUES (?, ?, ?)",
+                (str(library_key), collection, _encode_keys(rating_keys)),
+            )
+
+    def prune_memberships(self, library_key, keep):
+        """Drop stored memberships for collections no longer produced"""
+        keep = set(keep)
+        stale = [title for title in self.get_memberships(library_key) if title not in keep]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM memberships WHERE library_key = ? AND collection = ?",
+                [(str(library_key), title) for title in stale],
+            )
+        return stale
+
+    def get_task_run(self, task):
+        """Return when a maintenance task last started (epoch seconds), or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT started_at FROM task_runs WHERE task = ?", (task,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_task_run(self, task, started_at, finished_at, success):
+        """Record the latest run of a maintenance task"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                """INSERT INTO task_runs (task, started_at, finished_at, success, last_success_at)
+                   VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(task) DO UPDATE SET started_at = excluded.started_at,
+                       finished_at = excluded.finished_at, success = excluded.success,
+                       last_success_at = COALESCE(excluded.last_success_at, task_runs.last_success_at)""",
+                (task, started_at, finished_at, int(bool(success)), finished_at if success else None),
+            )
+
+    def get_task_runs(self):
+        """Return {task: {started_at, finished_at, success, last_success_at}} for all tasks"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT task, started_at, finished_at, success, last_success_at FROM task_runs"
+            ).fetchall()
+        return {
+            task: {'started_at': started_at, 'finished_at': finished_at,
+                   'success': bool(success), 'last_success_at': last_success_at}
+            for task, started_at, finished_at, success, last_success_at in rows
+        }
+
+    def get_checkpoints(self, run, max_age=None):
+        """Return {unit: value} checkpointed by an unfinished run, ignoring those older than max_age seconds"""
+        cutoff = time.time() - max_age if max_age is not None else 0
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT unit, value FROM checkpoints WHERE run = ? AND recorded_at >= ?", (run, cutoff)
+            )
+            return {unit: json.loads(value) for unit, value in cursor}
+
+    def set_checkpoint(self, run, unit, value=None):
+        """Record that a run finished a unit of work (with optional JSON progress)"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)",
+                (run, unit, json.dumps(value), time.time()),
+            )
+
+    def clear_checkpoints(self, run, unit=None):
+        """Forget a finished run's checkpoints, or just one unit's"""
+        with self._lock, self._conn:
+            if unit is None:
+                self._conn.execute("DELETE FROM checkpoints WHERE run = ?", (run,))
+            else:
+                self._conn.execute("DELETE FROM checkpoints WHERE run = ? AND unit = ?", (run, unit))
+
+
+class Checkpoints:
+    """The units of work one task run has finished, kept until the run ends
+
+    A run cut short by a crash or restart leaves its checkpoints in the
+    store, so the next run of the same task can skip what was already done.
+    Checkpoints older than ``max_age`` seconds are ignored; without a store
+    nothing is kept.
+    """
+
+    def __init__(self, store, run, max_age=None):
+        self.store = store
+        self.run = run
+        self._lock = threading.Lock()
+        self._done = store.get_checkpoints(run, max_age) if store is not None else {}
+
+    def __contains__(self, unit):
+        with self._lock:
+            return unit in self._done
+
+    def __len__(self):
+        with self._lock:
+            return len(self._done)
+
+    def get(self, unit, default=None):
+        with self._lock:
+            return self._done.get(unit, default)
+
+    def complete(self, unit, value=None):
+        """Record a finished unit, or the progress made on one"""
+        with self._lock:
+            self._done[unit] = value
+        if self.store is not None:
+            self.store.set_checkpoint(self.run, unit, value)
+
+    def discard(self, unit):
+        with self._lock:
+            self._done.pop(unit, None)
+        if self.store is not None:
+            self.store.clear_checkpoints(self.run, unit)
+
+    def finish(self):
+        """End the run: nothing is left to resume"""
+        with self._lock:
+            self._done.clear()
+        if self.store is not None:
+            self.store.clear_checkpoints(self.run)
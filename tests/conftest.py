@@ -0,0 +1,78 @@
+"""
+Shared fixtures: a mock_plex server and SimplePMM instances pointed at it
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# pmm sets up logging from PMM_CONFIG_PATH when imported; keep test logs
+# out of the repository
+_LOG_DIR = tempfile.mkdtemp(prefix='pmm-tests-')
+with open(os.path.join(_LOG_DIR, 'pmm_config.yml'), 'w', encoding='utf-8') as f:
+    yaml.safe_dump({'logging': {'file': os.path.join(_LOG_DIR, 'pmm.log'), 'stdout': False}}, f)
+os.environ['PMM_CONFIG_PATH'] = _LOG_DIR
+
+from mock_plex import MockPlexServer, synthetic_sections  # noqa: E402
+
+
+def _merge(base, override):
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+@pytest.fixture
+def plex(request):
+    """A mock Plex server with 500 movies and 100 shows, or (movies, shows) given by indirect parametrization"""
+    movies, shows = getattr(request, 'param', (500, 100))
+    with MockPlexServer(synthetic_sections(movies, shows)) as server:
+        yield server
+
+
+@pytest.fixture
+def make_pmm(plex, tmp_path, monkeypatch):
+    """Build SimplePMM instances for the mock server from pmm_config.yml plus overrides
+
+    Instances made by one test share a state database, like runs of one
+    installation.
+    """
+    import pmm
+
+    with open(os.path.join(ROOT, 'config', 'pmm_config.yml'), encoding='utf-8') as f:
+        base = yaml.safe_load(f)
+    base = _merge(base, {
+        'logging': {'file': str(tmp_path / 'logs' / 'pmm.log'), 'stdout': False},
+        'maintenance': {'wait_for_scan': False},
+        'tmdb': {'cache_file': str(tmp_path / 'tmdb_cache.db')},
+    })
+    config_dir = tmp_path / 'config'
+    config_dir.mkdir()
+    monkeypatch.setenv('PLEX_URL', plex.url)
+    monkeypatch.setenv('PLEX_TOKEN', plex.token)
+    monkeypatch.setenv('PMM_CONFIG_PATH', str(config_dir))
+    monkeypatch.setenv('PMM_STATE_DB', str(tmp_path / 'pmm_state.db'))
+    monkeypatch.delenv('TMDB_API_KEY', raising=False)
+    monkeypatch.delenv('RUN_SCHEDULE', raising=False)
+    instances = []
+
+    def make(**overrides):
+        with open(config_dir / 'pmm_config.yml', 'w', encoding='utf-8') as f:
+            yaml.safe_dump(_merge(base, overrides), f)
+        instance = pmm.SimplePMM()
+        instances.append(instance)
+        return instance
+
+    yield make
+    for instance in instances:
+        instance.state.close()
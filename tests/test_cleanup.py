@@ -0,0 +1,136 @@
+"""
+Temp directory cleanup policies
+"""
+
+import json
+import os
+import time
+
+from cleanup import CleanupEngine, CleanupPolicy
+
+KB = 1024
+HOUR = 3600
+
+
+def _file(root, relative, age_seconds, size=KB):
+    """Create root/relative with size bytes, last modified age_seconds ago"""
+    path = root / relative
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'x' * size)
+    mtime = time.time() - age_seconds
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def _files(root):
+    return sorted(path.relative_to(root).as_posix() for path in root.rglob('*') if path.is_file())
+
+
+def _run(root, dry_run=False, decision_log=None, **policy):
+    engine = CleanupEngine([CleanupPolicy(root, **policy)], workers=2, dry_run=dry_run,
+                           decision_log=decision_log)
+    [result] = engine.run()
+    return result
+
+
+def test_age_deletes_only_files_older_than_max_age(tmp_path):
+    _file(tmp_path, 'old.tmp', 48 * HOUR, size=3 * KB)
+    _file(tmp_path, 'sub/older.tmp', 72 * HOUR)
+    _file(tmp_path, 'new.tmp', 1 * HOUR)
+
+    result = _run(tmp_path, max_age_hours=24)
+    assert _files(tmp_path) == ['new.tmp']
+    assert result['scanned_files'] == 3
+    assert result['deleted_files'] == 2
+    assert result['deleted_bytes'] == 4 * KB
+    assert result['errors'] == 0
+
+
+def test_quota_deletes_oldest_files_first(tmp_path):
+    for hours in (1, 2, 3, 4):
+        _file(tmp_path, f'{hours}h.tmp', hours * HOUR)
+
+    result = _run(tmp_path, max_size_gb=2.5 * KB / 1024 ** 3)
+    assert _files(tmp_path) == ['1h.tmp', '2h.tmp']
+    assert result['deleted_files'] == 2
+
+
+def test_globs_match_names_and_relative_paths(tmp_path):
+    for relative in ('a.tmp', 'sub/b.tmp', 'cache/c.bin', 'other.bin', 'keep/d.tmp', 'important.tmp'):
+        _file(tmp_path, relative, 48 * HOUR)
+
+    _run(tmp_path, max_age_hours=24, include=['*.tmp', 'cache/*'], exclude=['keep/*', 'important.tmp'])
+    assert _files(tmp_path) == ['important.tmp', 'keep/d.tmp', 'other.bin']
+
+
+def test_recently_modified_files_are_never_deleted(tmp_path):
+    _file(tmp_path, 'writing.part', 5 * 60)
+    _file(tmp_path, 'settled.part', 20 * 60)
+
+    _run(tmp_path, max_age_hours=0.001, min_age_minutes=10)
+    assert _files(tmp_path) == ['writing.part']
+
+    # Not even to get under quota
+    _run(tmp_path, max_size_gb=1 / 1024 ** 3, min_age_minutes=10)
+    assert _files(tmp_path) == ['writing.part']
+
+
+def test_dry_run_reports_the_same_counts_without_deleting(tmp_path):
+    for hours in (1, 2, 3, 30, 40):
+        _file(tmp_path, f'dir/{hours}h.tmp', hours * HOUR)
+    policy = {'max_age_hours': 24, 'max_size_gb': 1.5 * KB / 1024 ** 3, 'remove_empty_dirs': True}
+    log = tmp_path.parent / 'dry.jsonl'
+
+    dry = _run(tmp_path, dry_run=True, decision_log=log, **policy)
+    assert len(_files(tmp_path)) == 5
+    assert {json.loads(line)['action'] for line in log.read_text().splitlines()} == {'would_delete'}
+
+    real = _run(tmp_path, **policy)
+    assert _files(tmp_path) == ['dir/1h.tmp']
+    for key in ('scanned_files', 'scanned_bytes', 'deleted_files', 'deleted_bytes'):
+        assert dry[key] == real[key]
+
+
+def test_decision_log_records_every_deletion(tmp_path):
+    root = tmp_path / 'temp'
+    old = _file(root, 'old.tmp', 48 * HOUR, size=2 * KB)
+    big = _file(root, 'big.tmp', 2 * HOUR, size=4 * KB)
+    _file(root, 'new.tmp', 1 * HOUR)
+    log = tmp_path / 'logs' / 'decisions.jsonl'
+
+    _run(root, decision_log=log, max_age_hours=24, max_size_gb=2 * KB / 1024 ** 3)
+    decisions = sorted((json.loads(line) for line in log.read_text().splitlines()), key=lambda d: d['path'])
+    assert [(d['action'], d['reason'], d['path'], d['bytes']) for d in decisions] == [
+        ('delete', 'quota', str(big), 4 * KB),
+        ('delete', 'age', str(old), 2 * KB),
+    ]
+
+
+def test_remove_empty_dirs_keeps_the_root(tmp_path):
+    root = tmp_path / 'transcode'
+    _file(root, 'session/a/old.ts', 48 * HOUR)
+    _file(root, 'session/b/old.ts', 48 * HOUR)
+    _file(root, 'busy/old.ts', 48 * HOUR)
+    _file(root, 'busy/new.ts', 1 * HOUR)
+    _file(root, 'top.ts', 48 * HOUR)
+
+    _run(root, max_age_hours=24, remove_empty_dirs=True)
+    assert root.is_dir()
+    assert _files(root) == ['busy/new.ts']
+    assert sorted(path.name for path in root.iterdir()) == ['busy']
+
+
+def test_cleanup_temp_files_applies_the_configured_policies(make_pmm, tmp_path):
+    root = tmp_path / 'temp'
+    _file(root, 'old.tmp', 48 * HOUR)
+    _file(root, 'new.tmp', 1 * HOUR)
+    pmm = make_pmm(cleanup={'decision_log': str(tmp_path / 'decisions.jsonl'),
+                            'directories': [{'path': str(root), 'max_age_hours': 24}]})
+
+    assert pmm.cleanup_temp_files(dry_run=True)
+    assert _files(root) == ['new.tmp', 'old.tmp']
+    assert 'pmm_cleanup_files_total' not in pmm.metrics.render_prometheus()
+
+    assert pmm.cleanup_temp_files()
+    assert _files(root) == ['new.tmp']
+    assert f'pmm_cleanup_files_total{{path="{root}"}} 1' in pmm.metrics.render_prometheus()
@@ -0,0 +1,87 @@
+"""
+Collection writes against mock_plex
+"""
+
+import threading
+from collections import Counter
+
+import pytest
+
+from mock_plex import existing_collections
+
+
+def _titles(plex):
+    with plex.state.lock:
+        return Counter((collection['section'], collection['title']) for collection in plex.state.collections.values())
+
+
+@pytest.mark.parametrize('mode', ['static', 'smart'])
+def test_lost_create_responses_do_not_duplicate_collections(plex, make_pmm, monkeypatch, mode):
+    pmm = make_pmm(collections={'mode': mode}, advanced={'max_retries': 3})
+    monkeypatch.setattr('pmm.time.sleep', lambda seconds: None)
+    plex.lose_responses('POST /library/collections', 3)
+
+    assert not pmm.create_collections()
+    titles = _titles(plex)
+    assert titles and set(titles.values()) == {1}
+
+
+def test_collection_indexes_are_reset_under_the_collections_lock(plex, make_pmm):
+    pmm = make_pmm()
+    in_use = {}
+    with pmm._collections_lock:
+        pmm._collection_indexes = in_use
+        run = threading.Thread(target=pmm.create_collections)
+        run.start()
+        run.join(timeout=1)
+        # Another run is still waiting for the lock and left this run's indexes alone
+        assert run.is_alive() and pmm._collection_indexes is in_use
+    run.join()
+    assert pmm._collection_indexes is not in_use
+
+
+def test_existing_collections_are_updated_in_place(plex, make_pmm):
+    seeded = existing_collections(list(plex.state.sections.values()), 5)
+    plex.state.initial_collections = seeded
+    plex.reset()
+    pmm = make_pmm()
+
+    assert not pmm.create_collections()
+    titles = _titles(plex)
+    assert set(titles.values()) == {1}
+    movies = plex.state.sections['1']
+    with plex.state.lock:
+        for collection in plex.state.collections.values():
+            if collection['section'] == '1' and collection['title'] in seeded['1']:
+                value = collection['title'][:-len(' Movies')]
+                expected = {item['ratingKey'] for item in movies.items
+                            if value in item['genres'] or value == item['studio']}
+                assert set(collection['items']) == expected
+
+
+def test_membership_writes_send_ratingkeys_without_fetching_items(plex, make_pmm):
+    seeded = existing_collections(list(plex.state.sections.values()), 3)
+    plex.state.initial_collections = seeded
+    plex.reset()
+    with plex.state.lock:
+        before = {(c['section'], c['title']): set(c['items']) for c in plex.state.collections.values()}
+    pmm = make_pmm(collections={'write_batch_size': 7}, advanced={'max_workers': 1})
+
+    assert not pmm.create_collections()
+    stats = plex.stats()['requests']
+    assert not any(endpoint.startswith('GET /library/metadata') for endpoint in stats)
+
+    puts = posts = deletes = 0
+    with plex.state.lock:
+        for collection in plex.state.collections.values():
+            items = set(collection['items'])
+            old = before.get((collection['section'], collection['title']))
+            if old is None:
+                posts += 1
+                puts += -(-len(items) // 7) - 1
+            else:
+                puts += -(-len(items - old) // 7)
+                deletes += len(old - items)
+    assert stats['POST /library/collections'] == posts
+    assert stats['PUT /library/collections/{id}/items'] == puts
+    assert stats['DELETE /library/collections/{id}/items/{id}'] == deletes
@@ -0,0 +1,91 @@
+"""
+Library event handling against mock_plex
+"""
+
+import time
+
+from events import ChangeBatcher, LibraryEventListener
+
+
+def _stored_genres(pmm, rating_key):
+    snapshot = pmm.state.load_snapshot('1')
+    index = snapshot.rating_keys.index(rating_key)
+    genre_ids = snapshot.genre_ids[snapshot.genre_offsets[index]:snapshot.genre_offsets[index + 1]]
+    return sorted(snapshot.genres[genre_id] for genre_id in genre_ids)
+
+
+def test_event_batches_do_not_hide_missed_edits(plex, make_pmm):
+    pmm = make_pmm()
+    assert not pmm.create_collections()
+
+    # An edit whose alert never arrived...
+    with plex.state.lock:
+        _, missed = plex.state.find_item(10)
+        missed['genres'] = ['Western']
+        missed['updatedAt'] = int(time.time()) - 60
+    # ...followed by an alert for a later edit of another item
+    plex.update_item(20, genres=['War'])
+    pmm.apply_item_changes('1', [20], [])
+    assert _stored_genres(pmm, 20) == ['War']
+
+    # The next incremental sweep still picks up the missed edit
+    library = pmm.plex.library.sectionByID(1)
+    pmm._load_snapshot(library)
+    assert _stored_genres(pmm, 10) == ['Western']
+
+
+def test_failed_batches_are_retried_then_resynced(plex, make_pmm):
+    pmm = make_pmm()
+    assert not pmm.create_collections()
+    with plex.state.lock:
+        _, missed = plex.state.find_item(10)
+        missed['genres'] = ['Western']
+        missed['updatedAt'] = int(time.time()) - 60
+
+    calls = []
+
+    def failing_batch(section_key, changed, deleted):
+        calls.append((section_key, changed, deleted))
+        raise RuntimeError('Plex unavailable')
+
+    listener = LibraryEventListener(None, failing_batch, debounce=0, max_attempts=3,
+                                    on_dropped=pmm._resync_library)
+    listener.batcher.add('1', 10)
+    for _ in range(5):
+        listener.dispatch_due()
+    assert calls == [('1', [10], [])] * 3
+    assert pmm.state.get_watermark('1') is None
+
+    # The dropped change is picked up by the full sweep that follows
+    pmm._load_snapshot(pmm.plex.library.sectionByID(1))
+    assert _stored_genres(pmm, 10) == ['Western']
+
+
+def test_requeue_keeps_newer_events():
+    batcher = ChangeBatcher(debounce=0)
+    batcher.add('1', 5, deleted=True)
+    batcher.requeue('1', [5, 6], [7])
+    assert batcher.pop_due() == {'1': ([6], [5, 7])}
+
+
+def test_deletions_balanced_by_additions_are_reconciled(plex, make_pmm):
+    pmm = make_pmm()
+    assert not pmm.create_collections()
+
+    # One item deleted and one added leave the count unchanged
+    plex.delete_item(10)
+    added = plex.add_item('1', genres=['Western'])
+    assert not pmm.create_collections()
+    with plex.state.lock:
+        listed = {item['ratingKey'] for item in plex.state.sections['1'].items}
+    assert 10 not in listed and added in listed
+    assert pmm.state.get_rating_keys('1') == listed
+    memberships = pmm.state.get_memberships('1')
+    assert all(10 not in keys for keys in memberships.values())
+    assert added in memberships['Western Movies']
+
+    # An item a sweep skipped is fetched by ratingKey, without a full sync
+    pmm.state.delete_items('1', [20])
+    pmm._load_snapshot(pmm.plex.library.sectionByID(1))
+    assert pmm.state.get_rating_keys('1') == listed
+    assert pmm.state.get_watermark('1') is not None
@@ -0,0 +1,43 @@
+"""
+Several Plex servers managed by one PMMFleet
+"""
+
+import socket
+
+import pytest
+
+
+@pytest.fixture
+def dead_url():
+    """A local URL nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return f'http://127.0.0.1:{port}'
+
+
+def test_a_server_that_is_down_does_not_stop_the_others(plex, make_pmm, dead_url):
+    import pmm
+
+    make_pmm(servers=[{'name': 'down', 'url': dead_url, 'token': 'token'},
+                      {'name': 'up', 'url': plex.url, 'token': plex.token}],
+             advanced={'max_retries': 0, 'timeout': 5})
+    fleet = pmm.PMMFleet()
+    try:
+        assert [server.label for server in fleet.servers] == ['down', 'up']
+        # A call that raises is logged and reported as None for that server only
+        assert fleet.run(lambda server: server.plex.friendlyName, 'status') == {'down': None, 'up': 'Mock Plex'}
+
+        assert not fleet.run_task('manage_collections')
+        with plex.state.lock:
+            assert plex.state.collections
+
+        healthy, status = fleet.health_status(ready=True)
+        assert not healthy
+        assert status['servers']['up']['status'] == 'ready'
+        assert status['servers']['up']['tasks']['manage_collections']['success']
+        assert status['servers']['down']['problems'] == ['not connected to Plex',
+                                                        'last manage_collections run failed']
+    finally:
+        for server in fleet.servers:
+            server.state.close()
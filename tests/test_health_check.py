@@ -0,0 +1,52 @@
+"""
+health_check.py timeouts and result cache
+"""
+
+import time
+
+import health_check
+
+
+def _check(seconds, message):
+    def check():
+        time.sleep(seconds)
+        return True, message
+    return check
+
+
+def test_each_check_gets_its_own_timeout(tmp_path):
+    checks = [
+        ("Slow", _check(5, "slow"), 0),
+        ("Fast", _check(0.2, "fast"), 0),
+    ]
+    started = time.monotonic()
+    results = health_check.run_checks(checks, timeout=1, cache_file=tmp_path / 'cache.json')
+    assert time.monotonic() - started < 2
+    assert results["Slow"] == (False, "✗ Timed out after 1s")
+    assert results["Fast"] == (True, "fast")
+
+
+def test_cached_results_are_per_target(tmp_path, monkeypatch):
+    cache_file = tmp_path / 'cache.json'
+    calls = []
+
+    def check():
+        calls.append(health_check.plex_target())
+        return True, f"✓ {calls[-1]}"
+
+    checks = [("Plex Connection", check, 60, health_check.plex_target)]
+
+    for url in ('http://a:32400', 'http://b:32400', 'http://a:32400'):
+        monkeypatch.setenv('PLEX_URL', url)
+        passed, message = health_check.run_checks(checks, cache_file=cache_file)["Plex Connection"]
+        assert passed and message.startswith(f"✓ {url}")
+    assert calls == ['http://a:32400', 'http://b:32400']
+
+
+def test_config_is_read_from_pmm_config_path(tmp_path, monkeypatch):
+    (tmp_path / 'pmm_config.yml').write_text("libraries: [Movies, TV Shows]\nadvanced:\n  max_retries: 5\n")
+    monkeypatch.setenv('PMM_CONFIG_PATH', str(tmp_path))
+
+    assert health_check.config_file() == str(tmp_path / 'pmm_config.yml')
+    assert health_check.load_config()['advanced'] == {'max_retries': 5}
+    assert health_check.check_configuration() == (True, "✓ Configuration valid (2 libraries configured)")
@@ -0,0 +1,106 @@
+"""
+Rotating, compressed log files
+"""
+
+import gzip
+import logging
+import os
+import time
+
+import pytest
+
+import log_pipeline
+from log_pipeline import RotatingLogFile
+
+DAY = 86400
+
+
+@pytest.fixture
+def open_log(tmp_path):
+    handlers = []
+
+    def open_log(**options):
+        handler = RotatingLogFile(str(tmp_path / 'logs' / 'pmm.log'), **options)
+        handlers.append(handler)
+        return handler
+
+    yield open_log
+    for handler in handlers:
+        handler.close()
+
+
+def _log(handler, message):
+    handler.emit(logging.LogRecord('pmm', logging.INFO, __file__, 0, message, None, None))
+
+
+def _names(tmp_path):
+    return sorted(os.listdir(tmp_path / 'logs'))
+
+
+def _backdate(path, days):
+    then = time.time() - days * DAY
+    os.utime(path, (then, then))
+
+
+def test_file_rolls_over_at_max_bytes(open_log, tmp_path):
+    handler = open_log(max_bytes=100, compress=False)
+    for number in range(5):
+        _log(handler, f'line {number} ' + 'x' * 60)
+
+    assert _names(tmp_path) == ['pmm.log', 'pmm.log.1', 'pmm.log.2', 'pmm.log.3', 'pmm.log.4']
+    assert (tmp_path / 'logs' / 'pmm.log').read_text().startswith('line 4')
+    assert (tmp_path / 'logs' / 'pmm.log.4').read_text().startswith('line 0')
+
+
+def test_rotated_files_are_gzipped_with_their_mtime(open_log, tmp_path):
+    handler = open_log(max_bytes=100)
+    _log(handler, 'first ' + 'x' * 60)
+    _backdate(tmp_path / 'logs' / 'pmm.log', 2)
+    before = os.path.getmtime(tmp_path / 'logs' / 'pmm.log')
+    _log(handler, 'second ' + 'x' * 60)
+    _log(handler, 'third ' + 'x' * 60)
+
+    assert _names(tmp_path) == ['pmm.log', 'pmm.log.1.gz', 'pmm.log.2.gz']
+    with gzip.open(tmp_path / 'logs' / 'pmm.log.2.gz', 'rt') as f:
+        assert f.read().startswith('first')
+    assert os.path.getmtime(tmp_path / 'logs' / 'pmm.log.2.gz') == pytest.approx(before)
+
+
+def test_file_rolls_over_on_a_new_day(open_log, tmp_path):
+    path = tmp_path / 'logs' / 'pmm.log'
+    path.parent.mkdir()
+    path.write_text('yesterday\n')
+    _backdate(path, 1)
+
+    handler = open_log(compress=False)
+    _log(handler, 'today')
+    _log(handler, 'still today')
+    assert _names(tmp_path) == ['pmm.log', 'pmm.log.1']
+    assert (tmp_path / 'logs' / 'pmm.log.1').read_text() == 'yesterday\n'
+    assert path.read_text() == 'today\nstill today\n'
+
+
+def test_rotated_files_past_retention_are_deleted(open_log, tmp_path):
+    logs = tmp_path / 'logs'
+    logs.mkdir()
+    for name, days in (('pmm.log', 40), ('pmm.log.1.gz', 5), ('pmm.log.2.gz', 29), ('pmm.log.3.gz', 31),
+                       ('pmm.log.4', 60), ('other.log.1', 60)):
+        (logs / name).write_text('old\n')
+        _backdate(logs / name, days)
+
+    open_log(retention_days=0).close()
+    assert len(_names(tmp_path)) == 6
+
+    open_log(retention_days=30)
+    assert _names(tmp_path) == ['other.log.1', 'pmm.log', 'pmm.log.1.gz', 'pmm.log.2.gz']
+
+
+def test_backups_are_capped(open_log, tmp_path, monkeypatch):
+    monkeypatch.setattr(log_pipeline, 'MAX_BACKUPS', 3)
+    handler = open_log(max_bytes=50)
+    for number in range(8):
+        _log(handler, f'line {number} ' + 'x' * 50)
+
+    assert _names(tmp_path) == ['pmm.log', 'pmm.log.1.gz', 'pmm.log.2.gz', 'pmm.log.3.gz']
+    with gzip.open(tmp_path / 'logs' / 'pmm.log.3.gz', 'rt') as f:
+        assert f.read().startswith('line 4')
@@ -0,0 +1,101 @@
+"""
+Maintenance runs against mock_plex: resuming interrupted runs and
+database optimization
+"""
+
+import time
+
+import pytest
+
+
+class Crash(BaseException):
+    """Stands in for the process dying: no handler in PMM catches it"""
+
+
+@pytest.mark.parametrize('plex', [(500, 2500)], indirect=True)
+def test_interrupted_run_resumes_from_checkpoints(plex, make_pmm):
+    settings = {'maintenance': {'tasks': ['scan_libraries', 'manage_collections']},
+                'advanced': {'max_workers': 1}}
+    first = make_pmm(**settings)
+    iter_items = first._iter_items
+
+    def crashing_iter(library, filters=None, start=0):
+        for count, item in enumerate(iter_items(library, filters, start)):
+            if library.title == 'TV Shows' and count == 2200:
+                raise Crash()
+            yield item
+
+    first._iter_items = crashing_iter
+    with pytest.raises(Crash):
+        first.run_maintenance()
+    assert set(first.state.get_checkpoints('maintenance')) == {'scan_libraries'}
+    assert set(first.state.get_checkpoints('manage_collections')) == {'library/1'}
+    assert first.state.get_checkpoints('sync') == {'2': 2000}
+    movie_collections = first.state.get_memberships('1')
+    plex.reset(stats_only=True)
+
+    second = make_pmm(**settings)
+    assert second.run_maintenance()
+    stats = plex.stats()
+    # No rescan, Movies left alone, and only the unsynced shows fetched
+    assert not stats['scans']
+    assert second.state.get_memberships('1') == movie_collections
+    assert second.state.count_items('2') == 2500
+    # Two pages from the sync checkpoint on, plus the TV collection index
+    assert stats['requests']['GET /library/sections/{id}/all'] == 3
+    for run in ('maintenance', 'scan_libraries', 'manage_collections', 'sync'):
+        assert not second.state.get_checkpoints(run)
+
+
+def test_interrupted_collection_writes_are_not_repeated(plex, make_pmm):
+    first = make_pmm(advanced={'max_workers': 1})
+    write = first._create_or_update_collection
+    written = []
+
+    def crashing_write(library, title, rating_keys):
+        if len(written) == 5:
+            raise Crash()
+        written.append(title)
+        return write(library, title, rating_keys)
+
+    first._create_or_update_collection = crashing_write
+    with pytest.raises(Crash):
+        first.run_task('manage_collections')
+    plex.reset(stats_only=True)
+
+    second = make_pmm(advanced={'max_workers': 1})
+    assert second.run_task('manage_collections')
+    with plex.state.lock:
+        titles = [collection['title'] for collection in plex.state.collections.values()]
+    assert len(titles) == len(set(titles))
+    assert plex.stats()['requests']['POST /library/collections'] == len(titles) - len(written)
+
+
+def test_optimize_skips_until_enough_items_changed(plex, make_pmm):
+    pmm = make_pmm(maintenance={'optimize': {'butler_tasks': ['OptimizeDatabase'], 'min_changes': 5}})
+    assert pmm.optimize_database()
+    assert len(plex.stats()['butler_runs']) == 1
+
+    def touch(rating_keys):
+        with plex.state.lock:
+            for rating_key in rating_keys:
+                plex.state.find_item(rating_key)[1]['updatedAt'] = int(time.time()) + 1
+
+    touch(range(1, 4))
+    assert pmm.optimize_database()
+    assert len(plex.stats()['butler_runs']) == 1
+
+    touch(range(4, 6))
+    assert pmm.optimize_database()
+    assert len(plex.stats()['butler_runs']) == 2
+
+
+def test_optimize_waits_for_running_scans(plex, make_pmm):
+    pmm = make_pmm(maintenance={'optimize': {'butler_tasks': ['OptimizeDatabase']}})
+    plex.state.scan_seconds = 3
+    plex.state.butler_seconds = 0.5
+    assert pmm.scan_library()
+
+    assert pmm.optimize_database(force=True)
+    runs = plex.stats()['butler_runs']
+    assert len(runs) == 1 and runs[0]['during_scan'] == []
@@ -0,0 +1,28 @@
+"""
+--profile runs against mock_plex
+"""
+
+import json
+
+import profiling
+
+
+def test_profiled_run_keeps_workers_working(plex, make_pmm, tmp_path):
+    pmm = make_pmm(advanced={'max_workers': 2})
+    output_dir = tmp_path / 'profile'
+    profiling.start_profiling(output_dir)
+    try:
+        with profiling.profile_phase('manage_collections'):
+            errors = pmm.create_collections()
+    finally:
+        profiling.stop_profiling()
+
+    assert not errors
+    summary = json.loads((output_dir / 'summary.json').read_text())
+    phase = summary['phases'][0]
+    assert phase['phase'] == 'manage_collections'
+    assert {child['phase'] for child in phase['children']} == {'manage_collections.Movies',
+                                                               'manage_collections.TV Shows'}
+    report = (output_dir / f"{phase['report']}.txt").read_text()
+    assert 'Top 30 functions' in report
+    assert list(output_dir.glob('*.pstats'))
@@ -0,0 +1,53 @@
+"""
+Collection rules evaluated over snapshots
+"""
+
+import logging
+
+from rules import collections_for, compile_rules
+from snapshot import LibrarySnapshot
+
+
+def _movie_rules():
+    return compile_rules({'movies': {'genres': {'minimum_items': 1}, 'studios': {'enabled': True, 'minimum_items': 1},
+                                     'decades': {'enabled': False}, 'ratings': {'enabled': False}}})['movie']
+
+
+def test_studio_named_like_a_genre_does_not_replace_the_genre_collection(caplog):
+    snapshot = LibrarySnapshot()
+    snapshot.add(1, studio='Comedy', genres=['Drama'])
+    snapshot.add(2, studio='Drama', genres=['Drama'])
+    snapshot.add(3, studio='Drama', genres=['Action'])
+
+    with caplog.at_level(logging.WARNING, logger='rules'):
+        collections = _movie_rules().evaluate(snapshot)
+    assert collections == {'Drama Movies': [1, 2], 'Action Movies': [3], 'Comedy Movies': [1]}
+    assert "studio collection 'Drama Movies'" in caplog.text
+
+
+def test_server_filters_keep_one_filter_per_title():
+    choices = {'genre': [('1', 'Drama'), ('2', 'Action')], 'studio': [('Drama', 'Drama'), ('A24', 'A24')]}
+
+    filters = _movie_rules().server_filters(choices)
+    assert [(title, filters) for title, filters, _ in filters] == [
+        ('Drama Movies', {'genre': '1'}),
+        ('Action Movies', {'genre': '2'}),
+        ('A24 Movies', {'studio': 'A24'}),
+    ]
+
+
+def test_keyword_and_franchise_collections_keep_genre_titles(caplog):
+    rules = compile_rules({'movies': {'genres': {'minimum_items': 1}, 'decades': {'enabled': False},
+                                      'ratings': {'enabled': False},
+                                      'franchises': {'enabled': True, 'minimum_items': 1},
+                                      'keywords': {'enabled': True, 'keywords': ['Action'], 'minimum_items': 1}}})
+    snapshot = LibrarySnapshot()
+    snapshot.add(1, genres=['Action'])
+    snapshot.add(2, genres=['Drama'])
+    enrichment = {1: {'keywords': [], 'franchise': 'Action Movies'},
+                  2: {'keywords': ['action'], 'franchise': None}}
+
+    with caplog.at_level(logging.WARNING, logger='rules'):
+        collections = collections_for('movie', snapshot, rules, enrichment)
+    assert collections == {'Action Movies': [1], 'Drama Movies': [2], 'Action Movies (Keyword)': [2]}
+    assert "TMDb collection 'Action Movies'" in caplog.text
@@ -0,0 +1,127 @@
+"""
+Cron schedules and the task scheduler
+"""
+
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from scheduler import CronSchedule, ScheduledTask, TaskScheduler
+from state_store import StateStore
+
+
+@pytest.mark.parametrize('expression, after, expected', [
+    # Steps, from the start of the range or from a given value
+    ('*/15 * * * *', '2024-03-01 10:07', '2024-03-01 10:15'),
+    ('*/15 * * * *', '2024-03-01 10:45', '2024-03-01 11:00'),
+    ('5/20 * * * *', '2024-03-01 10:26', '2024-03-01 10:45'),
+    # Strictly after, even on a matching minute
+    ('30 6 * * *', '2024-03-01 06:30', '2024-03-02 06:30'),
+    ('06:30', '2024-03-01 06:29', '2024-03-01 06:30'),
+    # Ranges: weekdays 09:00-17:00, from Friday evening to Monday morning
+    ('0 9-17 * * 1-5', '2024-03-01 17:30', '2024-03-04 09:00'),
+    ('0 9-17/4 * * *', '2024-03-01 10:00', '2024-03-01 13:00'),
+    # Day and weekday both restricted: the 13th or any Friday
+    ('0 0 13 * 5', '2024-03-01 00:00', '2024-03-08 00:00'),
+    ('0 0 13 * 5', '2024-03-08 00:00', '2024-03-13 00:00'),
+    # Only one restricted: that one alone decides
+    ('0 0 13 * *', '2024-03-01 00:00', '2024-03-13 00:00'),
+    ('0 0 * * 7', '2024-03-01 00:00', '2024-03-03 00:00'),
+    # Feb 29 only comes every four years
+    ('0 0 29 2 *', '2024-03-01 00:00', '2028-02-29 00:00'),
+])
+def test_next_after(expression, after, expected):
+    parse = lambda text: datetime.strptime(text, '%Y-%m-%d %H:%M')
+    assert CronSchedule(expression).next_after(parse(after)) == parse(expected)
+
+
+@pytest.mark.parametrize('expression', ['0 0 30 2 *', '0 0 31 4,6,9,11 *'])
+def test_never_matching_schedule_raises(expression):
+    with pytest.raises(ValueError, match='never matches'):
+        CronSchedule(expression).next_after(datetime(2024, 3, 1))
+
+
+@pytest.mark.parametrize('expression', ['60 * * * *', '* * * *', '0 0 0 * *', '5-1 * * * *', '*/0 * * * *', '25:00'])
+def test_invalid_schedules_are_rejected(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+def test_jitter_delays_within_bounds():
+    task = ScheduledTask('nightly', lambda: True, '0 6 * * *', jitter=600)
+    after = datetime(2024, 3, 1, 12, 0).timestamp()
+    due = datetime(2024, 3, 2, 6, 0).timestamp()
+    assert all(due <= task.next_due(after) <= due + 600 for _ in range(50))
+
+
+def _run_scheduler(scheduler, seconds):
+    async def run():
+        try:
+            await asyncio.wait_for(scheduler.run(), seconds)
+        except asyncio.TimeoutError:
+            pass
+    asyncio.run(run())
+
+
+@pytest.fixture
+def state(tmp_path):
+    store = StateStore(tmp_path / 'pmm_state.db')
+    yield store
+    store.close()
+
+
+def test_missed_run_is_caught_up_at_startup(state):
+    now = time.time()
+    state.set_task_run('nightly', now - 2 * 86400, now - 2 * 86400 + 60, True)
+    state.set_task_run('hourly', now, now, True)
+    calls = []
+    tasks = [ScheduledTask(name, lambda name=name: calls.append(name), schedule)
+             for name, schedule in (('nightly', datetime.fromtimestamp(now).strftime('%H:%M')),
+                                    ('hourly', '0 * * * *'))]
+    scheduler = TaskScheduler(tasks, state)
+
+    _run_scheduler(scheduler, 0.5)
+    # Only the task whose run came due while PMM was down ran, once
+    assert calls == ['nightly']
+    assert state.get_task_run('nightly') >= now
+    assert state.get_task_runs()['nightly']['success']
+    assert scheduler.next_runs['nightly'] > now
+
+
+def test_first_run_waits_for_the_schedule(state):
+    calls = []
+    scheduler = TaskScheduler([ScheduledTask('nightly', lambda: calls.append(1), '0 6 * * *')], state)
+    _run_scheduler(scheduler, 0.3)
+    assert not calls
+
+
+class EveryTenthSecond(CronSchedule):
+    """A schedule that comes due every 0.1s"""
+
+    def __init__(self):
+        self.expression = 'every 0.1s'
+
+    def next_after(self, when):
+        return when + timedelta(seconds=0.1)
+
+
+def test_task_never_overlaps_itself():
+    running = []
+    overlapped = []
+    lock = threading.Lock()
+
+    def slow_task():
+        with lock:
+            overlapped.append(bool(running))
+            running.append(1)
+        time.sleep(0.35)
+        with lock:
+            running.pop()
+
+    _run_scheduler(TaskScheduler([ScheduledTask('slow', slow_task, EveryTenthSecond())]), 1.2)
+    # Occurrences due while it ran were skipped, not queued up
+    assert 2 <= len(overlapped) <= 3
+    assert not any(overlapped)
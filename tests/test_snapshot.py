@@ -0,0 +1,99 @@
+"""
+Library snapshot files
+"""
+
+import json
+import sys
+from array import array
+
+import pytest
+
+from snapshot import SNAPSHOT_COLUMNS, SNAPSHOT_PREFIX, SNAPSHOT_VERSION, LibrarySnapshot
+
+COLUMNS = [name for name, _ in SNAPSHOT_COLUMNS]
+
+
+def _snapshot():
+    snapshot = LibrarySnapshot()
+    snapshot.add(5, 1999, 8.7, 'Warner Bros.', ['Action', 'Science Fiction'])
+    snapshot.add(17, None, None, None, [])
+    snapshot.add(2 ** 40, 2024, 6.1, 'A24', ['Horror'])
+    snapshot.add(42, 1985, 7.0, 'Warner Bros.', ['Action'])
+    return snapshot
+
+
+def _columns(snapshot):
+    """Every column as a plain list (NaN ratings as None) plus the lookup tables"""
+    values = {name: list(getattr(snapshot, name)) for name in COLUMNS}
+    values['ratings'] = [rating if rating == rating else None for rating in values['ratings']]
+    return values, snapshot.studios, snapshot.genres
+
+
+def test_save_and_load_round_trip(tmp_path):
+    snapshot = _snapshot()
+    path = snapshot.save(tmp_path / 'movies.snap', meta={'library': 'Movies', 'type': 'movie'})
+
+    loaded, meta = LibrarySnapshot.load(path)
+    assert meta == {'library': 'Movies', 'type': 'movie'}
+    assert len(loaded) == 4
+    assert _columns(loaded) == _columns(snapshot)
+    assert loaded.group_by_genre() == snapshot.group_by_genre() == {'Action': [5, 42], 'Science Fiction': [5],
+                                                                    'Horror': [2 ** 40]}
+    assert loaded.group_by_decade() == snapshot.group_by_decade()
+    assert loaded.rated_at_least(7.0) == [5, 42]
+
+
+def test_empty_snapshot_round_trip(tmp_path):
+    loaded, meta = LibrarySnapshot.load(LibrarySnapshot().save(tmp_path / 'empty.snap'))
+    assert meta == {}
+    assert len(loaded) == 0
+    assert list(loaded.genre_offsets) == [0]
+    assert loaded.group_by_genre() == {} and loaded.group_by_studio() == {}
+
+
+def test_files_that_are_not_snapshots_are_rejected(tmp_path):
+    for name, content in (('short', b'PMM'), ('other', b'SQLite format 3\0' + b'\0' * 64)):
+        (tmp_path / name).write_bytes(content)
+        with pytest.raises(ValueError, match='not a PMM snapshot'):
+            LibrarySnapshot.load(tmp_path / name)
+
+
+def test_other_format_versions_are_rejected(tmp_path):
+    path = _snapshot().save(tmp_path / 'movies.snap')
+    data = bytearray(path.read_bytes())
+    magic, _, header_length = SNAPSHOT_PREFIX.unpack_from(data)
+    SNAPSHOT_PREFIX.pack_into(data, 0, magic, SNAPSHOT_VERSION + 1, header_length)
+    path.write_bytes(data)
+
+    with pytest.raises(ValueError, match=f'format {SNAPSHOT_VERSION + 1}'):
+        LibrarySnapshot.load(path)
+
+
+def _foreign_copy(path, target):
+    """Rewrite a snapshot file as if written on a machine of the other byte order"""
+    data = bytearray(path.read_bytes())
+    _, _, header_length = SNAPSHOT_PREFIX.unpack_from(data)
+    data_start = SNAPSHOT_PREFIX.size + header_length
+    header = json.loads(data[SNAPSHOT_PREFIX.size:data_start])
+    for column in header['columns']:
+        start = data_start + column['offset']
+        values = array(column['type'])
+        end = start + values.itemsize * column['length']
+        values.frombytes(bytes(data[start:end]))
+        values.byteswap()
+        data[start:end] = values.tobytes()
+    header['byteorder'] = 'big' if sys.byteorder == 'little' else 'little'
+    encoded = json.dumps(header).encode('utf-8')
+    assert len(encoded) <= header_length
+    data[SNAPSHOT_PREFIX.size:data_start] = encoded.ljust(header_length)
+    target.write_bytes(data)
+    return target
+
+
+def test_foreign_byte_order_is_swapped_on_load(tmp_path):
+    snapshot = _snapshot()
+    path = _foreign_copy(snapshot.save(tmp_path / 'native.snap'), tmp_path / 'foreign.snap')
+
+    loaded, _ = LibrarySnapshot.load(path)
+    assert _columns(loaded) == _columns(snapshot)
+    assert loaded.group_by_studio() == {'Warner Bros.': [5, 42], 'A24': [2 ** 40]}
@@ -0,0 +1,127 @@
+"""
+Adaptive Plex request throttling
+"""
+
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from mock_plex import MockPlexServer, synthetic_sections
+from plex_session import create_session
+from throttle import AdaptiveLimiter, QuietHours, response_overloaded
+
+
+def _hammer(server, session, limiter, threads, requests_each):
+    """Send requests from several threads; return (status counts, lowest limit seen)"""
+    statuses = Counter()
+    lowest = [limiter.limit]
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(requests_each):
+            response = session.get(f'{server.url}/identity', params={'X-Plex-Token': server.token})
+            with lock:
+                statuses[response.status_code] += 1
+                lowest[0] = min(lowest[0], limiter.limit)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return statuses, lowest[0]
+
+
+def test_limit_backs_off_when_plex_is_overloaded_and_recovers():
+    limiter = AdaptiveLimiter(max_concurrency=12, target_latency=0.1)
+    session = create_session(pool_size=12, max_retries=0, limiter=limiter)
+    with MockPlexServer(synthetic_sections(10, 0), latency=0.02, capacity=2) as server:
+        statuses, lowest = _hammer(server, session, limiter, threads=12, requests_each=20)
+        assert statuses[503] and statuses[200]
+        assert lowest <= 3
+
+        server.state.capacity = None
+        statuses, _ = _hammer(server, session, limiter, threads=12, requests_each=20)
+        assert set(statuses) == {200}
+        assert int(limiter.limit) == 12
+
+
+def test_limit_halves_once_per_target_latency():
+    limiter = AdaptiveLimiter(max_concurrency=8, target_latency=0.2)
+    slow = limiter.acquire() - 1
+    limiter.release(slow)
+    assert limiter.limit == 4
+    # Other requests that were already in flight don't count again
+    limiter.release(limiter.acquire(), overloaded=True)
+    assert limiter.limit == 4
+
+    time.sleep(0.25)
+    limiter.release(limiter.acquire(), overloaded=True)
+    assert limiter.limit == 2
+    time.sleep(0.25)
+    limiter.release(limiter.acquire(), overloaded=True)
+    assert limiter.limit == limiter.min_concurrency == 1
+
+
+def test_limit_only_grows_while_it_is_reached():
+    limiter = AdaptiveLimiter(max_concurrency=4)
+    limiter.limit = 2.0
+    first, second = limiter.acquire(), limiter.acquire()
+    limiter.release(first)
+    assert limiter.limit == 2.5
+    limiter.release(second)
+    assert limiter.limit == 2.5
+
+
+def test_overload_statuses():
+    def response(status, history=()):
+        return SimpleNamespace(status_code=status, raw=SimpleNamespace(retries=SimpleNamespace(history=history)))
+
+    assert response_overloaded(response(429))
+    assert response_overloaded(response(503))
+    assert not response_overloaded(response(200))
+    assert not response_overloaded(response(404))
+    # A 503 urllib3 retried before succeeding still counts
+    assert response_overloaded(response(200, [SimpleNamespace(error=None, status=503)]))
+
+
+def test_requests_per_second_spaces_request_starts():
+    limiter = AdaptiveLimiter(requests_per_second=20)
+    started = time.monotonic()
+    for _ in range(5):
+        limiter.release(limiter.acquire())
+    assert time.monotonic() - started >= 0.19
+
+
+@pytest.mark.parametrize('hours, inside, outside', [
+    ('22:00-06:00', ['22:00', '23:59', '00:00', '05:59'], ['06:00', '12:00', '21:59']),
+    ('01:00-05:00', ['01:00', '04:59'], ['00:59', '05:00', '23:00']),
+])
+def test_quiet_hours_windows(hours, inside, outside):
+    window = QuietHours(hours)
+
+    def at(text):
+        return datetime.strptime(f'2024-03-01 {text}', '%Y-%m-%d %H:%M')
+
+    assert all(window.active(at(text)) for text in inside)
+    assert not any(window.active(at(text)) for text in outside)
+
+
+def test_quiet_hours_lower_both_caps(monkeypatch):
+    now = [datetime(2024, 3, 1, 23, 30)]
+    monkeypatch.setattr('throttle.datetime', SimpleNamespace(now=lambda: now[0]))
+    limiter = AdaptiveLimiter(max_concurrency=8, requests_per_second=50,
+                              quiet_hours=[QuietHours('22:00-06:00', max_concurrency=2, requests_per_second=5)])
+
+    assert limiter._caps() == (2, 5)
+    now[0] = datetime(2024, 3, 2, 6, 0)
+    assert limiter._caps() == (8, 50)
+
+
+def test_invalid_quiet_hours_are_rejected():
+    with pytest.raises(ValueError):
+        QuietHours('22:00-6pm')
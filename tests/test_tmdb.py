@@ -0,0 +1,127 @@
+"""
+TMDb enrichment and its cache against mock_tmdb
+"""
+
+import pytest
+
+import tmdb
+from mock_plex import TMDB_ID_OFFSET, synthetic_guids
+from mock_tmdb import MISSING_EVERY, MockTMDbServer
+
+DAY = 86400
+
+
+@pytest.fixture
+def tmdb_server():
+    with MockTMDbServer() as server:
+        yield server
+
+
+@pytest.fixture
+def make_enricher(tmdb_server, tmp_path):
+    caches = []
+
+    def make(**cache_options):
+        cache = tmdb.TMDbCache(tmp_path / 'tmdb_cache.db', **cache_options)
+        caches.append(cache)
+        return tmdb.TMDbEnricher(tmdb.TMDbClient(tmdb_server.api_key, tmdb_server.url), cache)
+
+    yield make
+    for cache in caches:
+        cache.close()
+
+
+def _guids(rating_keys):
+    return {rating_key: synthetic_guids(rating_key) for rating_key in rating_keys}
+
+
+def _clock(monkeypatch, start=1_700_000_000):
+    """Freeze tmdb's time.time; return a function that moves it forward"""
+    now = [start]
+    monkeypatch.setattr('tmdb.time.time', lambda: now[0])
+
+    def advance(seconds):
+        now[0] += seconds
+    return advance
+
+
+def test_external_ids_are_resolved_through_find(make_enricher, tmdb_server):
+    enrichment = make_enricher().enrich('movie', _guids(range(1, 31)))
+
+    # Every tenth item has only an IMDb id
+    assert tmdb_server.stats()['requests']['/3/find/{id}'] == 3
+    assert {rating_key: info['id'] for rating_key, info in enrichment.items()} == {
+        rating_key: TMDB_ID_OFFSET + rating_key for rating_key in range(1, 31)
+        if (TMDB_ID_OFFSET + rating_key) % MISSING_EVERY
+    }
+    assert tmdb.tmdb_reference(['com.plexapp.agents.imdb://tt0000010?lang=en']) == ('imdb', 'tt0000010')
+
+
+def test_second_run_is_served_from_the_cache(make_enricher, tmdb_server):
+    guids = _guids(range(1, 101))
+    first = make_enricher().enrich('movie', guids)
+    assert tmdb_server.stats()['total_requests'] == 110
+    tmdb_server.reset()
+
+    # A new process reading the same cache file
+    assert make_enricher().enrich('movie', guids) == first
+    assert tmdb_server.stats()['total_requests'] == 0
+
+
+def test_entries_expire_after_their_ttl(make_enricher, tmdb_server, monkeypatch):
+    advance = _clock(monkeypatch)
+    # Item 7 maps to an id TMDb doesn't know, which is cached as a miss
+    assert (TMDB_ID_OFFSET + 7) % MISSING_EVERY == 0
+    enricher = make_enricher(ttl=7 * DAY)
+    enricher.enrich('movie', _guids(range(1, 10)))
+    tmdb_server.reset()
+
+    advance(tmdb.NEGATIVE_TTL + 1)
+    enricher.enrich('movie', _guids(range(1, 10)))
+    assert tmdb_server.stats()['requests'] == {'/3/movie/{id}': 1}
+    tmdb_server.reset()
+
+    advance(7 * DAY)
+    enricher.enrich('movie', _guids(range(1, 10)))
+    assert tmdb_server.stats()['requests'] == {'/3/movie/{id}': 9}
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    advance = _clock(monkeypatch)
+    cache = tmdb.TMDbCache(tmp_path / 'tmdb_cache.db', max_entries=3)
+    for key in ('a', 'b', 'c', 'd'):
+        cache.put_many({key: {'id': key}})
+        advance(1)
+    cache.get_many(['a'])
+
+    assert cache.evict() == 1
+    assert set(cache.get_many(['a', 'b', 'c', 'd'])) == {'a', 'c', 'd'}
+    cache.close()
+
+
+def test_failed_lookups_raise(make_enricher, tmdb_server):
+    tmdb_server._httpd.api_key = 'revoked'
+    with pytest.raises(tmdb.TMDbError):
+        make_enricher().enrich('movie', _guids(range(1, 21)))
+
+
+def test_failed_lookups_leave_tmdb_collections_alone(plex, make_pmm, tmdb_server, tmp_path, monkeypatch):
+    monkeypatch.setenv('TMDB_API_KEY', tmdb_server.api_key)
+    settings = {'collections': {'movies': {'franchises': {'enabled': True}, 'popular': {'enabled': True}}}}
+
+    def tmdb_collections():
+        with plex.state.lock:
+            return {collection['title']: list(collection['items'])
+                    for collection in plex.state.collections.values()
+                    if 'Saga' in collection['title'] or collection['title'].startswith('Popular')}
+
+    first = make_pmm(tmdb={'base_url': tmdb_server.url}, **settings)
+    assert not first.create_collections()
+    before = tmdb_collections()
+    assert 'Popular Movies' in before and any('Saga' in title for title in before)
+
+    tmdb_server._httpd.api_key = 'revoked'
+    second = make_pmm(tmdb={'base_url': tmdb_server.url, 'cache_file': str(tmp_path / 'empty.db')},
+                      **settings)
+    second.create_collections()
+    assert tmdb_collections() == before
@@ -0,0 +1,134 @@
+"""
+Filesystem watcher: coalescing changes into folder scans
+"""
+
+import os
+import threading
+import time
+
+import pytest
+
+from watcher import ChangeCoalescer, LibraryWatcher, _PollingObserver
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Freeze watcher's monotonic clock; return a function that sets it"""
+    now = [1000.0]
+    monkeypatch.setattr('watcher.time.monotonic', lambda: now[0])
+
+    def at(seconds):
+        now[0] = 1000.0 + seconds
+        return now[0]
+    return at
+
+
+def test_paths_map_to_their_top_level_folder():
+    root = os.path.abspath('/media/movies')
+    coalescer = ChangeCoalescer([root])
+
+    assert coalescer.scan_folder(os.path.join(root, 'Film (2020)', 'Extras', 'a.mkv')) == \
+        (root, os.path.join(root, 'Film (2020)'))
+    assert coalescer.scan_folder(root) == (root, root)
+    assert coalescer.scan_folder(os.path.abspath('/media/movies2/Film/a.mkv')) is None
+    assert coalescer.scan_folder(os.path.abspath('/media/tv/Show/a.mkv')) is None
+
+
+def test_bursts_are_coalesced_after_the_debounce(clock):
+    movies, tv = os.path.abspath('/media/movies'), os.path.abspath('/media/tv')
+    coalescer = ChangeCoalescer([movies, tv], debounce=10, max_delay=300)
+
+    for seconds, path in ((0, 'Film (2020)/Film.mkv'), (5, 'Film (2020)/Film.srt'), (9, 'Other (1999)/a.mkv')):
+        clock(seconds)
+        coalescer.add(os.path.join(movies, path))
+    clock(9)
+    coalescer.add(os.path.join(tv, 'Show/Season 1/e1.mkv'))
+    coalescer.add('/elsewhere/file.mkv')
+
+    assert coalescer.pop_due(clock(18)) == {}
+    assert coalescer.pop_due(clock(19)) == {
+        movies: [os.path.join(movies, 'Film (2020)'), os.path.join(movies, 'Other (1999)')],
+        tv: [os.path.join(tv, 'Show')],
+    }
+    assert coalescer.pop_due(clock(100)) == {}
+
+
+def test_a_change_to_the_root_covers_its_folders(clock):
+    movies = os.path.abspath('/media/movies')
+    coalescer = ChangeCoalescer([movies], debounce=10)
+    coalescer.add(os.path.join(movies, 'Film (2020)/Film.mkv'))
+    coalescer.add(movies)
+    assert coalescer.pop_due(clock(10)) == {movies: [movies]}
+
+
+def test_continuous_changes_are_flushed_after_max_delay(clock):
+    movies = os.path.abspath('/media/movies')
+    coalescer = ChangeCoalescer([movies], debounce=10, max_delay=30)
+
+    due = {}
+    for seconds in range(0, 60, 5):
+        clock(seconds)
+        coalescer.add(os.path.join(movies, f'Film {seconds}/a.mkv'))
+        due = coalescer.pop_due()
+        if due:
+            break
+    # Events never went quiet for 10s, but the first one is 30s old
+    assert seconds == 30
+    assert len(due[movies]) == 7
+    assert coalescer.pop_due(clock(35)) == {}
+
+
+def _age(*paths):
+    """Backdate directory mtimes so any later change is visible at 1s resolution"""
+    old = time.time() - 3600
+    for path in paths:
+        os.utime(path, (old, old))
+
+
+def test_polling_reports_changed_folders(tmp_path, clock):
+    root = tmp_path / 'movies'
+    (root / 'Film').mkdir(parents=True)
+    (root / 'Quiet').mkdir()
+    _age(root, root / 'Film', root / 'Quiet')
+    coalescer = ChangeCoalescer([str(root)], debounce=0)
+    observer = _PollingObserver([str(root)], coalescer, interval=60)
+    observer._poll()
+    assert coalescer.pop_due() == {}
+
+    # A file inside a folder bumps that folder; a new folder tree is reported
+    # as its top folder, not as a change to the root that now contains it
+    (root / 'Film' / 'Film.srt').write_text('')
+    (root / 'New' / 'Extras').mkdir(parents=True)
+    observer._poll()
+    assert coalescer.pop_due() == {str(root): [str(root / 'Film'), str(root / 'New')]}
+
+    # A loose file only changes the root's own mtime
+    _age(root)
+    observer._poll()
+    (root / 'loose.mkv').write_text('')
+    observer._poll()
+    assert coalescer.pop_due() == {str(root): [str(root)]}
+
+
+def test_polling_watcher_calls_back_with_coalesced_folders(tmp_path):
+    root = tmp_path / 'movies'
+    (root / 'Film').mkdir(parents=True)
+    _age(root, root / 'Film')
+    changes = []
+    called = threading.Event()
+
+    def on_changes(changed_root, folders):
+        changes.append((changed_root, folders))
+        called.set()
+
+    watcher = LibraryWatcher([str(root), str(tmp_path / 'missing')], on_changes, debounce=0.1,
+                             poll_interval=0.1, use_polling=True).start()
+    try:
+        time.sleep(0.3)
+        (root / 'Film' / 'Film.mkv').write_text('')
+        (root / 'Film' / 'Film.srt').write_text('')
+        assert called.wait(5)
+    finally:
+        watcher.stop()
+    assert watcher.backend == 'polling' and watcher.roots == [str(root)]
+    assert changes == [(str(root), [str(root / 'Film')])]
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+PMM Request Throttle
+Adaptive (AIMD) concurrency limit, optional requests-per-second cap and
+quiet-hours profiles for the requests PMM sends to Plex
+"""
+
+import logging
+import re
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Statuses that mean Plex is overloaded rather than that the request was bad
+OVERLOAD_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+# Waiters re-check the limit this often so quiet hours take effect promptly
+RECHECK_SECONDS = 1.0
+
+
+def _minutes(text):
+    match = re.fullmatch(r'(\d{1,2}):(\d{2})', str(text).strip())
+    if not match or int(match[1]) > 24 or int(match[2]) > 59:
+        raise ValueError(f"invalid time '{text}', expected HH:MM")
+    return int(match[1]) * 60 + int(match[2])
+
+
+class QuietHours:
+    """A daily window (``HH:MM-HH:MM``, may wrap past midnight) with tighter limits"""
+
+    def __init__(self, hours, max_concurrency=None, requests_per_second=None):
+        start, _, end = str(hours).partition('-')
+        self.hours = hours
+        self.start = _minutes(start)
+        self.end = _minutes(end)
+        self.max_concurrency = max(1, int(max_concurrency)) if max_concurrency else None
+        self.requests_per_second = float(requests_per_second) if requests_per_second else None
+
+    def active(self, when):
+        minute = when.hour * 60 + when.minute
+        if self.start <= self.end:
+            return self.start <= minute < self.end
+        return minute >= self.start or minute < self.end
+
+
+class AdaptiveLimiter:
+    """Bound in-flight Plex requests, adapting the bound to how Plex copes
+
+    While the limit is fully used, it grows by about one for every
+    ``limit`` requests answered within ``target_latency`` seconds
+    (additive increase). It is multiplied by ``backoff`` when a request is
+    slow, fails or is answered with a 429/5xx (multiplicative decrease),
+    at most once per ``target_latency`` so a burst of failures from
+    requests already in flight counts once. ``requests_per_second`` additionally spaces
+    request starts; a matching quiet-hours profile lowers both caps.
+    """
+
+    def __init__(self, max_concurrency=8, min_concurrency=1, target_latency=1.0, backoff=0.5,
+                 requests_per_second=None, quiet_hours=(), metrics=None):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.min_concurrency = min(self.max_concurrency, max(1, int(min_concurrency)))
+        self.target_latency = float(target_latency)
+        self.backoff = min(max(float(backoff), 0.1), 0.9)
+        self.requests_per_second = float(requests_per_second) if requests_per_second else None
+        self.quiet_hours = list(quiet_hours)
+        self.metrics = metrics
+
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self._condition = threading.Condition()
+        self._next_start = 0.0
+        self._last_decrease = 0.0
+        self._profile = None
+        self._set_gauge()
+
+    def _active_profile(self):
+        if not self.quiet_hours:
+            return None
+        now = datetime.now()
+        profile = next((profile for profile in self.quiet_hours if profile.active(now)), None)
+        if profile is not self._profile:
+            logger.info(f"Plex request limits: {'quiet hours ' + profile.hours if profile else 'normal'}")
+            self._profile = profile
+        return profile
+
+    def _caps(self):
+        """(concurrency, requests per second) allowed right now"""
+        profile = self._active_profile()
+        concurrency = max(1, int(self.limit))
+        rate = self.requests_per_second
+        if profile:
+            if profile.max_concurrency:
+                concurrency = min(concurrency, profile.max_concurrency)
+            if profile.requests_per_second:
+                rate = min(rate, profile.requests_per_second) if rate else profile.requests_per_second
+        return concurrency, rate
+
+    def acquire(self):
+        """Wait for a request slot; return a token to pass to release()"""
+        with self._condition:
+            while True:
+                concurrency, rate = self._caps()
+                if self.in_flight < concurrency:
+                    break
+                self._condition.wait(RECHECK_SECONDS)
+            self.in_flight += 1
+
+            delay = 0.0
+            if rate:
+                now = time.monotonic()
+                start = max(now, self._next_start)
+                self._next_start = start + 1 / rate
+                delay = start - now
+        if delay > 0:
+            time.sleep(delay)
+        return time.monotonic()
+
+    def release(self, token, overloaded=False):
+        """Finish a request started with acquire() and adapt the limit"""
+        now = time.monotonic()
+        latency = now - token
+        with self._condition:
+            self.in_flight -= 1
+            if overloaded or latency > self.target_latency:
+                if now - self._last_decrease >= self.target_latency:
+                    self._last_decrease = now
+                    self.limit = max(float(self.min_concurrency), self.limit * self.backoff)
+                    if self.metrics is not None:
+                        self.metrics.inc('pmm_plex_throttled_total', reason='overload' if overloaded else 'latency')
+                    logger.debug(f"Plex {'overloaded' if overloaded else f'slow ({latency:.2f}s)'}, "
+                                 f"concurrency limit now {int(self.limit)}")
+                    self._set_gauge()
+            elif self.limit < self.max_concurrency and self.in_flight + 1 >= int(self.limit):
+                # Only a limit that is actually reached has shown it is safe to raise
+                before = int(self.limit)
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+                if int(self.limit) != before:
+                    self._set_gauge()
+            self._condition.notify_all()
+
+    def _set_gauge(self):
+        if self.metrics is not None:
+            self.metrics.set('pmm_plex_concurrency_limit', int(self.limit))
+
+
+def response_overloaded(response):
+    """Whether a response, or a retry urllib3 made on the way to it, signals overload"""
+    if response.status_code in OVERLOAD_STATUSES:
+        return True
+    retries = getattr(response.raw, 'retries', None)
+    return any(attempt.error is not None or attempt.status in OVERLOAD_STATUSES
+               for attempt in getattr(retries, 'history', ()))
+
+
+def limiter_from_config(config, max_concurrency=8, metrics=None):
+    """Build a limiter from ``advanced.throttle``, or None when throttling is disabled
+
+    ``max_concurrency`` is the default ceiling, normally the connection pool size.
+    """
+    throttle = (config or {}).get('advanced', {}).get('throttle') or {}
+    if not throttle.get('enabled', True):
+        return None
+    return AdaptiveLimiter(
+        max_concurrency=int(throttle.get('max_concurrency') or max_concurrency),
+        min_concurrency=int(throttle.get('min_concurrency', 1)),
+        target_latency=float(throttle.get('target_latency_ms', 1000)) / 1000,
+        backoff=float(throttle.get('backoff', 0.5)),
+        requests_per_second=throttle.get('requests_per_second') or None,
+        quiet_hours=[QuietHours(**profile) for profile in throttle.get('quiet_hours') or []],
+        metrics=metrics,
+    )
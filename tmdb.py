@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+PMM TMDb Enrichment
+Map library items to TMDb through their Plex agent GUIDs and fetch
+franchise, keyword and popularity data, keeping every lookup in an
+on-disk cache so repeat runs only ask TMDb about new or expired entries
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from plex_session import create_session
+
+logger = logging.getLogger(__name__)
+
+TMDB_URL = 'https://api.themoviedb.org/3'
+
+# TMDb media kind for each Plex library type
+KINDS = {'movie': 'movie', 'show': 'tv'}
+
+# Legacy Plex agents and the id source their GUIDs carry
+LEGACY_AGENTS = {
+    'com.plexapp.agents.themoviedb': 'tmdb',
+    'com.plexapp.agents.imdb': 'imdb',
+    'com.plexapp.agents.thetvdb': 'tvdb',
+}
+
+# Lookups that found nothing are retried after at most this long
+NEGATIVE_TTL = 86400
+
+# Fetched entries are written to the cache in batches of this size
+WRITE_BATCH = 500
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    data TEXT,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at);
+"""
+
+
+class TMDbError(RuntimeError):
+    """Raised when TMDb lookups fail, so partial data isn't used for collections"""
+
+
+def tmdb_reference(guids):
+    """Pick the best id from Plex agent GUIDs: ('tmdb', id), else ('imdb', id) or ('tvdb', id)"""
+    found = {}
+    for guid in guids:
+        scheme, _, rest = guid.partition('://')
+        source = LEGACY_AGENTS.get(scheme, scheme)
+        value = rest.split('?', 1)[0]
+        if value and source in ('tmdb', 'imdb', 'tvdb'):
+            found.setdefault(source, value)
+    for source in ('tmdb', 'imdb', 'tvdb'):
+        if source in found:
+            return source, found[source]
+    return None
+
+
+class TMDbCache:
+    """SQLite cache of TMDb lookups with a TTL and least-recently-used eviction
+
+    Values are JSON; None records a lookup that found nothing, which
+    expires after NEGATIVE_TTL so items added to TMDb later are picked up.
+    """
+
+    def __init__(self, path, ttl=30 * 86400, max_entries=100_000):
+        self.path = str(path)
+        self.ttl = float(ttl)
+        self.max_entries = int(max_entries)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Servers managed by one process share the file
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.executescript(CACHE_SCHEMA)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get_many(self, keys):
+        """Return {key: value} for the keys with an unexpired entry, marking them used"""
+        keys = list(keys)
+        now = time.time()
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), WRITE_BATCH):
+                batch = keys[start:start + WRITE_BATCH]
+                cursor = self._conn.execute(
+                    f"SELECT key, data, fetched_at FROM entries WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                )
+                for key, data, fetched_at in cursor:
+                    ttl = self.ttl if data is not None else min(self.ttl, NEGATIVE_TTL)
+                    if now - fetched_at < ttl:
+                        found[key] = json.loads(data) if data is not None else None
+            with self._conn:
+                self._conn.executemany("UPDATE entries SET accessed_at = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+        return found
+
+    def put_many(self, entries):
+        """Store {key: value} entries as freshly fetched"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                [(key, json.dumps(value) if value is not None else None, now, now)
+                 for key, value in entries.items()],
+            )
+
+    def evict(self):
+        """Drop expired entries, then the least recently used beyond max_entries; return the count"""
+        now = time.time()
+        with self._lock, self._conn:
+            removed = self._conn.execute(
+                "DELETE FROM entries WHERE fetched_at < ? OR (data IS NULL AND fetched_at < ?)",
+                (now - self.ttl, now - min(self.ttl, NEGATIVE_TTL)),
+            ).rowcount
+            excess = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+            if excess > 0:
+                removed += self._conn.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed_at LIMIT ?)",
+                    (excess,),
+                ).rowcount
+        return removed
+
+
+class TMDbClient:
+    """Minimal TMDb v3 client over a pooled, retrying session
+
+    ``api_key`` may be a v3 API key or a v4 read access token.
+    """
+
+    def __init__(self, api_key, base_url=TMDB_URL, language=None, pool_size=4, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.language = language
+        self.session = create_session(pool_size=pool_size, timeout=timeout)
+        if api_key.startswith('eyJ'):
+            self.session.headers['Authorization'] = f'Bearer {api_key}'
+            self.params = {}
+        else:
+            self.params = {'api_key': api_key}
+
+    def get(self, path, **params):
+        """GET a TMDb path; return the decoded JSON, or None for 404"""
+        response = self.session.get(f'{self.base_url}{path}', params=dict(self.params, **params))
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def details(self, kind, tmdb_id):
+        """Return the fields PMM uses for a movie or show, or None if TMDb doesn't know it"""
+        params = {'append_to_response': 'keywords'}
+        if self.language:
+            params['language'] = self.language
+        data = self.get(f'/{kind}/{tmdb_id}', **params)
+        if data is None:
+            return None
+        keywords = data.get('keywords') or {}
+        return {
+            'id': data['id'],
+            'franchise': (data.get('belongs_to_collection') or {}).get('name'),
+            'keywords': [keyword['name'] for keyword in keywords.get('keywords', keywords.get('results', []))],
+            'popularity': data.get('popularity'),
+        }
+
+    def find(self, kind, source, external_id):
+        """Return the TMDb id for an IMDb/TVDB id, or None"""
+        data = self.get(f'/find/{external_id}', external_source=f'{source}_id') or {}
+        results = data.get(f'{kind}_results') or []
+        return results[0]['id'] if results else None
+
+
+class TMDbEnricher:
+    """Resolve library items to cached TMDb details, fetching what is missing
+
+    At most ``concurrency`` requests are in flight, shared by libraries
+    enriched at the same time.
+    """
+
+    def __init__(self, client, cache, concurrency=4, metrics=None):
+        self.client = client
+        self.cache = cache
+        self.concurrency = max(1, int(concurrency))
+        self.metrics = metrics
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+
+    def enrich(self, library_type, guids_by_key):
+        """Return {ratingKey: TMDb details} for items with a TMDb match
+
+        ``guids_by_key`` maps ratingKeys to Plex agent GUIDs. Raises
+        TMDbError if any lookup failed, since collections built from
+        partial data would drop members.
+        """
+        kind = KINDS.get(library_type)
+        if kind is None:
+            return {}
+
+        references = {}
+        for rating_key, guids in guids_by_key.items():
+            reference = tmdb_reference(guids)
+            if reference is not None:
+                references[rating_key] = reference
+
+        # IMDb/TVDB ids first need TMDb's /find
+        lookups = {f'find/{kind}/{source}/{value}': (source, value)
+                   for source, value in references.values() if source != 'tmdb'}
+        found = self._cached(lookups, lambda lookup: self.client.find(kind, *lookup))
+
+        tmdb_ids = {}
+        for rating_key, (source, value) in references.items():
+            tmdb_id = int(value) if source == 'tmdb' else found.get(f'find/{kind}/{source}/{value}')
+            if tmdb_id:
+                tmdb_ids[rating_key] = int(tmdb_id)
+
+        details = self._cached({f'{kind}/{tmdb_id}': tmdb_id for tmdb_id in set(tmdb_ids.values())},
+                               lambda tmdb_id: self.client.details(kind, tmdb_id))
+        evicted = self.cache.evict()
+        if evicted:
+            logger.debug(f"Evicted {evicted} TMDb cache entries")
+
+        enrichment = {}
+        for rating_key, tmdb_id in tmdb_ids.items():
+            info = details.get(f'{kind}/{tmdb_id}')
+            if info is not None:
+                enrichment[rating_key] = info
+        return enrichment
+
+    def _cached(self, lookups, fetch):
+        """Resolve {cache key: argument} from the cache, calling fetch(argument) for misses"""
+        results = self.cache.get_many(lookups)
+        missing = [key for key in lookups if key not in results]
+        self._count(len(results), 'cached')
+        if not missing:
+            return results
+
+        logger.info(f"Fetching {len(missing)} TMDb entries ({len(results)} cached)")
+        def fetch_one(argument):
+            with self._slots:
+                return fetch(argument)
+
+        fetched = {}
+        failures = 0
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(missing))) as pool:
+            futures = {pool.submit(fetch_one, lookups[key]): key for key in missing}
+            for future in as_completed(futures):
+                try:
+                    fetched[futures[future]] = future.result()
+                except Exception as e:
+                    failures += 1
+                    logger.debug(f"TMDb lookup {futures[future]} failed: {e}")
+                    continue
+                if len(fetched) >= WRITE_BATCH:
+                    # Keep progress if the run is interrupted
+                    self.cache.put_many(fetched)
+                    results.update(fetched)
+                    fetched = {}
+        self.cache.put_many(fetched)
+        results.update(fetched)
+
+        self._count(len(missing) - failures, 'fetched')
+        if failures:
+            self._count(failures, 'failed')
+            raise TMDbError(f"{failures} of {len(missing)} TMDb lookups failed")
+        return results
+
+    def _count(self, value, result):
+        if self.metrics is not None and value:
+            self.metrics.inc('pmm_tmdb_lookups_total', value, result=result)
+
+
+def enricher_from_config(config, api_key, config_path='config', metrics=None):
+    """Build a TMDbEnricher from the ``tmdb`` section, or None without an API key"""
+    if not api_key or api_key == 'your_tmdb_api_key_here':
+        logger.warning("TMDb rules are enabled but TMDB_API_KEY is not set; skipping them")
+        return None
+    settings = (config or {}).get('tmdb') or {}
+    concurrency = max(1, int(settings.get('concurrency', 4)))
+    client = TMDbClient(api_key, settings.get('base_url', TMDB_URL), settings.get('language'),
+                        pool_size=concurrency, timeout=int(settings.get('timeout', 30)))
+    cache = TMDbCache(
+        settings.get('cache_file') or os.path.join(config_path, 'tmdb_cache.db'),
+        ttl=float(settings.get('cache_ttl_days', 30)) * 86400,
+        max_entries=int(settings.get('cache_max_entries', 100_000)),
+    )
+    return TMDbEnricher(client, cache, concurrency, metrics)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+PMM Library Watcher
+Watch library root folders and report bursts of changes as the set of
+top-level media folders that need a Plex partial scan
+"""
+
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+try:
+    # watchdog uses inotify on Linux and ReadDirectoryChangesW on Windows
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+
+def _normalize(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+class ChangeCoalescer:
+    """Collect changed paths and hand them out in bursts after a quiet period
+
+    Each path is reduced to the top-level folder below its library root
+    (``/movies/Film (2020)/Film.mkv`` becomes ``/movies/Film (2020)``), so a
+    burst of file events for one release turns into a single scan.
+    """
+
+    def __init__(self, roots, debounce=10.0, max_delay=300.0):
+        self.roots = {_normalize(root): root for root in roots}
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._first_event = None
+        self._last_event = None
+
+    def scan_folder(self, path):
+        """Return (root, folder to scan) for a changed path, or None if outside all roots"""
+        normalized = _normalize(path)
+        for key, root in self.roots.items():
+            try:
+                if os.path.commonpath([key, normalized]) != key:
+                    continue
+            except ValueError:
+                continue
+            relative = os.path.relpath(normalized, key)
+            if relative == '.':
+                return root, root
+            return root, os.path.join(root, relative.split(os.sep, 1)[0])
+        return None
+
+    def add(self, path):
+        target = self.scan_folder(path)
+        if target is None:
+            return
+        root, folder = target
+        now = time.monotonic()
+        with self._lock:
+            self._pending.setdefault(root, set()).add(folder)
+            self._first_event = self._first_event or now
+            self._last_event = now
+
+    def pop_due(self, now=None):
+        """Return {root: sorted folders} once events have gone quiet, else {}"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if not self._pending:
+                return {}
+            quiet = now - self._last_event >= self.debounce
+            overdue = now - self._first_event >= self.max_delay
+            if not (quiet or overdue):
+                return {}
+            pending, self._pending = self._pending, {}
+            self._first_event = self._last_event = None
+
+        due = {}
+        for root, folders in pending.items():
+            # A scan of the root covers every folder below it
+            due[root] = [root] if root in folders else sorted(folders)
+        return due
+
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, coalescer):
+        super().__init__()
+        self.coalescer = coalescer
+
+    def on_any_event(self, event):
+        # A directory's own "modified" event just echoes a change inside it,
+        # which arrives as a separate event for the child path
+        if event.is_directory and event.event_type == 'modified':
+            return
+        self.coalescer.add(event.src_path)
+        dest_path = getattr(event, 'dest_path', None)
+        if dest_path:
+            self.coalescer.add(dest_path)
+
+
+class _PollingObserver:
+    """Fallback observer comparing directory mtimes between periodic walks
+
+    Adding, removing or renaming a file bumps its directory's mtime, which
+    is all a library scan cares about, and only directories are stat'ed.
+    """
+
+    def __init__(self, roots, coalescer, interval):
+        self.roots = roots
+        self.coalescer = coalescer
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._state = {}
+
+    def _walk(self, root):
+        mtimes = {}
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+            except OSError:
+                continue
+        return mtimes
+
+    def _poll(self):
+        for root in self.roots:
+            current = self._walk(root)
+            previous = self._state.get(root)
+            self._state[root] = current
+            if previous is None:
+                continue
+            # New/removed folders are reported themselves; their parent's mtime
+            # bump only matters if nothing else explains it (loose files)
+            appeared = current.keys() ^ previous.keys()
+            parents = {os.path.dirname(path) for path in appeared}
+            for path in appeared:
+                self.coalescer.add(path)
+            for path in current.keys() & previous.keys():
+                if current[path] != previous[path] and path not in parents:
+                    self.coalescer.add(path)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._poll()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='pmm-watch-poll', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        if self._thread:
+            self._thread.join(timeout)
+
+
+class LibraryWatcher:
+    """Watch library roots and call on_changes(root, folders) for each coalesced burst"""
+
+    def __init__(self, roots, on_changes, debounce=10.0, max_delay=300.0,
+                 poll_interval=60.0, use_polling=False):
+        self.roots = [root for root in roots if os.path.isdir(root)]
+        missing = set(roots) - set(self.roots)
+        if missing:
+            logger.warning(f"Not watching missing library paths: {', '.join(sorted(missing))}")
+        self.on_changes = on_changes
+        self.coalescer = ChangeCoalescer(self.roots, debounce, max_delay)
+        self._stop = threading.Event()
+        self._dispatcher = None
+
+        if Observer is not None and not use_polling:
+            self.backend = 'native'
+            self._observer = Observer()
+            handler = _EventHandler(self.coalescer)
+            for root in self.roots:
+                self._observer.schedule(handler, root, recursive=True)
+        else:
+            self.backend = 'polling'
+            self._observer = _PollingObserver(self.roots, self.coalescer, poll_interval)
+
+    def _dispatch(self):
+        while not self._stop.wait(1.0):
+            for root, folders in self.coalescer.pop_due().items():
+                try:
+                    self.on_changes(root, folders)
+                except Exception as e:
+                    logger.error(f"Error handling changes under {root}: {e}")
+
+    def start(self):
+        logger.info(f"Watching {len(self.roots)} library paths ({self.backend})")
+        self._observer.start()
+        self._dispatcher = threading.Thread(target=self._dispatch, name='pmm-watch-dispatch', daemon=True)
+        self._dispatcher.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._observer.stop()
+        self._observer.join(timeout=5)
+        if self._dispatcher:
+            self._dispatcher.join(timeout=5)